@@ -1,112 +1,101 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify
 import psycopg2
-import random
+import logging
 from datetime import datetime, timedelta
 import os
 
-# --- Configuration ---
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-STATIC_FOLDER = os.path.join(BASE_DIR, '../public')
+import archive
+import assets
+import bingo
+import cards
+import concurrency
+import db
+import events
+import fanout
+import leaderboard as leaderboards
+import lobby
+import metrics
+import migrations
+import payments
+import scheduler
+import wallet
+from db import get_db_connection
+from draws import MAX_DRAWS, called_numbers, draw_next_number, new_seed
+from settlement import settle_game
 
+# --- Configuration ---
 TOKEN = os.environ.get('TOKEN')  # Fallback to hardcoded value
 WEB_APP_URL = os.environ.get('WEB_APP_URL')
 ADMIN_IDS = [int(x) for x in os.environ.get('ADMIN_IDS').split(',')]
-DATABASE_URL = os.environ.get('DATABASE_URL')
-
-app = Flask(__name__, static_folder=STATIC_FOLDER, static_url_path='')
-
-# --- Static File Serving ---
-@app.route('/')
-def serve_index():
-    print(f"Serving index.html from {os.path.join(STATIC_FOLDER, 'index.html')}")
-    return send_from_directory(app.static_folder, 'index.html')
 
-
-@app.route('/<path:path>')
-def serve_static(path):
-    print(f"Serving {path} from {os.path.join(STATIC_FOLDER, path)}")
-    return send_from_directory(app.static_folder, path)
-
-@app.route('/favicon.ico')
-def serve_favicon():
-    return send_from_directory(app.static_folder, 'favicon.ico')
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s %(message)s')
+logger = logging.getLogger(__name__)
+
+# Static files are served by assets.py, not by Flask's static route.
+app = Flask(__name__, static_folder=None)
+db.init_app(app)
+
+
+@app.before_request
+def start_background_work():
+    # Started by the first API request rather than at import, so forking servers start them
+    # per worker. Static files need none of it: a cold instance serving /style.css does not
+    # touch the database.
+    if request.endpoint in assets.ENDPOINTS:
+        return
+    migrations.ensure_schema()
+    if scheduler.SCHEDULER_ENABLED:
+        scheduler.scheduler.start()
+    if events.NOTIFY_ENABLED:
+        fanout.listener.start()
+
+
+assets.init_app(app)
+events.init_app(app)
+scheduler.init_app(app)
+leaderboards.init_app(app)
+archive.init_app(app)
+lobby.init_app(app)
+payments.init_app(app)
+metrics.init_app(app)
 
 # Constants
 INSUFFICIENT_WALLET = "Insufficient wallet"
-SELECT_WALLET_QUERY = "SELECT wallet FROM users WHERE user_id = ?"
-UPDATE_WALLET_DEBIT_QUERY = "UPDATE users SET wallet = wallet - ? WHERE user_id = ?"
-SELECT_CARD_NUMBERS_QUERY = "SELECT card_numbers FROM player_cards WHERE game_id = ? AND user_id = ?"
-SELECT_ROLE_QUERY = "SELECT role FROM users WHERE user_id = ?"
-UPDATE_ROLE_QUERY = "UPDATE users SET role = 'admin' WHERE user_id = ? AND role != 'admin'"
-
-def get_db_connection():
-    return psycopg2.connect(DATABASE_URL)
-
-def init_db():
-    with get_db_connection() as conn:
+GAME_FULL = "Game is full"
+SELECT_CARD_NUMBERS_QUERY = "SELECT card_numbers FROM player_cards WHERE game_id = %s AND user_id = %s"
+COUNT_PLAYERS_QUERY = "SELECT COUNT(*) FROM game_players WHERE game_id = %s"
+INSERT_PLAYER_QUERY = "INSERT INTO game_players (game_id, user_id) VALUES (%s, %s) ON CONFLICT DO NOTHING"
+SELECT_ROLE_QUERY = "SELECT role FROM users WHERE user_id = %s"
+SELECT_USER_PROFILE_COLUMNS = "u.wallet, u.score, (SELECT COUNT(*) FROM referrals WHERE referrer_id = u.user_id AND bonus_credited), u.role, u.invalid_bingo_count, u.username"
+SELECT_USER_PROFILE_QUERY = f"SELECT {SELECT_USER_PROFILE_COLUMNS} FROM users u WHERE u.user_id = %s"
+UPDATE_ROLE_QUERY = "UPDATE users SET role = 'admin' WHERE user_id = %s AND role != 'admin'"
+LOCK_WAITING_GAME_QUERY = "SELECT bet_amount FROM games WHERE game_id = %s AND status = 'waiting' FOR UPDATE"
+AUTO_START_QUERY = "UPDATE games SET status = 'started', start_time = %s, last_updated = %s, prize_amount = %s, draw_seed = %s WHERE game_id = %s AND status = 'waiting'"
+# Seeded games rebuild their called numbers from (draw_seed, draw_cursor) without reading game_draws.
+SELECT_CALLED_QUERY = '''SELECT status, next_draw_at, draw_seed, draw_cursor,
+                                CASE WHEN draw_seed IS NULL THEN ARRAY(SELECT number FROM game_draws WHERE game_id = g.game_id ORDER BY seq) END
+                         FROM games g WHERE game_id = %s'''
+LOCK_CLAIM_GAME_QUERY = "SELECT status, winner_id, prize_amount FROM games WHERE game_id = %s FOR UPDATE"
+SELECT_MARKS_QUERY = "SELECT card_id, mark_mask FROM player_cards WHERE game_id = %s AND user_id = %s ORDER BY card_id"
+INVALID_BINGO_QUERY = "UPDATE users SET invalid_bingo_count = invalid_bingo_count + 1 WHERE user_id = %s"
+SELECT_CLAIM_PLAYER_QUERY = '''SELECT p.winner, u.username FROM game_players p LEFT JOIN users u ON u.user_id = %s
+                               WHERE p.game_id = %s AND p.user_id = %s'''
+NOT_STARTED_CLAIM = {'message': 'Game already has a winner or not started', 'won': False}
+NO_CARD_CLAIM = {'message': 'Card not found', 'won': False}
+NO_BINGO_CLAIM = {'message': '❌ No Bingo yet! Your card is marked automatically as numbers are called.', 'won': False}
+
+@metrics.registry.collector
+def game_gauges():
+    with db.connection() as conn:
         cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            phone TEXT,
-            username TEXT UNIQUE,
-            name TEXT,
-            wallet INTEGER DEFAULT 10,
-            score INTEGER DEFAULT 0,
-            referral_code TEXT UNIQUE,
-            referred_by TEXT,
-            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            role TEXT DEFAULT 'user',
-            invalid_bingo_count INTEGER DEFAULT 0
-        )''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS referrals (
-            referral_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            referrer_id INTEGER,
-            referee_id INTEGER,
-            bonus_credited BOOLEAN DEFAULT FALSE,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS transactions (
-            tx_id TEXT PRIMARY KEY,
-            user_id INTEGER,
-            amount INTEGER,
-            method TEXT,
-            status TEXT DEFAULT 'pending',
-            verification_code TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS games (
-            game_id TEXT PRIMARY KEY,
-            players TEXT DEFAULT '',  -- Comma-separated list of user_ids
-            selected_numbers TEXT DEFAULT '',  -- Comma-separated list of selected numbers
-            status TEXT DEFAULT 'waiting',
-            start_time TIMESTAMP,
-            end_time TIMESTAMP,
-            numbers_called TEXT DEFAULT '',
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            prize_amount INTEGER DEFAULT 0,
-            winner_id INTEGER DEFAULT NULL,
-            bet_amount INTEGER DEFAULT 0,
-            countdown_start TIMESTAMP
-        )''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS player_cards (
-            card_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            game_id TEXT,
-            user_id INTEGER,
-            card_numbers TEXT,  -- Comma-separated 25 numbers
-            FOREIGN KEY (game_id) REFERENCES games(game_id)
-        )''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS withdrawals (
-            withdraw_id TEXT PRIMARY KEY,
-            user_id INTEGER,
-            amount INTEGER,
-            status TEXT DEFAULT 'pending',
-            request_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            method TEXT,
-            admin_note TEXT
-        )''')
-        conn.commit()
+        cursor.execute("SELECT status, COUNT(*) FROM games WHERE status IN ('waiting', 'started') GROUP BY status")
+        counts = dict(cursor.fetchall())
+    return [(f'bingo_games_{status}', f'Games currently {status}.', counts.get(status, 0)) for status in ('waiting', 'started')]
 
-init_db()
+@app.route('/api/pool_stats', methods=['GET'])
+def pool_stats():
+    return jsonify(db.pool.stats())
 
 @app.route('/api/register_user', methods=['POST'])
 def register_user():
@@ -117,43 +106,65 @@ def register_user():
     referral_code = request.json.get('referral_code')
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
+    cursor.execute("SELECT username FROM users WHERE username = %s", (username,))
     if cursor.fetchone():
-        conn.close()
         return jsonify({'status': 'failed', 'reason': 'Username already taken'}), 400
-    cursor.execute("INSERT INTO users (user_id, phone, username, name, referral_code) VALUES (?, ?, ?, ?, ?)",
+    cursor.execute("INSERT INTO users (user_id, phone, username, name, referral_code) VALUES (%s, %s, %s, %s, %s)",
                    (user_id, phone, username, name, f"REF{user_id}{int(datetime.now().timestamp())}"))
     if referral_code:
-        cursor.execute("SELECT user_id FROM users WHERE referral_code = ?", (referral_code,))
+        cursor.execute("SELECT user_id FROM users WHERE referral_code = %s", (referral_code,))
         referrer = cursor.fetchone()
         if referrer:
-            cursor.execute("INSERT INTO referrals (referrer_id, referee_id) VALUES (?, ?)", (referrer[0], user_id))
-            cursor.execute("UPDATE users SET wallet = wallet + 10 WHERE user_id = ?", (referrer[0],))
+            cursor.execute("INSERT INTO referrals (referrer_id, referee_id) VALUES (%s, %s)", (referrer[0], user_id))
+            wallet.credit(cursor, referrer[0], 10, 'referral_signup', str(user_id))
     conn.commit()
-    conn.close()
     return jsonify({'status': 'registered', 'wallet': 10, 'username': username})
 
+def user_profile(row):
+    balance, wins, successful_referrals, role, invalid_count, username = row
+    return {
+        'wallet': balance,
+        'wins': wins or 0,
+        'successful_referrals': successful_referrals or 0,
+        'role': role or 'user',
+        'is_admin' : role =='admin',
+        'invalid_bingo_count': invalid_count or 0,
+        'username': username
+    }
+
 @app.route('/api/user_data', methods=['GET'])
 def user_data():
     user_id = request.args.get('user_id')
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT wallet, score, (SELECT COUNT(*) FROM referrals WHERE referrer_id = ? AND bonus_credited), role, invalid_bingo_count, username FROM users WHERE user_id = ?", (user_id, user_id))
+    cursor.execute(SELECT_USER_PROFILE_QUERY, (user_id,))
     data = cursor.fetchone()
-    conn.close()
     if data:
-        wallet, wins, successful_referrals, role, invalid_count, username = data
-        return jsonify({
-            'wallet': wallet,
-            'wins': wins or 0,
-            'successful_referrals': successful_referrals or 0,
-            'role': role or 'user',
-            'is_admin' : role =='admin',
-            'invalid_bingo_count': invalid_count or 0,
-            'username': username
-        })
+        return jsonify(user_profile(data))
     return jsonify({'error': 'User not found'}), 404
 
+@app.route('/api/bootstrap', methods=['GET'])
+def bootstrap():
+    # Everything the web app needs on load, from one connection and (with a warm
+    # leaderboard cache) one query.
+    user_id = request.args.get('user_id')
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f'''SELECT {SELECT_USER_PROFILE_COLUMNS}, ag.game_id, ag.status, ag.bet_amount
+                       FROM users u LEFT JOIN LATERAL (
+                           SELECT g.game_id, g.status, g.bet_amount FROM game_players p JOIN games g ON g.game_id = p.game_id
+                           WHERE p.user_id = u.user_id AND g.status IN ('waiting', 'started')
+                           ORDER BY p.joined_at DESC LIMIT 1) ag ON TRUE
+                       WHERE u.user_id = %s''', (user_id,))
+    data = cursor.fetchone()
+    if not data:
+        return jsonify({'error': 'User not found'}), 404
+    profile = user_profile(data[:6])
+    game_id, status, bet_amount = data[6:]
+    profile['active_game'] = {'game_id': game_id, 'status': status, 'bet_amount': bet_amount} if game_id else None
+    profile['leaderboard'] = leaderboards.head(cursor)
+    return jsonify(profile)
+
 @app.route('/api/add_admin', methods=['POST'])
 def add_admin():
     user_id = request.json.get('user_id')  # Admin performing the action
@@ -163,15 +174,12 @@ def add_admin():
     cursor.execute(SELECT_ROLE_QUERY, (user_id,))
     role = cursor.fetchone()
     if not role or role[0] != 'admin':
-        conn.close()
         return jsonify({'status': 'unauthorized'}), 403
 
     cursor.execute(UPDATE_ROLE_QUERY, (target_user_id,))
     if cursor.rowcount > 0:
         conn.commit()
-        conn.close()
         return jsonify({'status': 'success', 'message': f'User {target_user_id} promoted to admin'})
-    conn.close()
     return jsonify({'status': 'failed', 'reason': 'User not found or already admin'}), 400
 
 @app.route('/api/get_contacts', methods=['GET'])
@@ -204,76 +212,57 @@ def send_invites():
 @app.route('/api/leaderboard', methods=['GET'])
 def leaderboard():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, score FROM users ORDER BY score DESC LIMIT 10")
-    leaderboard = [{'username': row[0] or 'Anonymous', 'score': row[1]} for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(leaderboard)
+    return jsonify(leaderboards.head(conn.cursor()))
 
 def start_game_action(cursor, game_id, bet_amount):
-    cursor.execute("SELECT players FROM games WHERE game_id = ? AND status = 'waiting'", (game_id,))
-    game = cursor.fetchone()
-    if game and len(game[0].split(',')) < 2:
+    cursor.execute(COUNT_PLAYERS_QUERY, (game_id,))
+    if cursor.fetchone()[0] < 2:
         return jsonify({'status': 'failed', 'reason': 'At least 2 players required'}), 400
-    cursor.execute("UPDATE games SET status = 'started', start_time = ?, last_updated = ?, prize_amount = ? WHERE game_id = ? AND status = 'waiting'",
-                   (datetime.now(), datetime.now(), bet_amount, game_id))
+    cursor.execute("UPDATE games SET status = 'started', start_time = %s, last_updated = %s, prize_amount = %s, draw_seed = %s WHERE game_id = %s AND status = 'waiting'",
+                   (datetime.now(), datetime.now(), bet_amount, new_seed(), game_id))
     if cursor.rowcount > 0:
+        events.publish(cursor, game_id, 'started', {'prize_amount': bet_amount})
         return jsonify({'status': 'started', 'prize_amount': bet_amount})
     return None
 
 def end_game_action(cursor, game_id):
-    cursor.execute("UPDATE games SET status = 'finished', end_time = ?, last_updated = ? WHERE game_id = ? AND status = 'started'",
+    cursor.execute("UPDATE games SET status = 'finished', end_time = %s, last_updated = %s WHERE game_id = %s AND status = 'started'",
                    (datetime.now(), datetime.now(), game_id))
     if cursor.rowcount > 0:
+        events.publish(cursor, game_id, 'finished')
         return jsonify({'status': 'ended'})
     return None
 
 def verify_payment_action(cursor, tx_id):
-    cursor.execute("SELECT user_id, amount FROM transactions WHERE tx_id = ? AND status = 'pending'", (tx_id,))
-    tx = cursor.fetchone()
-    if tx:
-        user_id, amount = tx
-        cursor.execute("UPDATE transactions SET status = 'verified' WHERE tx_id = ?", (tx_id,))
-        cursor.execute("UPDATE users SET wallet = wallet + ? WHERE user_id = ?", (amount, user_id))
-        cursor.execute("SELECT referrer_id FROM referrals WHERE referee_id = ? AND NOT bonus_credited", (user_id,))
-        referrer = cursor.fetchone()
-        if referrer:
-            cursor.execute("UPDATE users SET wallet = wallet + 20 WHERE user_id = ?", (referrer[0],))
-            cursor.execute("UPDATE referrals SET bonus_credited = TRUE WHERE referee_id = ?", (user_id,))
-        return jsonify({'status': 'verified', 'user_id': user_id, 'amount': amount})
+    result = payments.verify_payments(cursor, [tx_id])[0]
+    if result['status'] == 'verified':
+        return jsonify({'status': 'verified', 'user_id': result['user_id'], 'amount': result['amount']})
     return None
 
 def kick_user_action(cursor, target_user_id):
-    cursor.execute("DELETE FROM users WHERE user_id = ?", (target_user_id,))
+    cursor.execute("DELETE FROM users WHERE user_id = %s", (target_user_id,))
     if cursor.rowcount > 0:
         return jsonify({'status': 'kicked'})
     return None
 
 def manage_withdrawal_action(cursor, withdraw_id, action_type, admin_note, user_id):
-    cursor.execute("SELECT user_id, amount FROM withdrawals WHERE withdraw_id = ? AND status = 'pending'", (withdraw_id,))
-    withdrawal = cursor.fetchone()
-    if withdrawal:
-        withdrawal_user_id, amount = withdrawal
-        cursor.execute(SELECT_WALLET_QUERY, (withdrawal_user_id,))
-        wallet = cursor.fetchone()[0]
-        if action_type == 'approve' and wallet >= amount:
-            cursor.execute(UPDATE_WALLET_DEBIT_QUERY, (amount, withdrawal_user_id))
-            cursor.execute("UPDATE withdrawals SET status = 'approved', admin_note = ? WHERE withdraw_id = ?", (admin_note, withdraw_id))
-            return jsonify({'status': 'approved', 'user_id': withdrawal_user_id, 'amount': amount})
-        elif action_type == 'reject':
-            cursor.execute("UPDATE withdrawals SET status = 'rejected', admin_note = ? WHERE withdraw_id = ?", (admin_note, withdraw_id))
-            return jsonify({'status': 'rejected', 'user_id': withdrawal_user_id, 'amount': amount})
-    return None
+    # Settled at most once: only a pending withdrawal is changed, and an approval the wallet
+    # cannot cover leaves it pending.
+    if action_type not in ('approve', 'reject'):
+        return None
+    result = payments.settle_withdrawals(cursor, [withdraw_id], action_type, admin_note)[0]
+    if result['status'] == 'failed':
+        return None
+    return jsonify({'status': result['status'], 'user_id': result['user_id'], 'amount': result['amount']})
 
 @app.route('/api/admin_actions', methods=['POST'])
 def admin_actions():
     user_id = request.json.get('user_id')
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
+    cursor.execute("SELECT role FROM users WHERE user_id = %s", (user_id,))
     role = cursor.fetchone()
     if not role or role[0] != 'admin':
-        conn.close()
         return jsonify({'status': 'unauthorized'}), 403
 
     action = request.json.get('action')
@@ -296,32 +285,22 @@ def admin_actions():
     result = actions.get(action, lambda: None)()
     if result:
         conn.commit()
-        conn.close()
         return result
-    conn.close()
     return jsonify({'status': 'failed'}), 400
 
 @app.route('/api/create_game', methods=['POST'])
 def create_game():
     user_id = request.json.get('user_id')
     bet_amount = request.json.get('bet_amount')  # 10, 50, 100, or 200 ETB
-    if bet_amount not in [10, 50, 100, 200]:
+    if bet_amount not in lobby.BET_TIERS:
         return jsonify({'status': 'failed', 'reason': 'Invalid bet amount'}), 400
-    game_id = f"MP{user_id}{int(datetime.now().timestamp())}"
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute(SELECT_WALLET_QUERY, (user_id,))
-    wallet = cursor.fetchone()[0]
-    if wallet < bet_amount:
-        conn.close()
+    game_id = lobby.open_game(cursor, user_id, bet_amount)
+    if game_id is None:
         return jsonify({'status': 'failed', 'reason': INSUFFICIENT_WALLET}), 400
-    cursor.execute(UPDATE_WALLET_DEBIT_QUERY, (bet_amount, user_id))
-    cursor.execute(
-        "INSERT INTO games (game_id, players, selected_numbers, status, bet_amount, countdown_start) VALUES (?, ?, ?, 'waiting', ?, NULL)",
-        (game_id, str(user_id), '', bet_amount)
-    )
     conn.commit()
-    conn.close()
+    lobby.snapshot_cache.invalidate()
     return jsonify({'game_id': game_id, 'status': 'waiting', 'bet_amount': bet_amount})
 
 @app.route('/api/join_game', methods=['POST'])
@@ -331,31 +310,27 @@ def join_game():
     bet_amount = request.json.get('bet_amount')
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT players, selected_numbers, bet_amount FROM games WHERE game_id = ? AND status = 'waiting'", (game_id,))
+    cursor.execute(LOCK_WAITING_GAME_QUERY, (game_id,))
     game = cursor.fetchone()
     if not game:
-        conn.close()
         return jsonify({'status': 'failed', 'reason': 'Game not found'}), 400
-    players, selected_numbers, game_bet = game
-    players = players.split(',')
-    selected_numbers = selected_numbers.split(',') if selected_numbers else []
-    if str(user_id) in players:
-        conn.close()
-        return jsonify({'status': 'failed', 'reason': 'Already joined'}), 400
-    if bet_amount != game_bet:
-        conn.close()
+    if bet_amount != game[0]:
         return jsonify({'status': 'failed', 'reason': 'Bet amount must match game'}), 400
-    cursor.execute(SELECT_WALLET_QUERY, (user_id,))
-    wallet = cursor.fetchone()[0]
-    if wallet < bet_amount:
-        conn.close()
+    cursor.execute(COUNT_PLAYERS_QUERY, (game_id,))
+    if cursor.fetchone()[0] >= lobby.MAX_PLAYERS:
+        return jsonify({'status': 'failed', 'reason': GAME_FULL}), 400
+    cursor.execute(INSERT_PLAYER_QUERY, (game_id, user_id))
+    if cursor.rowcount == 0:
+        return jsonify({'status': 'failed', 'reason': 'Already joined'}), 400
+    if wallet.debit(cursor, user_id, bet_amount, 'bet', game_id) is None:
+        conn.rollback()
         return jsonify({'status': 'failed', 'reason': INSUFFICIENT_WALLET}), 400
-    cursor.execute(UPDATE_WALLET_DEBIT_QUERY, (bet_amount, user_id))
-    players.append(str(user_id))
-    cursor.execute("UPDATE games SET players = ? WHERE game_id = ?", (','.join(players), game_id))
+    cursor.execute(COUNT_PLAYERS_QUERY, (game_id,))
+    player_count = cursor.fetchone()[0]
+    events.publish(cursor, game_id, 'joined', {'user_id': user_id, 'players': player_count})
     conn.commit()
-    conn.close()
-    return jsonify({'status': 'joined', 'players': len(players), 'bet_amount': bet_amount})
+    lobby.snapshot_cache.invalidate()
+    return jsonify({'status': 'joined', 'players': player_count, 'bet_amount': bet_amount})
 
 @app.route('/api/select_number', methods=['POST'])
 def select_number():
@@ -364,28 +339,37 @@ def select_number():
     selected_number = request.json.get('selected_number')
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT players, selected_numbers, status FROM games WHERE game_id = ? AND status = 'waiting'", (game_id,))
+    if not isinstance(selected_number, int) or not (0 <= selected_number <= 100):
+        return jsonify({'status': 'failed', 'reason': 'Number must be 0-100'}), 400
+    cursor.execute('''SELECT (SELECT user_id FROM game_players WHERE game_id = g.game_id ORDER BY joined_at LIMIT 1)
+                      FROM games g JOIN game_players p ON p.game_id = g.game_id
+                      WHERE g.game_id = %s AND g.status = 'waiting' AND p.user_id = %s
+                      FOR UPDATE OF g''', (game_id, user_id))
     game = cursor.fetchone()
-    if not game or str(user_id) not in game[0].split(','):
-        conn.close()
+    if not game:
         return jsonify({'status': 'failed', 'reason': 'Invalid game or user'}), 400
-    selected_numbers = game[1].split(',') if game[1] else []
-    if str(selected_number) != '':
-        conn.close()
+    try:
+        # Conditional on the row as it is now, not as the locking SELECT first saw it.
+        cursor.execute("UPDATE game_players SET selected_number = %s WHERE game_id = %s AND user_id = %s AND selected_number IS NULL",
+                       (selected_number, game_id, user_id))
+    except psycopg2.IntegrityError:
+        conn.rollback()
         return jsonify({'status': 'failed', 'reason': 'Number already selected'}), 400
-    if not (0 <= selected_number <= 100):
-        conn.close()
-        return jsonify({'status': 'failed', 'reason': 'Number must be 0-100'}), 400
-    selected_numbers.append(str(selected_number))
-    cursor.execute("UPDATE games SET selected_numbers = ? WHERE game_id = ?", (','.join(selected_numbers), game_id))
-    if game[2] != 'waiting' or game[0].split(',').index(str(user_id)) != 0:
-        cursor.execute("UPDATE games SET countdown_start = ? WHERE game_id = ?", (datetime.now(), game_id))
-    random.seed(selected_number)
-    card_numbers = sorted(random.sample(range(0, 101), 25))
-    cursor.execute("INSERT INTO player_cards (game_id, user_id, card_numbers) VALUES (?, ?, ?)",
+    if cursor.rowcount == 0:
+        return jsonify({'status': 'failed', 'reason': 'Card already generated'}), 400
+    events.publish(cursor, game_id, 'number_selected', {'user_id': user_id, 'selected_number': selected_number})
+    if game[0] != int(user_id):
+        countdown_start = datetime.now()
+        cursor.execute("UPDATE games SET countdown_start = %s WHERE game_id = %s", (countdown_start, game_id))
+        events.publish(cursor, game_id, 'countdown', {'countdown_start': countdown_start.isoformat()})
+    card_numbers = list(cards.card(selected_number))
+    cursor.execute("INSERT INTO player_cards (game_id, user_id, card_numbers) VALUES (%s, %s, %s) RETURNING card_id",
                    (game_id, user_id, ','.join(map(str, card_numbers))))
+    card_id = cursor.fetchone()[0]
+    cursor.execute('''INSERT INTO card_cells (game_id, number, card_id, cell)
+                      SELECT %s, number, %s, ord - 1 FROM unnest(%s::INTEGER[]) WITH ORDINALITY AS c(number, ord)''',
+                   (game_id, card_id, card_numbers))
     conn.commit()
-    conn.close()
     return jsonify({'status': 'card_generated', 'card_numbers': card_numbers, 'selected_number': selected_number})
 
 @app.route('/api/accept_card', methods=['POST'])
@@ -397,161 +381,143 @@ def accept_card():
     cursor.execute(SELECT_CARD_NUMBERS_QUERY, (game_id, user_id))
     card = cursor.fetchone()
     if card:
-        conn.close()
         return jsonify({'status': 'accepted', 'card_numbers': card[0].split(',')})
-    conn.close()
     return jsonify({'status': 'failed'}), 400
 
 @app.route('/api/game_status', methods=['GET'])
 def game_status():
+    # games.event_seq is bumped by every state change, so it doubles as the game's version:
+    # a client presenting the current ETag gets a 304. With since=<draw seq> only later draws
+    # are returned and the card is left out. While the fan-out listener is connected the game
+    # is read from its in-memory snapshot, so neither needs the database.
     game_id = request.args.get('game_id')
     user_id = request.args.get('user_id')
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT status, start_time, end_time, numbers_called, prize_amount, winner_id, players, selected_numbers, bet_amount, countdown_start FROM games WHERE game_id = ?", (game_id,))
-    game = cursor.fetchone()
-    if not game:
-        conn.close()
+    since = request.args.get('since', type=int)
+    if since is not None:
+        since = max(since, 0)
+    snapshot = fanout.snapshots.get_or_load(game_id, lambda: fanout.GameSnapshot.load(get_db_connection().cursor(), game_id))
+    if not snapshot:
         return jsonify({'status': 'not_found'}), 404
-    status, start_time, end_time, numbers_called, prize_amount, winner_id, players_str, selected_numbers, bet_amount, countdown_start = game
-    players = players_str.split(',') if players_str else []
-    cursor.execute(SELECT_CARD_NUMBERS_QUERY, (game_id, user_id))
-    card = cursor.fetchone()
-    auto_start = countdown_start and len(players) > 2 and (datetime.now() - countdown_start).total_seconds() > 120
-    if auto_start and status == 'waiting':
-        cursor.execute("UPDATE games SET status = 'started', start_time = ?, last_updated = ?, prize_amount = ?, selected_numbers = '' WHERE game_id = ?",
-                       (datetime.now(), datetime.now(), bet_amount, game_id))
+    if snapshot.auto_start_due():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(AUTO_START_QUERY, (datetime.now(), datetime.now(), snapshot.bet_amount, new_seed(), game_id))
+        if cursor.rowcount > 0:
+            events.publish(cursor, game_id, 'started', {'prize_amount': snapshot.bet_amount})
         conn.commit()
-    conn.close()
-    return jsonify({
-        'status': status,
-        'start_time': start_time.isoformat() if start_time else None,
-        'end_time': end_time.isoformat() if end_time else None,
-        'numbers_called': numbers_called.split(',') if numbers_called else [],
-        'prize_amount': prize_amount,
-        'winner_id': winner_id,
-        'players': players,
-        'selected_numbers': selected_numbers.split(',') if selected_numbers else [],
-        'bet_amount': bet_amount,
-        'card_numbers': card[0].split(',') if card else []
-    })
+        snapshot = fanout.GameSnapshot.load(cursor, game_id)
+    etag = game_status_etag(game_id, user_id, snapshot.version, since)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        user_id = int(user_id) if user_id and user_id.isdigit() else None
+        response = jsonify(snapshot.status_body(user_id, since))
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def game_status_etag(game_id, user_id, version, since):
+    return f"{game_id}:{user_id}:{version}:{'' if since is None else since}"
 
 @app.route('/api/call_number', methods=['POST'])
 def call_number():
+    # Draws are made by the background scheduler; this endpoint reports the latest one and
+    # lets admins force an immediate draw.
     game_id = request.json.get('game_id')
+    user_id = request.json.get('user_id')
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT status, numbers_called, end_time FROM games WHERE game_id = ?", (game_id,))
-    game = cursor.fetchone()
-    if not game or game[0] != 'started' or (game[2] and datetime.now() > game[2]):
-        conn.close()
-        return jsonify({'status': 'invalid'}), 400
-    numbers = game[1].split(',') if game[1] else []
-    if len(numbers) >= 100 or game[0] == 'finished':
-        conn.close()
-        return jsonify({'status': 'complete'}), 400
-    new_number = random.randint(0, 100)
-    while str(new_number) in numbers:
-        new_number = random.randint(0, 100)
-    numbers.append(str(new_number))
-    cursor.execute("UPDATE games SET numbers_called = ?, last_updated = ? WHERE game_id = ?",
-                   (','.join(numbers), datetime.now(), game_id))
-    conn.commit()
-    import time
-    time.sleep(5)  # 5-second interval
-    conn.close()
-    return jsonify({'number': new_number, 'called_numbers': numbers, 'remaining': 100 - len(numbers)})
+    cursor.execute(SELECT_ROLE_QUERY, (user_id,))
+    role = cursor.fetchone()
+    if role and role[0] == 'admin' and request.json.get('force'):
+        def force_draw():
+            result = draw_next_number(cursor, game_id, force=True)
+            conn.commit()
+            return result
+        # Simultaneous forced draws for one game collapse into a single draw.
+        concurrency.flights.do(('draw', game_id), force_draw)
+    cursor.execute(SELECT_CALLED_QUERY, (game_id,))
+    body, status_code = called_body(cursor.fetchone())
+    return jsonify(body), status_code
+
+def called_body(game):
+    """call_number's response for a SELECT_CALLED_QUERY row, as ``(body, status_code)``."""
+    if not game or game[0] not in ('started', 'finished'):
+        return {'status': 'invalid'}, 400
+    status, next_draw_at, seed, drawn, numbers = game
+    if seed is not None:
+        numbers = called_numbers(seed, drawn)
+    numbers = [str(n) for n in numbers]
+    if len(numbers) >= MAX_DRAWS or status == 'finished':
+        return {'status': 'complete', 'called_numbers': numbers}, 400
+    return {
+        'number': int(numbers[-1]) if numbers else None,
+        'called_numbers': numbers,
+        'remaining': MAX_DRAWS - len(numbers),
+        'next_draw_at': next_draw_at.isoformat() if next_draw_at else None
+    }, 200
 
 @app.route('/api/check_bingo', methods=['POST'])
 def check_bingo():
+    # Cards are daubed and winners settled on every draw; a claim only reports the outcome,
+    # or settles a win whose draw has not been processed yet.
     user_id = request.json.get('user_id')
     game_id = request.json.get('game_id')
+    # Repeated claims from one player that arrive together are answered by a single check.
+    return jsonify(concurrency.flights.do(('check_bingo', game_id, str(user_id)), lambda: claim_bingo(game_id, user_id)))
+
+def claim_bingo(game_id, user_id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT numbers_called, winner_id, players, bet_amount FROM games WHERE game_id = ?", (game_id,))
+    cursor.execute(LOCK_CLAIM_GAME_QUERY, (game_id,))
     game = cursor.fetchone()
-    if not game or game[1] is not None:
-        conn.close()
-        return jsonify({'message': 'Game already has a winner or not started', 'won': False})
-    numbers_called = game[0].split(',') if game[0] else []
-    players = game[2].split(',')
-    bet_amount = game[3]
-    cursor.execute(SELECT_CARD_NUMBERS_QUERY, (game_id, user_id))
-    card = cursor.fetchone()
-    if not card:
-        conn.close()
-        return jsonify({'message': 'Card not found', 'won': False})
-    card_numbers = set(card[0].split(','))
-    marked = [num for num in card_numbers if num in numbers_called]
-    card_grid = [marked[i:i+5] for i in range(0, 25, 5)]
-    won = any(all(row) for row in card_grid) or \
-          any(all(str(i*5 + col) in marked for i in range(5)) for col in range(5)) or \
-          all(str(i*5 + i) in marked for i in range(5)) or \
-          all(str(i*5 + (4-i)) in marked for i in range(5))
-    if not won:
-        cursor.execute("UPDATE users SET invalid_bingo_count = invalid_bingo_count + 1 WHERE user_id = ?", (user_id,))
-        invalid_count = cursor.execute("SELECT invalid_bingo_count FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
-        if invalid_count >= 1:
-            cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-            conn.commit()
-            conn.close()
-            return jsonify({'message': '🚫 You were kicked for repeated invalid Bingo claims!', 'kicked': True})
+    if not game or game[0] != 'started' and game[1] is None:
+        return NOT_STARTED_CLAIM
+    cursor.execute(SELECT_MARKS_QUERY, (game_id, user_id))
+    marks = cursor.fetchall()
+    if not marks:
+        return NO_CARD_CLAIM
+    if game[1] is None and any(bingo.is_winning_mask(mask) for _, mask in marks):
+        settle_game(cursor, game_id, [int(user_id)])
         conn.commit()
-        conn.close()
-        return jsonify({'message': '❌ Invalid Bingo claim! Try again. (You are kicked out of the game!)', 'won': False})
-    total_bet = bet_amount * len(players)
-    prize_amount = int(total_bet * 0.98)  # 2% deduction
-    cursor.execute("UPDATE games SET winner_id = ?, prize_amount = ?, status = 'finished', end_time = ? WHERE game_id = ?", (user_id, prize_amount, datetime.now(), game_id))
-    cursor.execute("SELECT username FROM users WHERE user_id = ?", (user_id,))
-    winner_username = cursor.fetchone()[0]
-    cursor.execute(UPDATE_WALLET_DEBIT_QUERY, (bet_amount, user_id))  # Corrected to credit winner
-    cursor.execute("UPDATE users SET wallet = wallet + ? WHERE user_id = ?", (prize_amount, user_id))
-    for player in players:
-        if player != str(user_id):
-            cursor.execute(UPDATE_WALLET_DEBIT_QUERY, (bet_amount, player))
-    conn.commit()
-    conn.close()
-    return jsonify({'message': f'🎉 Bingo! {winner_username} won {prize_amount} ETB! You are the first winner!', 'won': True})
+        cursor.execute("SELECT status, winner_id, prize_amount FROM games WHERE game_id = %s", (game_id,))
+        game = cursor.fetchone()
+    if game[1] is None:
+        cursor.execute(INVALID_BINGO_QUERY, (user_id,))
+        conn.commit()
+        return NO_BINGO_CLAIM
+    cursor.execute(SELECT_CLAIM_PLAYER_QUERY, (game[1], game_id, user_id))
+    return claim_result(game, cursor.fetchone())
 
-@app.route('/api/pending_withdrawals', methods=['GET'])
-def pending_withdrawals():
-    user_id = request.args.get('user_id')
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT role FROM users WHERE user_id = ?", (user_id,))
-    role = cursor.fetchone()
-    if not role or role[0] != 'admin':
-        conn.close()
-        return jsonify({'status': 'unauthorized'}), 403
-    cursor.execute("SELECT withdraw_id, user_id, amount, method, request_time FROM withdrawals WHERE status = 'pending'")
-    withdrawals = [{'withdraw_id': row[0], 'user_id': row[1], 'amount': row[2], 'method': row[3], 'request_time': row[4].isoformat()} for row in cursor.fetchall()]
-    conn.close()
-    return jsonify({'withdrawals': withdrawals})
+def claim_result(game, player):
+    """The claim outcome once ``game`` has a winner; ``player`` is a SELECT_CLAIM_PLAYER_QUERY row."""
+    if player and player[0]:
+        return {'message': f'🎉 Bingo! You won in this game! Prize pool: {game[2]} ETB', 'won': True}
+    winner_username = player[1] if player else game[1]
+    return {'message': f'Game already won by {winner_username}', 'won': False}
 
 @app.route('/api/request_withdrawal', methods=['POST'])
 def request_withdrawal():
     user_id = request.json.get('user_id')
     amount = request.json.get('amount')
     method = request.json.get('method', 'telebirr')
+    if not isinstance(amount, int) or isinstance(amount, bool) or amount <= 0:
+        return jsonify({'status': 'failed', 'reason': 'Amount must be a positive whole number'}), 400
     withdraw_id = f"W{user_id}{int(datetime.now().timestamp())}"
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute(SELECT_WALLET_QUERY, (user_id,))
-    wallet = cursor.fetchone()[0]
-    if wallet < 100:
-        conn.close()
-        return jsonify({'status': 'failed', 'reason': 'Wallet must be at least 100 ETB to request withdrawal'}), 400
-    if wallet < amount:
-        conn.close()
-        return jsonify({'status': 'failed', 'reason': INSUFFICIENT_WALLET}), 400
+    # The balance check is part of the insert; the wallet is only read again to explain a refusal.
     cursor.execute(
-        "INSERT INTO withdrawals (withdraw_id, user_id, amount, method) VALUES (?, ?, ?, ?)",
-        (withdraw_id, user_id, amount, method)
+        "INSERT INTO withdrawals (withdraw_id, user_id, amount, method) SELECT %s, user_id, %s, %s FROM users WHERE user_id = %s AND wallet >= GREATEST(%s, 100)",
+        (withdraw_id, amount, method, user_id, amount)
     )
+    if cursor.rowcount == 0:
+        if (wallet.balance(cursor, user_id) or 0) < 100:
+            return jsonify({'status': 'failed', 'reason': 'Wallet must be at least 100 ETB to request withdrawal'}), 400
+        return jsonify({'status': 'failed', 'reason': INSUFFICIENT_WALLET}), 400
     conn.commit()
-    conn.close()
     return jsonify({'status': 'requested', 'withdraw_id': withdraw_id, 'amount': amount})
 
 if __name__ == '__main__':
-    print(f"Static folder: {STATIC_FOLDER}")  # Debug
+    logger.debug('Serving static files from %s', assets.PUBLIC_DIR)
     app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""Moving finished games out of the live tables, and the per-user game history read from the archive.
+
+Finished games older than ARCHIVE_AFTER_SECONDS are copied in batches into games_archive
+(one compact row per game, draws as an array) and game_history (one row per player and
+game), then deleted together with their players, cards, draws and events. The live tables
+only ever hold games in play plus the recently finished ones, so their lookups stay flat
+however many games have been played. Batches lock their games with SKIP LOCKED, so the job
+can run in every scheduler process at once.
+
+    python api/archive.py   # archive everything due, e.g. from cron
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+from flask import jsonify, request
+
+import db
+import events
+from db import get_db_connection
+
+ARCHIVE_AFTER_SECONDS = float(os.environ.get('ARCHIVE_AFTER_SECONDS', 3600))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 200))
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+SELECT_DUE_GAMES_QUERY = '''SELECT game_id FROM games
+                            WHERE status = 'finished' AND COALESCE(end_time, last_updated) < %s
+                            ORDER BY end_time LIMIT %s
+                            FOR UPDATE SKIP LOCKED'''
+ARCHIVE_GAMES_QUERY = '''INSERT INTO games_archive (game_id, bet_amount, prize_amount, winner_id, player_count,
+                                                    start_time, end_time, draw_seed, draws)
+    SELECT g.game_id, g.bet_amount, g.prize_amount, g.winner_id,
+           (SELECT COUNT(*) FROM game_players WHERE game_id = g.game_id),
+           g.start_time, COALESCE(g.end_time, g.last_updated), g.draw_seed,
+           ARRAY(SELECT number FROM game_draws WHERE game_id = g.game_id ORDER BY seq)::SMALLINT[]
+    FROM games g WHERE g.game_id = ANY(%s)
+    ON CONFLICT DO NOTHING'''
+ARCHIVE_PLAYERS_QUERY = '''INSERT INTO game_history (user_id, game_id, ended_at, bet_amount, selected_number,
+                                                     card_numbers, won, payout)
+    SELECT p.user_id, p.game_id, COALESCE(g.end_time, g.last_updated), g.bet_amount, p.selected_number,
+           string_to_array(pc.card_numbers, ',')::SMALLINT[], p.winner,
+           (SELECT COALESCE(SUM(amount), 0) FROM wallet_ledger
+            WHERE user_id = p.user_id AND ref = p.game_id AND reason = 'prize')
+    FROM game_players p JOIN games g ON g.game_id = p.game_id
+    LEFT JOIN LATERAL (SELECT card_numbers FROM player_cards
+                       WHERE game_id = p.game_id AND user_id = p.user_id ORDER BY card_id LIMIT 1) pc ON TRUE
+    WHERE p.game_id = ANY(%s)
+    ON CONFLICT DO NOTHING'''
+# Children first, so the games foreign keys hold at every step.
+PURGE_QUERIES = (
+    "DELETE FROM card_cells WHERE game_id = ANY(%s)",
+    "DELETE FROM player_cards WHERE game_id = ANY(%s)",
+    "DELETE FROM game_draws WHERE game_id = ANY(%s)",
+    "DELETE FROM game_events WHERE game_id = ANY(%s)",
+    "DELETE FROM game_players WHERE game_id = ANY(%s)",
+    "DELETE FROM games WHERE game_id = ANY(%s)",
+)
+NOTIFY_ARCHIVED_QUERY = "SELECT pg_notify(%s, json_build_object('game_id', game_id)::TEXT) FROM unnest(%s::TEXT[]) AS game_id"
+SELECT_HISTORY_QUERY = '''SELECT game_id, ended_at, bet_amount, selected_number, card_numbers, won, payout
+                          FROM game_history WHERE user_id = %s {after}
+                          ORDER BY ended_at DESC, game_id DESC LIMIT %s'''
+
+
+def archive_batch(cursor, older_than, limit=ARCHIVE_BATCH_SIZE):
+    """Archive and purge up to ``limit`` games finished before ``older_than``. Returns how many."""
+    cursor.execute(SELECT_DUE_GAMES_QUERY, (older_than, limit))
+    game_ids = [row[0] for row in cursor.fetchall()]
+    if not game_ids:
+        return 0
+    cursor.execute(ARCHIVE_GAMES_QUERY, (game_ids,))
+    cursor.execute(ARCHIVE_PLAYERS_QUERY, (game_ids,))
+    for query in PURGE_QUERIES:
+        cursor.execute(query, (game_ids,))
+    if events.NOTIFY_ENABLED:
+        # Drops the games from every process's snapshots once the purge commits.
+        cursor.execute(NOTIFY_ARCHIVED_QUERY, (events.NOTIFY_CHANNEL, game_ids))
+    return len(game_ids)
+
+
+def archive_finished_games(max_batches=None):
+    """Archive every game that is due, one committed batch at a time. Returns how many."""
+    older_than = datetime.now() - timedelta(seconds=ARCHIVE_AFTER_SECONDS)
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        with db.connection() as conn:
+            count = archive_batch(conn.cursor(), older_than)
+        archived += count
+        batches += 1
+        if count < ARCHIVE_BATCH_SIZE:
+            break
+    if archived:
+        logger.info('Archived %s finished games', archived)
+    return archived
+
+
+def history(cursor, user_id, limit, after=None):
+    if after is None:
+        cursor.execute(SELECT_HISTORY_QUERY.format(after=''), (user_id, limit))
+    else:
+        cursor.execute(SELECT_HISTORY_QUERY.format(after='AND (ended_at, game_id) < (%s, %s)'), (user_id, *after, limit))
+    games = [{'game_id': game_id, 'ended_at': ended_at.isoformat(), 'bet_amount': bet_amount,
+              'selected_number': selected_number, 'card_numbers': card_numbers, 'won': won, 'payout': payout}
+             for game_id, ended_at, bet_amount, selected_number, card_numbers, won, payout in cursor.fetchall()]
+    next_cursor = f"{games[-1]['ended_at']}|{games[-1]['game_id']}" if len(games) == limit else None
+    return {'games': games, 'next_cursor': next_cursor}
+
+
+def game_history(user_id):
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), MAX_HISTORY_PAGE_SIZE)
+    after = request.args.get('cursor')
+    if after:
+        ended_at, _, game_id = after.partition('|')
+        try:
+            after = (datetime.fromisoformat(ended_at), game_id)
+        except ValueError:
+            return jsonify({'status': 'failed', 'reason': 'Invalid cursor'}), 400
+    return jsonify(history(get_db_connection().cursor(), user_id, limit, after))
+
+
+def init_app(app):
+    app.add_url_rule('/api/users/<int:user_id>/games', 'game_history', game_history)
+
+
+if __name__ == '__main__':
+    import migrations
+    logging.basicConfig(level=logging.INFO)
+    migrations.ensure_schema()
+    archive_finished_games()
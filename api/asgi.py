@@ -0,0 +1,451 @@
+"""Optional async serving mode: an ASGI app with async Postgres for the game endpoints.
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app --app-dir api --workers 4
+
+game_status, call_number, check_bingo, join_game and the game event stream run here as
+coroutines on a psycopg 3 async pool; every other route goes to the Flask app unchanged. A
+waiting client costs a coroutine rather than a worker thread or a database connection, so
+one process holds thousands of open game connections. game_status takes wait=<seconds>
+with If-None-Match and answers as soon as the game changes, or with a 304 once the wait runs
+out. Wake-ups come from the fan-out listener (fanout.py), which this mode starts at boot.
+
+Forced draws and a claim that settles a win are rare; they run the sync code in a worker
+thread, so draws and settlement keep a single implementation.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import psycopg
+from asgiref.wsgi import WsgiToAsgi
+from psycopg_pool import AsyncConnectionPool
+from werkzeug.http import parse_etags, quote_etag
+
+import app as flask_app
+import bingo
+import concurrency
+import db
+import events
+import fanout
+import lobby
+import metrics
+import migrations
+import scheduler
+import wallet
+from draws import draw_next_number, new_seed
+
+ASYNC_POOL_MIN = int(os.environ.get('ASYNC_DB_POOL_MIN', 1))
+ASYNC_POOL_MAX = int(os.environ.get('ASYNC_DB_POOL_MAX', 20))
+MAX_WAIT_SECONDS = 30
+# A waiting stream costs a coroutine here, not a thread, so streams stay open far longer.
+STREAM_MAX_SECONDS = float(os.environ.get('ASYNC_EVENT_STREAM_MAX_SECONDS', 300))
+WAITED_GAMES_MAX = 10000
+RENDERED_MAX = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedAsyncCursor(psycopg.AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            metrics.db_statements_total.inc()
+            metrics.db_seconds_total.inc(time.perf_counter() - start)
+
+
+pool = AsyncConnectionPool(db.DATABASE_URL, min_size=ASYNC_POOL_MIN, max_size=ASYNC_POOL_MAX, open=False,
+                           kwargs={'cursor_factory': InstrumentedAsyncCursor})
+flights = concurrency.AsyncSingleFlight()
+_rendered = OrderedDict()  # (game_id, version, since) -> game_status body
+
+
+class GameWaiters:
+    """Requests waiting for a game to change. Woken on the event loop for each fan-out event."""
+
+    def __init__(self):
+        self._versions = {}
+        self._events = {}
+
+    def version(self, game_id):
+        return self._versions.get(game_id, 0)
+
+    def wake(self, game_id):
+        if game_id is None or len(self._versions) > WAITED_GAMES_MAX:
+            # Listener (re)connected or too many games tracked: every waiter re-checks.
+            self._versions.clear()
+            waiting, self._events = self._events, {}
+        else:
+            self._versions[game_id] = self._versions.get(game_id, 0) + 1
+            event = self._events.pop(game_id, None)
+            waiting = {game_id: event} if event else {}
+        for event in waiting.values():
+            event.set()
+
+    async def wait(self, game_id, seen, timeout):
+        """Wait up to ``timeout`` seconds for a change after version ``seen``. Returns whether there was one."""
+        if self.version(game_id) != seen:
+            return True
+        event = self._events.setdefault(game_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), max(timeout, 0))
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+waiters = GameWaiters()
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.args = {key: values[-1] for key, values in parse_qs(scope['query_string'].decode()).items()}
+        self.headers = {key.decode().lower(): value.decode() for key, value in scope['headers']}
+        self.body = body
+
+    @property
+    def json(self):
+        try:
+            body = json.loads(self.body or b'null')
+        except ValueError:
+            return None
+        return body if isinstance(body, dict) else None
+
+    def arg(self, name, type=str):
+        try:
+            return type(self.args[name]) if name in self.args else None
+        except ValueError:
+            return None
+
+
+class Response:
+    def __init__(self, status=200, body=b'', headers=(), content_type=None):
+        self.status = status
+        self.body = body  # bytes, or an async iterator of str for streams
+        self.headers = [(name.lower().encode(), value.encode()) for name, value in headers]
+        if content_type:
+            self.headers.append((b'content-type', content_type.encode()))
+        if isinstance(body, bytes):
+            self.headers.append((b'content-length', str(len(body)).encode()))
+
+
+def json_response(body, status=200, headers=()):
+    # Serialised like Flask's jsonify, so both modes send the same bytes.
+    data = json.dumps(body, sort_keys=True, separators=(',', ':')) + '\n'
+    return Response(status, data.encode(), headers, 'application/json')
+
+
+def failed(reason):
+    return json_response({'status': 'failed', 'reason': reason}, 400)
+
+
+async def publish(conn, game_id, event_type, payload=None):
+    """events.publish for an async connection."""
+    cursor = await conn.execute(events.BUMP_EVENT_SEQ_QUERY, (game_id,))
+    row = await cursor.fetchone()
+    if not row:
+        return None
+    await conn.execute(*events.insert_event(game_id, row[0], event_type, payload))
+    return row[0]
+
+
+async def load_snapshot(game_id):
+    snapshot, generation = fanout.snapshots.lookup(game_id)
+    if snapshot is None:
+        async with pool.connection() as conn:
+            cursor = await conn.execute(fanout.SELECT_SNAPSHOT_QUERY, (game_id,))
+            snapshot = fanout.GameSnapshot.from_row(await cursor.fetchone())
+        fanout.snapshots.store(game_id, snapshot, generation)
+    return snapshot
+
+
+async def auto_start(game_id, snapshot):
+    async with pool.connection() as conn:
+        cursor = await conn.execute(flask_app.AUTO_START_QUERY,
+                                    (datetime.now(), datetime.now(), snapshot.bet_amount, new_seed(), game_id))
+        if cursor.rowcount > 0:
+            await publish(conn, game_id, 'started', {'prize_amount': snapshot.bet_amount})
+        await conn.commit()
+        cursor = await conn.execute(fanout.SELECT_SNAPSHOT_QUERY, (game_id,))
+        return fanout.GameSnapshot.from_row(await cursor.fetchone())
+
+
+async def game_status(request):
+    game_id = request.arg('game_id')
+    user_id = request.arg('user_id')
+    since = request.arg('since', int)
+    if since is not None:
+        since = max(since, 0)
+    wait = min(request.arg('wait', float) or 0, MAX_WAIT_SECONDS)
+    if_none_match = parse_etags(request.headers.get('if-none-match'))
+    deadline = time.monotonic() + wait
+    while True:
+        seen = waiters.version(game_id)
+        snapshot = await load_snapshot(game_id)
+        if not snapshot:
+            return json_response({'status': 'not_found'}, 404)
+        if snapshot.auto_start_due():
+            snapshot = await auto_start(game_id, snapshot)
+        etag = flask_app.game_status_etag(game_id, user_id, snapshot.version, since)
+        unchanged = if_none_match.contains_weak(etag)
+        if not unchanged or time.monotonic() >= deadline:
+            break
+        await waiters.wait(game_id, seen, deadline - time.monotonic())
+    headers = [('ETag', quote_etag(etag, weak=True)), ('Cache-Control', 'no-cache')]
+    if unchanged:
+        return Response(304, headers=headers)
+    if since is not None:
+        return Response(200, rendered_status(game_id, snapshot, since), headers, 'application/json')
+    user_id = int(user_id) if user_id and user_id.isdigit() else None
+    return json_response(snapshot.status_body(user_id, since), headers=headers)
+
+
+def rendered_status(game_id, snapshot, since):
+    """The serialised game_status body with ``since``, shared by everyone waiting on this version."""
+    key = (game_id, snapshot.version, since)
+    data = _rendered.get(key)
+    if data is None:
+        data = json_response(snapshot.status_body(None, since)).body
+        _rendered[key] = data
+        if len(_rendered) > RENDERED_MAX:
+            _rendered.popitem(last=False)
+    return data
+
+
+def force_draw(game_id):
+    with db.connection() as conn:
+        return draw_next_number(conn.cursor(), game_id, force=True)
+
+
+async def call_number(request):
+    body = request.json or {}
+    game_id = body.get('game_id')
+    async with pool.connection() as conn:
+        cursor = await conn.execute(flask_app.SELECT_ROLE_QUERY, (body.get('user_id'),))
+        role = await cursor.fetchone()
+    if role and role[0] == 'admin' and body.get('force'):
+        await flights.do(('draw', game_id), lambda: asyncio.to_thread(force_draw, game_id))
+    async with pool.connection() as conn:
+        cursor = await conn.execute(flask_app.SELECT_CALLED_QUERY, (game_id,))
+        result, status = flask_app.called_body(await cursor.fetchone())
+    return json_response(result, status)
+
+
+def settle_claim(game_id, user_id):
+    with flask_app.app.app_context():
+        return flask_app.claim_bingo(game_id, user_id)
+
+
+async def claim_bingo(game_id, user_id):
+    async with pool.connection() as conn:
+        cursor = await conn.execute(flask_app.LOCK_CLAIM_GAME_QUERY, (game_id,))
+        game = await cursor.fetchone()
+        if not game or game[0] != 'started' and game[1] is None:
+            return flask_app.NOT_STARTED_CLAIM
+        cursor = await conn.execute(flask_app.SELECT_MARKS_QUERY, (game_id, user_id))
+        marks = await cursor.fetchall()
+        if not marks:
+            return flask_app.NO_CARD_CLAIM
+        if game[1] is not None:
+            cursor = await conn.execute(flask_app.SELECT_CLAIM_PLAYER_QUERY, (game[1], game_id, user_id))
+            return flask_app.claim_result(game, await cursor.fetchone())
+        if not any(bingo.is_winning_mask(mask) for _, mask in marks):
+            await conn.execute(flask_app.INVALID_BINGO_QUERY, (user_id,))
+            return flask_app.NO_BINGO_CLAIM
+    # A win no draw has settled yet: the sync claim takes the lock again and settles it.
+    return await asyncio.to_thread(settle_claim, game_id, user_id)
+
+
+async def check_bingo(request):
+    body = request.json or {}
+    user_id = body.get('user_id')
+    game_id = body.get('game_id')
+    return json_response(await flights.do(('check_bingo', game_id, str(user_id)), lambda: claim_bingo(game_id, user_id)))
+
+
+async def join_game(request):
+    body = request.json or {}
+    user_id = body.get('user_id')
+    game_id = body.get('game_id')
+    bet_amount = body.get('bet_amount')
+    async with pool.connection() as conn:
+        cursor = await conn.execute(flask_app.LOCK_WAITING_GAME_QUERY, (game_id,))
+        game = await cursor.fetchone()
+        if not game:
+            return failed('Game not found')
+        if bet_amount != game[0]:
+            return failed('Bet amount must match game')
+        cursor = await conn.execute(flask_app.COUNT_PLAYERS_QUERY, (game_id,))
+        if (await cursor.fetchone())[0] >= lobby.MAX_PLAYERS:
+            return failed(flask_app.GAME_FULL)
+        cursor = await conn.execute(flask_app.INSERT_PLAYER_QUERY, (game_id, user_id))
+        if cursor.rowcount == 0:
+            return failed('Already joined')
+        cursor = await conn.execute(wallet.DEBIT_QUERY, {'user_id': user_id, 'amount': bet_amount, 'required': bet_amount,
+                                                         'reason': 'bet', 'ref': game_id})
+        if await cursor.fetchone() is None:
+            await conn.rollback()
+            return failed(flask_app.INSUFFICIENT_WALLET)
+        cursor = await conn.execute(flask_app.COUNT_PLAYERS_QUERY, (game_id,))
+        player_count = (await cursor.fetchone())[0]
+        await publish(conn, game_id, 'joined', {'user_id': user_id, 'players': player_count})
+    lobby.snapshot_cache.invalidate()
+    return json_response({'status': 'joined', 'players': player_count, 'bet_amount': bet_amount})
+
+
+async def stream_game_events(game_id, since):
+    # Like events.stream_game_events, without a thread per stream.
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    yield f"retry: {events.STREAM_RETRY_MS}\n\n"
+    while time.monotonic() < deadline:
+        seen = waiters.version(game_id)
+        recent = events.broker.recent(game_id, since)
+        if recent is None:
+            async with pool.connection() as conn:
+                cursor = await conn.execute(events.SELECT_EVENTS_QUERY, (game_id, since))
+                recent = await cursor.fetchall()
+        for seq, event_type, payload in recent:
+            since = seq
+            yield events.format_event(seq, event_type, payload)
+            if event_type in events.TERMINAL_EVENTS:
+                return
+        if not await waiters.wait(game_id, seen, min(events.STREAM_RECHECK_SECONDS, deadline - time.monotonic())):
+            yield ": keepalive\n\n"
+
+
+async def game_events(request, game_id):
+    since = request.headers.get('last-event-id') or request.args.get('since') or 0
+    try:
+        since = int(since)
+    except ValueError:
+        since = 0
+    return Response(200, stream_game_events(game_id, since),
+                    [('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')], 'text/event-stream')
+
+
+ROUTES = [
+    ('GET', '/api/game_status', game_status),
+    ('POST', '/api/call_number', call_number),
+    ('POST', '/api/check_bingo', check_bingo),
+    ('POST', '/api/join_game', join_game),
+    ('GET', '/api/games/<game_id>/events', game_events),
+]
+_compiled_routes = [(method, re.compile('^' + re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', rule) + '$'), rule, handler)
+                    for method, rule, handler in ROUTES]
+
+
+def match(method, path):
+    for route_method, pattern, rule, handler in _compiled_routes:
+        found = pattern.match(path)
+        if found and method in (route_method, 'HEAD' if route_method == 'GET' else None):
+            return rule, handler, found.groupdict()
+    return None
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def until_disconnect(receive, awaitable):
+    """Await ``awaitable``, cancelling it if the client goes away first. Returns None in that case."""
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        await asyncio.wait({task})
+        return None
+    return task.result()
+
+
+class GameServer:
+    def __init__(self, wsgi_app):
+        self.wsgi = WsgiToAsgi(wsgi_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        route = match(scope['method'], scope['path']) if scope['type'] == 'http' else None
+        if route is None:
+            return await self.wsgi(scope, receive, send)
+        rule, handler, params = route
+        start = time.perf_counter()
+        body = await read_body(receive)
+        if body is None:
+            return
+        response = await until_disconnect(receive, handler(Request(scope, body), **params))
+        if response is None:
+            return
+        metrics.request_seconds.observe(time.perf_counter() - start, scope['method'], rule, response.status)
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': response.headers})
+        if isinstance(response.body, bytes):
+            await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else response.body})
+            return
+        chunks = response.body
+
+        async def stream():
+            async for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        try:
+            await until_disconnect(receive, stream())
+        finally:
+            await chunks.aclose()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as exc:
+                    logger.exception('Startup failed')
+                    await send({'type': 'lifespan.startup.failed', 'message': str(exc)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                fanout.listener.stop()
+                scheduler.scheduler.stop()
+                await pool.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        await asyncio.to_thread(migrations.ensure_schema)
+        await pool.open()
+        loop = asyncio.get_running_loop()
+        fanout.subscribe(lambda game_id: loop.call_soon_threadsafe(waiters.wake, game_id))
+        if events.NOTIFY_ENABLED:
+            fanout.listener.start()
+        if scheduler.SCHEDULER_ENABLED:
+            scheduler.scheduler.start()
+
+
+app = GameServer(flask_app.app)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
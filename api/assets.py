@@ -0,0 +1,197 @@
+"""Static files from public/, fingerprinted, precompressed and served from memory.
+
+    python api/assets.py   # build into build/static, e.g. as a deploy step
+
+The build names every asset after a hash of its content (script.3f2a1b9c04.js), points the
+references in index.html at those names, and writes gzip and, when the optional brotli
+package is installed, brotli copies alongside, plus manifest.json mapping source names to
+built ones. The app loads the build into memory on the first static request, or runs the
+same steps in memory when there is no build. Fingerprinted files never change, so they are
+cached for a year as immutable; index.html and the plain names that older pages still
+reference are cached briefly and revalidated by ETag.
+
+On Vercel every non-API path is routed to the app as well (vercel.json), so the deployed
+web app gets the same names, encodings and headers.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import threading
+
+from flask import Response, abort, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PUBLIC_DIR = os.path.join(BASE_DIR, '../public')
+BUILD_DIR = os.environ.get('ASSET_BUILD_DIR', os.path.join(BASE_DIR, '../build/static'))
+PAGES = ('index.html',)
+HASH_LENGTH = 10
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+COMPRESS_MIN_BYTES = 256
+# s-maxage lets a CDN in front of the app (Vercel's edge) keep them too, not only browsers.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, s-maxage=31536000, immutable'
+PAGE_CACHE_CONTROL = 'public, max-age=60, must-revalidate'
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}  # in order of preference
+MANIFEST = 'manifest.json'
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_PATTERN = re.compile(r'''(\b(?:src|href)=["'])([^"'?#]+)''')
+
+
+def fingerprint(name, body):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(body).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def compress(name, body):
+    """The encoded copies of ``body`` worth sending, as {encoding: bytes}."""
+    content_type = mimetypes.guess_type(name)[0] or ''
+    if len(body) < COMPRESS_MIN_BYTES or not content_type.startswith(COMPRESSIBLE_TYPES):
+        return {}
+    encoded = {'gzip': gzip.compress(body, 9, mtime=0)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(body, quality=11)
+    return {encoding: data for encoding, data in encoded.items() if len(data) < len(body)}
+
+
+def build(public_dir=PUBLIC_DIR):
+    """Fingerprint and compress the files in ``public_dir``. Returns ``(manifest, {name: (body, encoded)})``."""
+    sources = {}
+    for name in sorted(os.listdir(public_dir)):
+        path = os.path.join(public_dir, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                sources[name] = f.read()
+    manifest = {name: fingerprint(name, body) for name, body in sources.items() if name not in PAGES}
+    files = {}
+    for name, body in sources.items():
+        if name in PAGES:
+            body = REFERENCE_PATTERN.sub(lambda m: m.group(1) + manifest.get(m.group(2), m.group(2)), body.decode()).encode()
+        files[manifest.get(name, name)] = (body, compress(name, body))
+    return manifest, files
+
+
+def write_build(build_dir=BUILD_DIR, public_dir=PUBLIC_DIR):
+    manifest, files = build(public_dir)
+    os.makedirs(build_dir, exist_ok=True)
+    for name, (body, encoded) in files.items():
+        for suffix, data in [('', body)] + [(ENCODINGS[encoding], data) for encoding, data in encoded.items()]:
+            with open(os.path.join(build_dir, name + suffix), 'wb') as f:
+                f.write(data)
+    with open(os.path.join(build_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest, files
+
+
+def read_build(build_dir=BUILD_DIR):
+    """The build written by ``write_build``, in the shape ``build`` returns, or None if there is none."""
+    try:
+        with open(os.path.join(build_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    files = {}
+    for name in list(manifest.values()) + list(PAGES):
+        with open(os.path.join(build_dir, name), 'rb') as f:
+            body = f.read()
+        encoded = {}
+        for encoding, suffix in ENCODINGS.items():
+            if os.path.exists(os.path.join(build_dir, name + suffix)):
+                with open(os.path.join(build_dir, name + suffix), 'rb') as f:
+                    encoded[encoding] = f.read()
+        files[name] = (body, encoded)
+    return manifest, files
+
+
+class Asset:
+    __slots__ = ('body', 'encoded', 'content_type', 'etag', 'cache_control')
+
+    def __init__(self, name, body, encoded, cache_control):
+        self.body = body
+        self.encoded = encoded
+        self.content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.etag = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+        self.cache_control = cache_control
+
+
+def load_table():
+    """Every servable URL path mapped to its Asset."""
+    built = read_build()
+    if built is None:
+        logger.info('No asset build in %s, building in memory', BUILD_DIR)
+        built = build()
+    manifest, files = built
+    table = {}
+    for name, (body, encoded) in files.items():
+        table[name] = Asset(name, body, encoded, PAGE_CACHE_CONTROL if name in PAGES else IMMUTABLE_CACHE_CONTROL)
+    for source, name in manifest.items():
+        body, encoded = files[name]
+        table[source] = Asset(source, body, encoded, PAGE_CACHE_CONTROL)
+    return table
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def serve(path):
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = load_table()
+    asset = _table.get(path)
+    if asset is None:
+        abort(404)
+    encoding = request.accept_encodings.best_match([encoding for encoding in ENCODINGS if encoding in asset.encoded])
+    # Each encoding is its own representation, with its own strong ETag.
+    etag = f'{asset.etag}-{encoding}' if encoding else asset.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(asset.encoded[encoding] if encoding else asset.body, mimetype=asset.content_type)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = asset.cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def serve_index():
+    return serve('index.html')
+
+
+def serve_static(path):
+    return serve(path)
+
+
+def serve_favicon():
+    return serve('favicon.ico')
+
+
+# Endpoints that need no database; app.py skips its startup work for them.
+ENDPOINTS = ('serve_index', 'serve_static', 'serve_favicon')
+
+
+def init_app(app):
+    app.add_url_rule('/', 'serve_index', serve_index)
+    app.add_url_rule('/<path:path>', 'serve_static', serve_static)
+    app.add_url_rule('/favicon.ico', 'serve_favicon', serve_favicon)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    manifest, files = write_build()
+    for name, (body, encoded) in sorted(files.items()):
+        sizes = ' '.join(f'{encoding}={len(data)}' for encoding, data in encoded.items())
+        logger.info('%s %s bytes %s', name, len(body), sizes)
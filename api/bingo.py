@@ -0,0 +1,70 @@
+"""Bitmask bingo evaluation.
+
+A card is 25 numbers in row-major order. Marks on a card are a 25-bit integer (bit i is
+cell i), called numbers are a 101-bit integer (bit n is number n), and each winning pattern
+is a precomputed cell mask, so checking a card is a handful of AND operations.
+"""
+GRID_SIZE = 5
+CELL_COUNT = GRID_SIZE * GRID_SIZE
+FREE_CELL = 12  # The centre cell is shown as a star and always counts as marked.
+FULL_CARD = (1 << CELL_COUNT) - 1
+
+
+def _cells_mask(cells):
+    mask = 0
+    for cell in cells:
+        mask |= 1 << cell
+    return mask
+
+
+ROW_MASKS = tuple(_cells_mask(row * GRID_SIZE + col for col in range(GRID_SIZE)) for row in range(GRID_SIZE))
+COLUMN_MASKS = tuple(_cells_mask(row * GRID_SIZE + col for row in range(GRID_SIZE)) for col in range(GRID_SIZE))
+DIAGONAL_MASKS = (
+    _cells_mask(i * GRID_SIZE + i for i in range(GRID_SIZE)),
+    _cells_mask(i * GRID_SIZE + (GRID_SIZE - 1 - i) for i in range(GRID_SIZE)),
+)
+LINE_MASKS = ROW_MASKS + COLUMN_MASKS + DIAGONAL_MASKS
+CORNERS_MASK = _cells_mask((0, GRID_SIZE - 1, CELL_COUNT - GRID_SIZE, CELL_COUNT - 1))
+
+PATTERNS = {
+    'lines': LINE_MASKS,
+    'corners': (CORNERS_MASK,),
+    'full_house': (FULL_CARD,),
+}
+WINNING_PATTERNS = ('lines',)
+
+
+CELL_BITS = tuple(1 << cell for cell in range(CELL_COUNT))
+NUMBER_BITS = tuple(1 << number for number in range(101))
+
+
+def called_bitmap(numbers):
+    bitmap = 0
+    for number in numbers:
+        bitmap |= NUMBER_BITS[number]
+    return bitmap
+
+
+def mark_mask(card_numbers, called, free_cell=FREE_CELL):
+    """Return the 25-bit mask of cells on ``card_numbers`` whose number is set in ``called``."""
+    mask = 0 if free_cell is None else CELL_BITS[free_cell]
+    for bit, number in zip(CELL_BITS, card_numbers):
+        if called & NUMBER_BITS[number]:
+            mask |= bit
+    return mask
+
+
+def winning_masks(mask, patterns=WINNING_PATTERNS):
+    return [line for name in patterns for line in PATTERNS[name] if mask & line == line]
+
+
+def is_winning_mask(mask, patterns=WINNING_PATTERNS):
+    for name in patterns:
+        for line in PATTERNS[name]:
+            if mask & line == line:
+                return True
+    return False
+
+
+def has_bingo(card_numbers, called_numbers, patterns=WINNING_PATTERNS):
+    return is_winning_mask(mark_mask(card_numbers, called_bitmap(called_numbers)), patterns)
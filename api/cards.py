@@ -0,0 +1,41 @@
+"""The 101 bingo cards a player can pick from, one per selectable number.
+
+Card ``n`` is the same card the old ``random.seed(n)`` code produced, so existing players
+keep their cards, but it is generated with its own ``random.Random(n)`` rather than by
+reseeding the global RNG. The table is built once, on first use, and shared read-only.
+"""
+import random
+import threading
+
+import bingo
+
+CARD_COUNT = 101
+NUMBER_RANGE = range(0, 101)
+
+_cards = None
+_bitmaps = None
+_lock = threading.Lock()
+
+
+def _build():
+    global _cards, _bitmaps
+    with _lock:
+        if _cards is None:
+            cards = tuple(tuple(sorted(random.Random(number).sample(NUMBER_RANGE, bingo.CELL_COUNT)))
+                          for number in range(CARD_COUNT))
+            _bitmaps = tuple(bingo.called_bitmap(card) for card in cards)
+            _cards = cards
+
+
+def card(number):
+    """The 25 numbers of card ``number``, in cell order."""
+    if _cards is None:
+        _build()
+    return _cards[number]
+
+
+def card_bitmap(number):
+    """Card ``number`` as a 101-bit set of its numbers."""
+    if _cards is None:
+        _build()
+    return _bitmaps[number]
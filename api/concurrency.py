@@ -0,0 +1,67 @@
+"""In-process single-flight for game mutations.
+
+Across processes, game mutations serialise on the games row. join_game, select_number and
+check_bingo take it FOR UPDATE before anything else, and draws take it FOR UPDATE SKIP LOCKED.
+Taking it first keeps the lock order games -> game_players -> users everywhere, the same
+order settlement uses. Within one process, duplicate concurrent requests (a double-tapped
+claim, several admins forcing a draw) are collapsed here, so only one of them queues on that
+row lock and the rest share its result. The async serving mode (asgi.py) does the same for
+its coroutines with AsyncSingleFlight.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Run ``fn()`` unless a call with ``key`` is already running; then wait for and return its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+flights = SingleFlight()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        """Await ``fn()`` unless a call with ``key`` is already running; then await and return its result."""
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = asyncio.ensure_future(fn())
+            call.add_done_callback(lambda _: self._calls.pop(key, None))
+        # Shielded, so a caller that goes away does not cancel the call for the others.
+        return await asyncio.shield(call)
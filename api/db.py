@@ -0,0 +1,200 @@
+"""Pooled Postgres connections, held for the lifetime of a Flask app context."""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from flask import g
+
+import metrics
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+POOL_MIN = int(os.environ.get('DB_POOL_MIN', 0))
+POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300))
+POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', 10))
+POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30))
+
+
+def connect(dsn):
+    return psycopg2.connect(dsn, cursor_factory=metrics.InstrumentedCursor)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe pool that opens connections lazily, up to ``maxconn``.
+
+    Nothing is opened until the first checkout, so a cold start pays for one
+    handshake at most. Idle connections beyond ``minconn`` are closed after
+    ``idle_timeout`` seconds, and a connection that sat idle longer than
+    ``health_check_interval`` is pinged before it is handed out again.
+    """
+
+    def __init__(self, dsn, minconn=0, maxconn=10, idle_timeout=300.0, wait_timeout=10.0,
+                 health_check_interval=30.0, connect=connect):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.health_check_interval = health_check_interval
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = []  # (conn, released_at), most recently used last
+        self._size = 0
+        self._in_use = 0
+        self._stats = {'created': 0, 'closed': 0, 'checkouts': 0, 'waits': 0,
+                       'wait_time': 0.0, 'timeouts': 0, 'health_check_failures': 0}
+
+    def getconn(self):
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                self._prune_idle()
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, released_at = None, None
+                    break
+                remaining = self.wait_timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'No connection available within {self.wait_timeout}s')
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time'] += time.monotonic() - start
+
+        if conn is not None and not self._is_healthy(conn, released_at):
+            self._discard(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect(self.dsn)
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats['created'] += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._size -= 1
+                self._stats['closed'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if discard and not conn.closed:
+            conn.close()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._stats['closed'] += len(idle)
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, size=self._size, in_use=self._in_use, idle=len(self._idle),
+                        min=self.minconn, max=self.maxconn)
+
+    def _is_healthy(self, conn, released_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - released_at < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            return False
+
+    def _discard(self, conn):
+        # The slot stays reserved for the replacement connection.
+        with self._cond:
+            self._stats['closed'] += 1
+        if not conn.closed:
+            conn.close()
+
+    def _prune_idle(self):
+        # Called with the lock held; the oldest idle connections sit at the front.
+        now = time.monotonic()
+        while len(self._idle) and self._size > self.minconn:
+            conn, released_at = self._idle[0]
+            if now - released_at < self.idle_timeout:
+                break
+            self._idle.pop(0)
+            self._size -= 1
+            self._stats['closed'] += 1
+            conn.close()
+
+
+pool = ConnectionPool(DATABASE_URL, minconn=POOL_MIN, maxconn=POOL_MAX, idle_timeout=POOL_IDLE_TIMEOUT,
+                      wait_timeout=POOL_WAIT_TIMEOUT, health_check_interval=POOL_HEALTH_CHECK_INTERVAL)
+
+
+@metrics.registry.collector
+def pool_gauges():
+    stats = pool.stats()
+    return [(f'db_pool_{key}', f'Connection pool {key}.', value) for key, value in stats.items()]
+
+
+def get_db_connection():
+    """Return the connection bound to the current app context, checking one out on first use."""
+    if 'db_conn' not in g:
+        g.db_conn = pool.getconn()
+    return g.db_conn
+
+
+def release_db_connection(exc=None):
+    # Anything the handler did not commit is rolled back by putconn.
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        pool.putconn(conn)
+
+
+@contextmanager
+def connection():
+    """Check out a connection outside of a request (startup, background jobs)."""
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db_connection)
@@ -0,0 +1,88 @@
+"""Drawing numbers for started games.
+
+Each game's draw order is a shuffle of 0-100 fixed by games.draw_seed, and
+games.draw_cursor counts the numbers drawn so far. A draw reads one entry of the
+(cached) permutation, and the called numbers of any game can be rebuilt, or replayed for
+an audit, from the seed and the cursor alone.
+"""
+import os
+import random
+import secrets
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import bingo
+import events
+import metrics
+from settlement import settle_game
+
+DRAW_INTERVAL_SECONDS = float(os.environ.get('DRAW_INTERVAL_SECONDS', 5))
+MAX_DRAWS = 100
+NUMBER_COUNT = 101
+
+# Only used for games that were already under way when draw seeds were introduced.
+_rng = secrets.SystemRandom()
+
+
+def new_seed():
+    """A seed for a game that is starting; it comes from the OS, so players cannot predict it."""
+    return secrets.randbits(63)
+
+
+@lru_cache(maxsize=1024)
+def draw_order(seed):
+    order = bytearray(range(NUMBER_COUNT))
+    random.Random(seed).shuffle(order)
+    return bytes(order)
+
+
+def called_numbers(seed, drawn):
+    """The first ``drawn`` numbers of the game seeded with ``seed``, in draw order."""
+    return list(draw_order(seed)[:drawn])
+
+
+def draw_next_number(cursor, game_id, force=False):
+    """Draw one number for a started game if it is due, inside the caller's transaction.
+
+    The games row is locked with SKIP LOCKED, so concurrent callers (scheduler threads in
+    several processes, an admin trigger) never draw twice for the same slot: whoever does not
+    get the lock, or finds the game not yet due, returns None.
+    """
+    cursor.execute('''SELECT draw_seed, draw_cursor FROM games
+                      WHERE game_id = %s AND status = 'started' AND winner_id IS NULL
+                        AND (%s OR next_draw_at IS NULL OR next_draw_at <= %s)
+                      FOR UPDATE SKIP LOCKED''', (game_id, force, datetime.now()))
+    game = cursor.fetchone()
+    if not game:
+        return None
+    seed, drawn = game
+    if drawn >= MAX_DRAWS:
+        cursor.execute("UPDATE games SET status = 'finished', end_time = %s, last_updated = %s WHERE game_id = %s",
+                       (datetime.now(), datetime.now(), game_id))
+        events.publish(cursor, game_id, 'finished')
+        return None
+    if seed is None and drawn == 0:
+        seed = new_seed()
+    if seed is not None:
+        new_number = draw_order(seed)[drawn]
+    else:
+        cursor.execute("SELECT number FROM game_draws WHERE game_id = %s", (game_id,))
+        called = {row[0] for row in cursor.fetchall()}
+        new_number = _rng.choice([number for number in range(NUMBER_COUNT) if number not in called])
+    drawn += 1
+    cursor.execute("INSERT INTO game_draws (game_id, seq, number) VALUES (%s, %s, %s)",
+                   (game_id, drawn, new_number))
+    now = datetime.now()
+    cursor.execute("UPDATE games SET draw_seed = %s, draw_cursor = %s, last_updated = %s, next_draw_at = %s WHERE game_id = %s",
+                   (seed, drawn, now, now + timedelta(seconds=DRAW_INTERVAL_SECONDS), game_id))
+    metrics.draws_total.inc()
+    events.publish(cursor, game_id, 'number_called', {'number': new_number, 'draw_seq': drawn, 'remaining': MAX_DRAWS - drawn})
+    # Only cards holding the drawn number are touched, via the card_cells inverted index.
+    cursor.execute('''UPDATE player_cards pc SET mark_mask = pc.mark_mask | (1 << cc.cell)
+                      FROM card_cells cc
+                      WHERE cc.game_id = %s AND cc.number = %s AND pc.card_id = cc.card_id
+                      RETURNING pc.card_id, pc.user_id, pc.mark_mask''', (game_id, new_number))
+    winners = [user_id for _, user_id, mask in sorted(cursor.fetchall()) if bingo.is_winning_mask(mask)]
+    if winners:
+        settle_game(cursor, game_id, winners)
+    return new_number, drawn
@@ -0,0 +1,175 @@
+"""Per-game event log and the Server-Sent Events stream built on top of it."""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from flask import Response, g, has_app_context, request
+
+import db
+
+# An open stream holds a worker thread, so streams are short and EventSource reconnects with
+# Last-Event-ID, replaying anything it missed. Keep it below the platform's request timeout.
+STREAM_MAX_SECONDS = float(os.environ.get('EVENT_STREAM_MAX_SECONDS', 25))
+STREAM_RECHECK_SECONDS = float(os.environ.get('EVENT_STREAM_RECHECK_SECONDS', 15))
+STREAM_RETRY_MS = 1000
+TERMINAL_EVENTS = ('winner', 'finished')
+# Events are also sent on this channel for the fan-out listener (see fanout.py).
+NOTIFY_ENABLED = os.environ.get('GAME_FANOUT', 'on') != 'off'
+NOTIFY_CHANNEL = 'game_events'
+NOTIFY_MAX_BYTES = 7900  # Postgres rejects payloads of 8000 bytes or more
+RECENT_EVENTS = 200
+RECENT_MAX_GAMES = 2000
+
+SELECT_EVENTS_QUERY = "SELECT seq, type, payload FROM game_events WHERE game_id = %s AND seq > %s ORDER BY seq LIMIT 500"
+BUMP_EVENT_SEQ_QUERY = "UPDATE games SET event_seq = event_seq + 1 WHERE game_id = %s RETURNING event_seq"
+INSERT_EVENT_QUERY = "INSERT INTO game_events (game_id, seq, type, payload) VALUES (%s, %s, %s, %s)"
+# NOTIFY is transactional: listeners get the event when the writer commits, and never for a rollback.
+INSERT_AND_NOTIFY_QUERY = f'''WITH event AS ({INSERT_EVENT_QUERY} RETURNING seq)
+                             SELECT pg_notify(%s, %s) FROM event'''
+
+
+class GameEventBroker:
+    """Wakes up streams in this process when one of their games gets a new event.
+
+    While the fan-out listener is connected, every process's events are delivered here and
+    the latest RECENT_EVENTS of each game are kept, so streams read them from memory.
+    Otherwise streams re-read the log, at the latest every STREAM_RECHECK_SECONDS.
+    """
+
+    def __init__(self, max_games=RECENT_MAX_GAMES):
+        self.max_games = max_games
+        self._cond = threading.Condition()
+        self._versions = {}
+        self._recent = OrderedDict()  # game_id -> deque of gap-free (seq, type, payload)
+        self._live = False
+
+    def version(self, game_id):
+        with self._cond:
+            return self._versions.get(game_id, 0)
+
+    def wake(self, game_id):
+        with self._cond:
+            self._versions[game_id] = self._versions.get(game_id, 0) + 1
+            self._cond.notify_all()
+
+    def wait(self, game_id, seen, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self._versions.get(game_id, 0) != seen, timeout)
+            return self._versions.get(game_id, 0)
+
+    def set_live(self, live):
+        """Called by the listener when it connects or drops; events may have been missed either way."""
+        with self._cond:
+            self._live = live
+            self._recent.clear()
+
+    def deliver(self, game_id, seq, event_type, payload):
+        """Record an event received from the listener and wake the game's streams.
+
+        ``payload`` is None when it was too large to send, which leaves a gap like a missed event.
+        """
+        with self._cond:
+            recent = self._recent.pop(game_id, None)
+            if recent and recent[-1][0] >= seq:
+                self._recent[game_id] = recent
+                return
+            if not recent or recent[-1][0] != seq - 1:
+                recent = deque(maxlen=RECENT_EVENTS)
+            if payload is not None:
+                recent.append((seq, event_type, payload))
+                self._recent[game_id] = recent
+                while len(self._recent) > self.max_games:
+                    self._recent.popitem(last=False)
+            self._versions[game_id] = self._versions.get(game_id, 0) + 1
+            self._cond.notify_all()
+
+    def recent(self, game_id, since):
+        """The game's events after ``since`` if all of them are held in memory, else None."""
+        with self._cond:
+            recent = self._recent.get(game_id)
+            if not self._live or not recent or recent[0][0] > since + 1:
+                return None
+            return [event for event in recent if event[0] > since]
+
+
+broker = GameEventBroker()
+
+
+def publish(cursor, game_id, event_type, payload=None):
+    """Append an event to the game's log inside the caller's transaction.
+
+    Bumping games.event_seq takes the row lock, so events of one game get gap-free,
+    strictly increasing sequence numbers. Local streams are woken once the request ends;
+    callers outside a request wake ``broker`` themselves after committing. Listeners in
+    every process get the event through NOTIFY on commit.
+    """
+    cursor.execute(BUMP_EVENT_SEQ_QUERY, (game_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    cursor.execute(*insert_event(game_id, row[0], event_type, payload))
+    if has_app_context():
+        g.setdefault('published_games', set()).add(game_id)
+    return row[0]
+
+
+def insert_event(game_id, seq, event_type, payload=None):
+    """The statement and parameters that log event ``seq`` and notify listeners, for either Postgres driver."""
+    payload = payload or {}
+    if not NOTIFY_ENABLED:
+        return INSERT_EVENT_QUERY, (game_id, seq, event_type, json.dumps(payload))
+    message = json.dumps({'game_id': game_id, 'seq': seq, 'type': event_type, 'payload': payload})
+    if len(message.encode()) > NOTIFY_MAX_BYTES:
+        message = json.dumps({'game_id': game_id, 'seq': seq, 'type': event_type})
+    return INSERT_AND_NOTIFY_QUERY, (game_id, seq, event_type, json.dumps(payload), NOTIFY_CHANNEL, message)
+
+
+def fetch_events(game_id, since):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SELECT_EVENTS_QUERY, (game_id, since))
+        return cursor.fetchall()
+
+
+def format_event(seq, event_type, payload):
+    return f"id: {seq}\nevent: {event_type}\ndata: {json.dumps(dict(payload, seq=seq))}\n\n"
+
+
+def stream_game_events(game_id, since):
+    # Connections are checked out only while reading the log, never while the stream waits.
+    deadline = time.monotonic() + STREAM_MAX_SECONDS
+    yield f"retry: {STREAM_RETRY_MS}\n\n"
+    seen = broker.version(game_id)
+    while time.monotonic() < deadline:
+        recent = broker.recent(game_id, since)
+        for seq, event_type, payload in recent if recent is not None else fetch_events(game_id, since):
+            since = seq
+            yield format_event(seq, event_type, payload)
+            if event_type in TERMINAL_EVENTS:
+                return
+        version = broker.wait(game_id, seen, min(STREAM_RECHECK_SECONDS, deadline - time.monotonic()))
+        if version == seen:
+            yield ": keepalive\n\n"
+        seen = version
+
+
+def game_events(game_id):
+    since = request.headers.get('Last-Event-ID') or request.args.get('since') or 0
+    try:
+        since = int(since)
+    except ValueError:
+        since = 0
+    return Response(stream_game_events(game_id, since), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _wake_published(exc=None):
+    for game_id in g.pop('published_games', ()):
+        broker.wake(game_id)
+
+
+def init_app(app):
+    app.add_url_rule('/api/games/<game_id>/events', 'game_events', game_events)
+    app.teardown_appcontext(_wake_published)
@@ -0,0 +1,293 @@
+"""Cross-process fan-out of game events over Postgres LISTEN/NOTIFY, and the live game snapshots it keeps.
+
+events.publish sends every event on the game_events channel inside the writer's transaction.
+Each process runs one listener thread on its own connection. It hands the events to the
+local event streams (events.broker) and applies them to an in-memory snapshot per game, so
+game_status answers from memory without touching the database.
+
+A snapshot is loaded from the database on first use and is only cached while the listener
+is connected. Joins, picks, countdowns and draws are applied in place; any other event, or a
+gap in the sequence (a dropped connection, an oversized payload), discards the snapshot and
+the next read loads it again. Winner events also drop the cached leaderboards. Processes without a listener (GAME_FANOUT=off, short-lived
+serverless handlers) read through to the database on every call.
+"""
+import json
+import logging
+import os
+import select
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import psycopg2
+
+import cards
+import db
+import events
+import leaderboard
+import metrics
+from draws import called_numbers
+
+SNAPSHOT_MAX_GAMES = int(os.environ.get('GAME_SNAPSHOT_MAX_GAMES', 5000))
+LISTEN_PING_SECONDS = 10
+RECONNECT_SECONDS = 1
+AUTO_START_SECONDS = 120
+
+logger = logging.getLogger(__name__)
+
+SELECT_SNAPSHOT_QUERY = '''SELECT g.event_seq, g.status, g.start_time, g.end_time, g.prize_amount, g.winner_id, g.bet_amount,
+                                  g.countdown_start,
+                                  ARRAY(SELECT user_id FROM game_players WHERE game_id = g.game_id ORDER BY joined_at),
+                                  ARRAY(SELECT ARRAY[user_id, selected_number] FROM game_players
+                                        WHERE game_id = g.game_id AND selected_number IS NOT NULL),
+                                  g.draw_seed, g.draw_cursor,
+                                  CASE WHEN g.draw_seed IS NULL THEN ARRAY(SELECT number FROM game_draws WHERE game_id = g.game_id ORDER BY seq) END
+                           FROM games g WHERE g.game_id = %s'''
+
+fanout_events = metrics.registry.counter('game_fanout_events_total', 'Game events received from the fan-out listener.')
+snapshot_loads = metrics.registry.counter('game_snapshot_loads_total', 'Game snapshots read from the database.')
+
+
+class GameSnapshot:
+    """What game_status reports about one game, as of event ``version``. Never modified once built."""
+
+    __slots__ = ('version', 'status', 'start_time', 'end_time', 'prize_amount', 'winner_id', 'bet_amount',
+                 'countdown_start', 'players', 'selections', 'numbers')
+
+    def __init__(self, version, status, start_time, end_time, prize_amount, winner_id, bet_amount, countdown_start,
+                 players, selections, numbers):
+        self.version = version
+        self.status = status
+        self.start_time = start_time
+        self.end_time = end_time
+        self.prize_amount = prize_amount
+        self.winner_id = winner_id
+        self.bet_amount = bet_amount
+        self.countdown_start = countdown_start
+        self.players = players  # user ids in join order
+        self.selections = selections  # user_id -> selected (card) number
+        self.numbers = numbers  # called numbers in draw order
+
+    @classmethod
+    def load(cls, cursor, game_id):
+        cursor.execute(SELECT_SNAPSHOT_QUERY, (game_id,))
+        return cls.from_row(cursor.fetchone())
+
+    @classmethod
+    def from_row(cls, row):
+        """Build a snapshot from a SELECT_SNAPSHOT_QUERY row; None for a missing game."""
+        snapshot_loads.inc()
+        if not row:
+            return None
+        *fields, players, selections, seed, drawn, numbers = row
+        if seed is not None:
+            numbers = called_numbers(seed, drawn)
+        return cls(*fields, tuple(players), dict(selections), tuple(numbers))
+
+    def _replace(self, **changes):
+        return GameSnapshot(**dict({name: getattr(self, name) for name in self.__slots__}, **changes))
+
+    def apply(self, seq, event_type, payload):
+        """The snapshot after event ``seq``, or None if the event alone cannot bring it up to date."""
+        if seq != self.version + 1 or payload is None:
+            return None
+        if event_type == 'joined':
+            user_id = int(payload['user_id'])
+            return self._replace(version=seq, players=self.players if user_id in self.players else self.players + (user_id,))
+        if event_type == 'number_selected' and 'user_id' in payload:
+            return self._replace(version=seq, selections={**self.selections, int(payload['user_id']): payload['selected_number']})
+        if event_type == 'countdown':
+            return self._replace(version=seq, countdown_start=datetime.fromisoformat(payload['countdown_start']))
+        if event_type == 'number_called' and payload['draw_seq'] == len(self.numbers) + 1:
+            return self._replace(version=seq, numbers=self.numbers + (payload['number'],))
+        return None
+
+    def auto_start_due(self):
+        return (self.status == 'waiting' and self.countdown_start is not None and len(self.players) > 2
+                and (datetime.now() - self.countdown_start).total_seconds() > AUTO_START_SECONDS)
+
+    def status_body(self, user_id, since):
+        """The game_status response: everything, or with ``since`` only later draws and no card."""
+        body = {
+            'status': self.status,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'numbers_called': [str(n) for n in self.numbers[since or 0:]],
+            'draw_seq': len(self.numbers),
+            'version': self.version,
+            'prize_amount': self.prize_amount,
+            'winner_id': self.winner_id,
+            'players': [str(p) for p in self.players],
+            'selected_numbers': [str(n) for n in sorted(self.selections.values())] if self.status == 'waiting' else [],
+            'bet_amount': self.bet_amount
+        }
+        if since is None:
+            selected = self.selections.get(user_id)
+            body['card_numbers'] = [str(n) for n in cards.card(selected)] if selected is not None else []
+        else:
+            body['since'] = since
+        return body
+
+
+class SnapshotCache:
+    """Snapshots of recently read games, trusted only while the listener is connected."""
+
+    def __init__(self, max_games=SNAPSHOT_MAX_GAMES):
+        self.max_games = max_games
+        self._lock = threading.Lock()
+        self._games = OrderedDict()
+        self._latest = OrderedDict()  # highest event seq notified per game
+        self._live = False
+        self._generation = 0
+
+    def get_or_load(self, game_id, loader):
+        snapshot, generation = self.lookup(game_id)
+        if snapshot is None:
+            snapshot = loader()
+            self.store(game_id, snapshot, generation)
+        return snapshot
+
+    def lookup(self, game_id):
+        """``(snapshot, None)`` if cached, else ``(None, generation)`` to pass to ``store`` with a fresh load."""
+        with self._lock:
+            snapshot = self._games.get(game_id)
+            if snapshot is not None:
+                self._games.move_to_end(game_id)
+                return snapshot, None
+            return None, self._generation
+
+    def store(self, game_id, snapshot, generation):
+        with self._lock:
+            # Not kept if an event arrived while it loaded, or the listener reconnected meanwhile.
+            if (snapshot is not None and self._live and generation == self._generation
+                    and self._latest.get(game_id, 0) <= snapshot.version):
+                self._games[game_id] = snapshot
+                while len(self._games) > self.max_games:
+                    self._games.popitem(last=False)
+
+    def apply(self, game_id, seq, event_type, payload):
+        with self._lock:
+            self._latest[game_id] = max(seq, self._latest.pop(game_id, 0))
+            while len(self._latest) > self.max_games:
+                self._latest.popitem(last=False)
+            snapshot = self._games.get(game_id)
+            if snapshot is None or seq <= snapshot.version:
+                return
+            updated = snapshot.apply(seq, event_type, payload)
+            if updated is None:
+                del self._games[game_id]
+            else:
+                self._games[game_id] = updated
+
+    def discard(self, game_id):
+        with self._lock:
+            self._games.pop(game_id, None)
+
+    def set_live(self, live):
+        with self._lock:
+            self._live = live
+            self._generation += 1
+            self._games.clear()
+            self._latest.clear()
+
+    @property
+    def live(self):
+        return self._live
+
+    def __len__(self):
+        return len(self._games)
+
+
+snapshots = SnapshotCache()
+
+
+class GameListener:
+    """Background thread that LISTENs on the events channel and keeps this process's caches current."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='game-listener', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception('Game event listener failed, reconnecting')
+            finally:
+                snapshots.set_live(False)
+                events.broker.set_live(False)
+                _notify(None)
+            self._stop.wait(RECONNECT_SECONDS)
+
+    def _listen(self):
+        # A dedicated connection outside the pool: it is held for the life of the process.
+        conn = psycopg2.connect(db.DATABASE_URL)
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f'LISTEN {events.NOTIFY_CHANNEL}')
+            # Anything published before LISTEN was missed, so the caches start out empty.
+            snapshots.set_live(True)
+            events.broker.set_live(True)
+            _notify(None)
+            while not self._stop.is_set():
+                if select.select([conn], [], [], LISTEN_PING_SECONDS)[0]:
+                    conn.poll()
+                else:
+                    cursor.execute('SELECT 1')  # notices a dead connection instead of waiting on it forever
+                while conn.notifies:
+                    handle(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+
+_subscribers = []
+
+
+def subscribe(callback):
+    """Call ``callback(game_id)`` on the listener thread after each event has been applied.
+
+    ``game_id`` is None when the listener connects or drops, as any game may have changed.
+    """
+    _subscribers.append(callback)
+
+
+def _notify(game_id):
+    for callback in _subscribers:
+        callback(game_id)
+
+
+def handle(message):
+    event = json.loads(message)
+    game_id, seq = event['game_id'], event.get('seq')
+    fanout_events.inc()
+    if seq is None:
+        # Archived: the game is gone from the live tables.
+        snapshots.discard(game_id)
+        return
+    snapshots.apply(game_id, seq, event['type'], event.get('payload'))
+    if event['type'] == 'winner':
+        leaderboard.cache.invalidate()
+    events.broker.deliver(game_id, seq, event['type'], event.get('payload'))
+    _notify(game_id)
+
+
+listener = GameListener()
+
+
+@metrics.registry.collector
+def snapshot_gauges():
+    return [('game_snapshots_cached', 'Live game snapshots held in memory.', len(snapshots))]
@@ -0,0 +1,152 @@
+"""Leaderboard reads served from the users (score, user_id) index and a short in-process cache.
+
+Ranking order is score descending, then user_id descending, so every page and neighbour
+lookup is a single index range scan. Ranks are competition ranks: 1 + the number of users
+with a strictly higher score.
+"""
+import os
+import threading
+import time
+
+from flask import g, has_app_context, jsonify, request
+
+from db import get_db_connection
+
+CACHE_TTL_SECONDS = float(os.environ.get('LEADERBOARD_TTL_SECONDS', 30))
+CACHE_MAX_ENTRIES = 1024
+HEAD_SIZE = 10
+MAX_PAGE_SIZE = 100
+MAX_NEIGHBOURS = 10
+
+
+class TTLCache:
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+        value = loader()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = TTLCache(CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES)
+
+
+def record_wins(cursor, user_ids):
+    """Count a win for each of ``user_ids`` inside the caller's transaction. Returns their usernames.
+
+    Cached rankings are dropped once the request ends, after its commit; dropping them earlier
+    would let a read before the commit cache the old scores again. Every process with a
+    listener also drops them when the winner event arrives (fanout.py); without one, other
+    processes see the new scores once their cache entries expire.
+    """
+    cursor.execute("UPDATE users SET score = score + 1 WHERE user_id = ANY(%s) RETURNING username", (list(user_ids),))
+    usernames = [row[0] for row in cursor.fetchall()]
+    if has_app_context():
+        g.leaderboard_changed = True
+    return usernames
+
+
+def _invalidate_changed(exc=None):
+    if g.pop('leaderboard_changed', False):
+        cache.invalidate()
+
+
+# Ranks come from one count at the page's highest entry: ties with it share its rank, which
+# may have started on an earlier page; every other rank is the number of users ahead of that
+# entry plus its rank() within the page.
+RANKED_QUERY = '''WITH page AS MATERIALIZED (SELECT user_id, username, score FROM users {where} ORDER BY {order} LIMIT %s),
+    top AS MATERIALIZED (SELECT score, user_id FROM page ORDER BY score DESC, user_id DESC LIMIT 1),
+    ahead AS MATERIALIZED (SELECT t.score, COUNT(h.user_id) FILTER (WHERE h.score > t.score) AS higher,
+                                  COUNT(h.user_id) AS before
+                           FROM top t LEFT JOIN users h ON (h.score, h.user_id) > (t.score, t.user_id)
+                           GROUP BY t.score)
+    SELECT p.user_id, p.username, p.score,
+           CASE WHEN p.score = a.score THEN a.higher + 1
+                ELSE a.before + rank() OVER (ORDER BY p.score DESC) END AS rank
+    FROM page p CROSS JOIN ahead a
+    ORDER BY p.score DESC, p.user_id DESC'''
+
+
+def _ranked(cursor, where, order, params):
+    cursor.execute(RANKED_QUERY.format(where=where, order=order), params)
+    return [{'rank': rank, 'user_id': user_id, 'username': username or 'Anonymous', 'score': score}
+            for user_id, username, score, rank in cursor.fetchall()]
+
+
+def head(cursor, limit=HEAD_SIZE):
+    def load():
+        cursor.execute("SELECT username, score FROM users ORDER BY score DESC, user_id DESC LIMIT %s", (limit,))
+        return [{'username': row[0] or 'Anonymous', 'score': row[1]} for row in cursor.fetchall()]
+    return cache.get_or_load(('head', limit), load)
+
+
+def page(cursor, limit, after=None):
+    def load():
+        if after is None:
+            entries = _ranked(cursor, '', 'score DESC, user_id DESC', (limit,))
+        else:
+            entries = _ranked(cursor, 'WHERE (score, user_id) < (%s, %s)', 'score DESC, user_id DESC', (*after, limit))
+        next_cursor = f"{entries[-1]['score']}:{entries[-1]['user_id']}" if len(entries) == limit else None
+        return {'entries': entries, 'next_cursor': next_cursor}
+    return cache.get_or_load(('page', limit, after), load)
+
+
+def around(cursor, user_id, neighbours):
+    def load():
+        cursor.execute("SELECT score FROM users WHERE user_id = %s", (user_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        score = row[0]
+        cursor.execute("SELECT score, user_id FROM users WHERE (score, user_id) > (%s, %s) ORDER BY score, user_id LIMIT %s",
+                       (score, user_id, neighbours))
+        above = cursor.fetchall()
+        top = above[-1] if above else (score, user_id)
+        entries = _ranked(cursor, 'WHERE (score, user_id) <= (%s, %s)', 'score DESC, user_id DESC',
+                          (*top, len(above) + neighbours + 1))
+        me = next(entry for entry in entries if entry['user_id'] == user_id)
+        return {'rank': me['rank'], 'score': score, 'entries': entries}
+    return cache.get_or_load(('around', user_id, neighbours), load)
+
+
+def leaderboard_page():
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PAGE_SIZE)
+    after = request.args.get('cursor')
+    if after:
+        try:
+            score, user_id = (int(part) for part in after.split(':'))
+        except ValueError:
+            return jsonify({'status': 'failed', 'reason': 'Invalid cursor'}), 400
+        after = (score, user_id)
+    return jsonify(page(get_db_connection().cursor(), limit, after))
+
+
+def leaderboard_me():
+    user_id = request.args.get('user_id', type=int)
+    neighbours = min(max(request.args.get('neighbours', 2, type=int), 0), MAX_NEIGHBOURS)
+    result = around(get_db_connection().cursor(), user_id, neighbours)
+    if result is None:
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify(result)
+
+
+def init_app(app):
+    app.add_url_rule('/api/leaderboard/page', 'leaderboard_page', leaderboard_page)
+    app.add_url_rule('/api/leaderboard/me', 'leaderboard_me', leaderboard_me)
+    app.teardown_appcontext(_invalidate_changed)
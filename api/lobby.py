@@ -0,0 +1,151 @@
+"""Matchmaking lobby: players pick a bet tier and are seated in an open waiting game of that tier.
+
+Seating in a tier is serialised by a per-tier lock in this process, held until the join is
+committed, and by a SKIP LOCKED row lock on the chosen game across processes. The fullest
+open game is filled first, so players end up in fewer, fuller games instead of each
+opening their own. A new game is only created when every open game is full or row-locked.
+GAME_CAPACITY only limits lobby seating; players joining a game by id fill it up to the
+MAX_PLAYERS that the card numbers allow.
+"""
+import os
+import secrets
+import threading
+from datetime import datetime
+
+from flask import jsonify, request
+
+import events
+import wallet
+from db import get_db_connection
+from leaderboard import TTLCache
+
+BET_TIERS = (10, 50, 100, 200)
+# Each player needs a distinct card number (0-100), so no game can seat more than 101.
+MAX_PLAYERS = 101
+# The lobby stops seating into a game at GAME_CAPACITY; a direct join_game can still fill it to MAX_PLAYERS.
+GAME_CAPACITY = min(int(os.environ.get('LOBBY_GAME_CAPACITY', 20)), MAX_PLAYERS)
+SNAPSHOT_TTL_SECONDS = float(os.environ.get('LOBBY_SNAPSHOT_TTL_SECONDS', 2))
+SNAPSHOT_GAMES_PER_TIER = 10
+
+SELECT_SEATED_GAME_QUERY = '''SELECT g.game_id FROM games g JOIN game_players p ON p.game_id = g.game_id
+                              WHERE p.user_id = %s AND g.status = 'waiting' AND g.bet_amount = %s LIMIT 1'''
+# Picks and locks in one statement, so a game another worker is seating into is skipped for
+# the next fullest one instead of opening a new game.
+LOCK_OPEN_GAME_QUERY = '''SELECT g.game_id FROM games g
+                          WHERE g.status = 'waiting' AND g.bet_amount = %s AND g.game_id <> ALL(%s)
+                            AND (SELECT COUNT(*) FROM game_players WHERE game_id = g.game_id) < %s
+                          ORDER BY (SELECT COUNT(*) FROM game_players WHERE game_id = g.game_id) DESC, g.game_id
+                          LIMIT 1
+                          FOR UPDATE SKIP LOCKED'''
+SELECT_SNAPSHOT_QUERY = '''SELECT g.bet_amount, g.game_id, COUNT(p.user_id), g.countdown_start
+                           FROM games g LEFT JOIN game_players p ON p.game_id = g.game_id
+                           WHERE g.status = 'waiting'
+                           GROUP BY g.game_id
+                           ORDER BY g.bet_amount, COUNT(p.user_id) DESC'''
+
+_tier_locks = {tier: threading.Lock() for tier in BET_TIERS}
+snapshot_cache = TTLCache(SNAPSHOT_TTL_SECONDS, 1)
+
+
+def new_game_id(user_id):
+    # The random suffix keeps ids unique across the archive too, even for games one user opens within a second.
+    return f"MP{user_id}{int(datetime.now().timestamp())}{secrets.token_hex(2)}"
+
+
+def open_game(cursor, user_id, bet_amount):
+    """Create a waiting game with ``user_id`` as its first player, debiting the stake.
+
+    Returns the game id, or None if the wallet cannot cover the bet.
+    """
+    game_id = new_game_id(user_id)
+    if wallet.debit(cursor, user_id, bet_amount, 'bet', game_id) is None:
+        return None
+    cursor.execute("INSERT INTO games (game_id, status, bet_amount, countdown_start) VALUES (%s, 'waiting', %s, NULL)",
+                   (game_id, bet_amount))
+    cursor.execute("INSERT INTO game_players (game_id, user_id) VALUES (%s, %s)", (game_id, user_id))
+    events.publish(cursor, game_id, 'joined', {'user_id': user_id, 'players': 1})
+    return game_id
+
+
+def lock_open_game(cursor, bet_amount):
+    """Lock the fullest open game of the tier that has room and no other seating in progress."""
+    full = []
+    while True:
+        cursor.execute(LOCK_OPEN_GAME_QUERY, (bet_amount, full, GAME_CAPACITY))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        # Counted again under the row lock: a join committed since the statement began is not in its count.
+        cursor.execute("SELECT COUNT(*) FROM game_players WHERE game_id = %s", (row[0],))
+        if cursor.fetchone()[0] < GAME_CAPACITY:
+            return row[0]
+        full.append(row[0])
+
+
+def seat(cursor, user_id, bet_amount):
+    """Seat ``user_id`` in the fullest open game of the tier, opening one if none has room.
+
+    Returns ``(game_id, players)``, or None if the wallet cannot cover the bet. A player
+    already waiting in a game of this tier gets that game back, without a second debit.
+    """
+    cursor.execute(SELECT_SEATED_GAME_QUERY, (user_id, bet_amount))
+    seated = cursor.fetchone()
+    if seated:
+        cursor.execute("SELECT COUNT(*) FROM game_players WHERE game_id = %s", (seated[0],))
+        return seated[0], cursor.fetchone()[0]
+    game_id = lock_open_game(cursor, bet_amount)
+    if game_id is None:
+        game_id = open_game(cursor, user_id, bet_amount)
+        return (game_id, 1) if game_id else None
+    if wallet.debit(cursor, user_id, bet_amount, 'bet', game_id) is None:
+        return None
+    cursor.execute("INSERT INTO game_players (game_id, user_id) VALUES (%s, %s)", (game_id, user_id))
+    cursor.execute("SELECT COUNT(*) FROM game_players WHERE game_id = %s", (game_id,))
+    players = cursor.fetchone()[0]
+    events.publish(cursor, game_id, 'joined', {'user_id': user_id, 'players': players})
+    return game_id, players
+
+
+def snapshot(cursor):
+    def load():
+        cursor.execute(SELECT_SNAPSHOT_QUERY)
+        tiers = {tier: {'bet_amount': tier, 'open_games': 0, 'waiting_players': 0, 'games': []} for tier in BET_TIERS}
+        for bet_amount, game_id, players, countdown_start in cursor.fetchall():
+            tier = tiers.get(bet_amount)
+            if tier is None:
+                continue
+            tier['open_games'] += 1
+            tier['waiting_players'] += players
+            if len(tier['games']) < SNAPSHOT_GAMES_PER_TIER:
+                tier['games'].append({'game_id': game_id, 'players': players,
+                                      'countdown_start': countdown_start.isoformat() if countdown_start else None})
+        return {'tiers': list(tiers.values()), 'capacity': GAME_CAPACITY}
+    return snapshot_cache.get_or_load('lobby', load)
+
+
+def lobby():
+    return jsonify(snapshot(get_db_connection().cursor()))
+
+
+def lobby_join():
+    user_id = request.json.get('user_id')
+    bet_amount = request.json.get('bet_amount')
+    if bet_amount not in BET_TIERS:
+        return jsonify({'status': 'failed', 'reason': 'Invalid bet amount'}), 400
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    # Held through the commit, so the next player of this tier sees the seat just taken.
+    with _tier_locks[bet_amount]:
+        seated = seat(cursor, user_id, bet_amount)
+        if seated is None:
+            conn.rollback()
+            return jsonify({'status': 'failed', 'reason': 'Insufficient wallet'}), 400
+        conn.commit()
+    snapshot_cache.invalidate()
+    game_id, players = seated
+    return jsonify({'status': 'waiting', 'game_id': game_id, 'players': players, 'bet_amount': bet_amount})
+
+
+def init_app(app):
+    app.add_url_rule('/api/lobby', 'lobby', lobby)
+    app.add_url_rule('/api/lobby/join', 'lobby_join', lobby_join, methods=['POST'])
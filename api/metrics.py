@@ -0,0 +1,229 @@
+"""Request, SQL and game metrics in Prometheus text format, plus an opt-in slow-request profiler."""
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+
+import psycopg2.extensions
+from flask import Response, g, has_app_context, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+PROFILE_SLOW_REQUESTS_MS = float(os.environ.get('PROFILE_SLOW_REQUESTS_MS', 0))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_MS', 10)) / 1000
+PROFILE_TOP_STACKS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def _labels_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels_text(self.labels, key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.setdefault(label_values, [0] * (len(self.buckets) + 2))
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._values.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', _labels_text(self.labels + ('le',), key + (bound,)), cumulative))
+            samples.append((f'{self.name}_bucket', _labels_text(self.labels + ('le',), key + ('+Inf',)), series[-1]))
+            samples.append((f'{self.name}_sum', _labels_text(self.labels, key), series[-2]))
+            samples.append((f'{self.name}_count', _labels_text(self.labels, key), series[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register ``fn() -> [(name, help, value)]`` for gauges read at scrape time."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{labels} {value}' for name, labels, value in metric.samples())
+        for collect in self._collectors:
+            try:
+                gauges = collect()
+            except Exception:
+                logger.exception('Metrics collector %s failed', collect.__name__)
+                continue
+            for name, help_text, value in gauges:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_seconds = registry.histogram('http_request_duration_seconds', 'Request latency by route.', ('method', 'route', 'status'))
+request_statements = registry.histogram('http_request_db_statements', 'SQL statements per request by route.', ('route',),
+                                        buckets=STATEMENT_BUCKETS)
+request_db_seconds = registry.histogram('http_request_db_seconds', 'Time spent in SQL per request by route.', ('route',))
+db_statements_total = registry.counter('db_statements_total', 'SQL statements executed.')
+db_seconds_total = registry.counter('db_seconds_total', 'Time spent executing SQL.')
+draws_total = registry.counter('bingo_draws_total', 'Numbers drawn across all games.')
+settlement_seconds = registry.histogram('bingo_settlement_duration_seconds', 'Time to settle a finished game.')
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that counts statements and SQL time, globally and for the current request."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - start
+            db_statements_total.inc()
+            db_seconds_total.inc(elapsed)
+            if has_app_context() and 'metrics_start' in g:
+                g.db_statements += 1
+                g.db_seconds += elapsed
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of in-flight request threads and logs the hottest ones for slow requests."""
+
+    def __init__(self, threshold_seconds, interval):
+        self.threshold = threshold_seconds
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = {}  # thread id -> Counter of stacks
+        self._thread = None
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = StackCounter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='slow-request-profiler', daemon=True)
+                self._thread.start()
+
+    def end(self, route, duration):
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+        if not stacks or duration < self.threshold:
+            return
+        for stack, hits in stacks.most_common(PROFILE_TOP_STACKS):
+            logger.warning('slow_request_profile route=%s duration_ms=%.1f samples=%d stack=%s',
+                           route, duration * 1000, hits, ' <- '.join(stack))
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    stack = []
+                    while frame is not None and len(stack) < 12:
+                        stack.append(f'{frame.f_code.co_name}:{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}')
+                        frame = frame.f_back
+                    if stack:
+                        stacks[tuple(stack)] += 1
+
+
+profiler = SlowRequestProfiler(PROFILE_SLOW_REQUESTS_MS / 1000, PROFILE_INTERVAL_SECONDS) if PROFILE_SLOW_REQUESTS_MS else None
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.db_statements = 0
+    g.db_seconds = 0.0
+    if profiler:
+        profiler.begin()
+
+
+def _after_request(response):
+    if 'metrics_start' not in g:
+        return response
+    duration = time.perf_counter() - g.metrics_start
+    route = _route()
+    request_seconds.observe(duration, request.method, route, response.status_code)
+    request_statements.observe(g.db_statements, route)
+    request_db_seconds.observe(g.db_seconds, route)
+    if profiler:
+        profiler.end(route, duration)
+    logger.debug('request method=%s route=%s status=%s duration_ms=%.1f statements=%d db_ms=%.1f',
+                 request.method, route, response.status_code, duration * 1000, g.db_statements, g.db_seconds * 1000)
+    return response
+
+
+def metrics_endpoint():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    app.add_url_rule('/api/metrics', 'api_metrics', metrics_endpoint)
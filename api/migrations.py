@@ -0,0 +1,309 @@
+"""Versioned schema migrations.
+
+Applied versions are recorded in schema_migrations. Run ``python api/migrations.py`` at
+deploy time; otherwise the first request of each process applies whatever is pending,
+under an advisory lock so concurrent cold starts do not race. Once the schema is current
+a process pays one SELECT for the check, and nothing at all after that.
+SCHEMA_MIGRATIONS=deploy skips the runtime check for deployments that always migrate first.
+"""
+import logging
+import os
+import threading
+
+import psycopg2.errors
+
+import bingo
+import db
+
+SCHEMA_MIGRATIONS = os.environ.get('SCHEMA_MIGRATIONS', 'auto')
+MIGRATION_LOCK_KEY = 0x7a656269  # pg_advisory_xact_lock key shared by every process
+
+logger = logging.getLogger(__name__)
+
+CREATE_VERSION_TABLE_QUERY = '''CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)'''
+SELECT_VERSION_QUERY = "SELECT COALESCE(MAX(version), 0) FROM schema_migrations"
+INSERT_VERSION_QUERY = "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)"
+
+
+def create_base_tables(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        phone TEXT,
+        username TEXT UNIQUE,
+        name TEXT,
+        wallet INTEGER DEFAULT 10,
+        score INTEGER DEFAULT 0,
+        referral_code TEXT UNIQUE,
+        referred_by TEXT,
+        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        role TEXT DEFAULT 'user',
+        invalid_bingo_count INTEGER DEFAULT 0
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS referrals (
+        referral_id SERIAL PRIMARY KEY,
+        referrer_id INTEGER,
+        referee_id INTEGER,
+        bonus_credited BOOLEAN DEFAULT FALSE,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS transactions (
+        tx_id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        amount INTEGER,
+        method TEXT,
+        status TEXT DEFAULT 'pending',
+        verification_code TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS games (
+        game_id TEXT PRIMARY KEY,
+        players TEXT DEFAULT '',  -- Legacy, superseded by game_players
+        selected_numbers TEXT DEFAULT '',  -- Legacy, superseded by game_players.selected_number
+        status TEXT DEFAULT 'waiting',
+        start_time TIMESTAMP,
+        end_time TIMESTAMP,
+        numbers_called TEXT DEFAULT '',  -- Legacy, superseded by game_draws
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        prize_amount INTEGER DEFAULT 0,
+        winner_id INTEGER DEFAULT NULL,
+        bet_amount INTEGER DEFAULT 0,
+        countdown_start TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS player_cards (
+        card_id SERIAL PRIMARY KEY,
+        game_id TEXT,
+        user_id INTEGER,
+        card_numbers TEXT,  -- Comma-separated 25 numbers
+        FOREIGN KEY (game_id) REFERENCES games(game_id)
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS withdrawals (
+        withdraw_id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        amount INTEGER,
+        status TEXT DEFAULT 'pending',
+        request_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        method TEXT,
+        admin_note TEXT
+    )''')
+
+
+def create_game_players_and_draws(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_players (
+        game_id TEXT REFERENCES games(game_id),
+        user_id BIGINT,
+        selected_number INTEGER,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (game_id, user_id)
+    )''')
+    cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS game_players_selected_number_idx
+        ON game_players (game_id, selected_number) WHERE selected_number IS NOT NULL''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_draws (
+        game_id TEXT REFERENCES games(game_id),
+        seq INTEGER,
+        number INTEGER,
+        called_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (game_id, seq),
+        UNIQUE (game_id, number)
+    )''')
+    migrate_legacy_game_columns(cursor)
+
+
+def migrate_legacy_game_columns(cursor):
+    """Copy the old comma-separated games.players / numbers_called / selected_numbers into
+    game_players and game_draws, then blank them so the copy only ever happens once."""
+    cursor.execute('''INSERT INTO game_players (game_id, user_id, joined_at)
+        SELECT g.game_id, p.user_id::BIGINT, CURRENT_TIMESTAMP + p.ord * INTERVAL '1 microsecond'
+        FROM games g, unnest(string_to_array(g.players, ',')) WITH ORDINALITY AS p(user_id, ord)
+        WHERE p.user_id <> ''
+        ON CONFLICT DO NOTHING''')
+    cursor.execute('''INSERT INTO game_draws (game_id, seq, number)
+        SELECT g.game_id, d.ord, d.number::INTEGER
+        FROM games g, unnest(string_to_array(g.numbers_called, ',')) WITH ORDINALITY AS d(number, ord)
+        WHERE d.number <> ''
+        ON CONFLICT DO NOTHING''')
+    # Legacy selected_numbers carry no owner and cannot be attributed to a player; they are dropped.
+    cursor.execute("UPDATE games SET players = '', numbers_called = '', selected_numbers = '' "
+                   "WHERE players <> '' OR numbers_called <> '' OR selected_numbers <> ''")
+
+
+def create_game_events(cursor):
+    cursor.execute("ALTER TABLE games ADD COLUMN IF NOT EXISTS event_seq INTEGER DEFAULT 0")
+    cursor.execute("ALTER TABLE games ADD COLUMN IF NOT EXISTS next_draw_at TIMESTAMP")
+    cursor.execute("CREATE INDEX IF NOT EXISTS games_next_draw_idx ON games (next_draw_at) WHERE status = 'started'")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_events (
+        game_id TEXT REFERENCES games(game_id),
+        seq INTEGER,
+        type TEXT,
+        payload JSONB,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (game_id, seq)
+    )''')
+
+
+def create_card_marks(cursor):
+    cursor.execute(f"ALTER TABLE player_cards ADD COLUMN IF NOT EXISTS mark_mask INTEGER DEFAULT {1 << bingo.FREE_CELL}")
+    cursor.execute("ALTER TABLE game_players ADD COLUMN IF NOT EXISTS winner BOOLEAN DEFAULT FALSE")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS card_cells (
+        game_id TEXT,
+        number INTEGER,
+        card_id INTEGER REFERENCES player_cards(card_id),
+        cell INTEGER,
+        PRIMARY KEY (game_id, number, card_id)
+    )''')
+    backfill_card_cells(cursor)
+
+
+def backfill_card_cells(cursor):
+    """Index cards created before card_cells existed and catch their marks up with past draws."""
+    cursor.execute('''INSERT INTO card_cells (game_id, number, card_id, cell)
+        SELECT pc.game_id, c.number::INTEGER, pc.card_id, c.ord - 1
+        FROM player_cards pc, unnest(string_to_array(pc.card_numbers, ',')) WITH ORDINALITY AS c(number, ord)
+        WHERE NOT EXISTS (SELECT 1 FROM card_cells WHERE card_id = pc.card_id)
+        ON CONFLICT DO NOTHING
+        RETURNING card_id''')
+    card_ids = list({row[0] for row in cursor.fetchall()})
+    cursor.execute('''UPDATE player_cards pc SET mark_mask = %s | COALESCE((
+            SELECT bit_or(1 << cc.cell) FROM card_cells cc
+            JOIN game_draws d ON d.game_id = cc.game_id AND d.number = cc.number
+            WHERE cc.card_id = pc.card_id), 0)
+        WHERE pc.card_id = ANY(%s)''', (1 << bingo.FREE_CELL, card_ids))
+
+
+def create_lookup_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS users_score_idx ON users (score, user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS referrals_credited_referrer_idx ON referrals (referrer_id) WHERE bonus_credited")
+    cursor.execute("CREATE INDEX IF NOT EXISTS referrals_referee_idx ON referrals (referee_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS game_players_user_idx ON game_players (user_id, joined_at)")
+
+
+def create_wallet_ledger(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS wallet_ledger (
+        entry_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        amount INTEGER,
+        balance_after INTEGER,
+        reason TEXT,
+        ref TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS wallet_ledger_user_idx ON wallet_ledger (user_id, entry_id)")
+
+
+def create_draw_sequence(cursor):
+    cursor.execute("ALTER TABLE games ADD COLUMN IF NOT EXISTS draw_seed BIGINT")
+    cursor.execute("ALTER TABLE games ADD COLUMN IF NOT EXISTS draw_cursor INTEGER DEFAULT 0")
+    # Games already under way keep a NULL seed and finish on the legacy path in draws.py.
+    cursor.execute('''UPDATE games g SET draw_cursor = d.drawn
+        FROM (SELECT game_id, COUNT(*) AS drawn FROM game_draws GROUP BY game_id) d
+        WHERE d.game_id = g.game_id AND g.draw_cursor <> d.drawn''')
+
+
+def create_lobby_index(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS games_status_bet_idx ON games (status, bet_amount)")
+
+
+def create_archive(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS player_cards_game_user_idx ON player_cards (game_id, user_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS games_finished_idx ON games (end_time) WHERE status = 'finished'")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS games_archive (
+        game_id TEXT PRIMARY KEY,
+        bet_amount INTEGER,
+        prize_amount INTEGER,
+        winner_id BIGINT,
+        player_count INTEGER,
+        start_time TIMESTAMP,
+        end_time TIMESTAMP,
+        draw_seed BIGINT,
+        draws SMALLINT[],
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_history (
+        user_id BIGINT,
+        game_id TEXT,
+        ended_at TIMESTAMP,
+        bet_amount INTEGER,
+        selected_number INTEGER,
+        card_numbers SMALLINT[],
+        won BOOLEAN,
+        payout INTEGER,
+        PRIMARY KEY (user_id, ended_at, game_id)
+    )''')
+
+
+def create_withdrawal_queue_index(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS withdrawals_pending_idx ON withdrawals (request_time, withdraw_id) WHERE status = 'pending'")
+
+
+# Append only: a version, once deployed, is never edited or renumbered. Every step is
+# idempotent so databases set up by the old import-time init_db() migrate cleanly.
+MIGRATIONS = [
+    (1, 'base tables', create_base_tables),
+    (2, 'game_players and game_draws', create_game_players_and_draws),
+    (3, 'game events', create_game_events),
+    (4, 'card marks', create_card_marks),
+    (5, 'lookup indexes', create_lookup_indexes),
+    (6, 'wallet ledger', create_wallet_ledger),
+    (7, 'draw sequence', create_draw_sequence),
+    (8, 'lobby index', create_lobby_index),
+    (9, 'game archive', create_archive),
+    (10, 'withdrawal queue index', create_withdrawal_queue_index),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cursor):
+    try:
+        cursor.execute(SELECT_VERSION_QUERY)
+    except psycopg2.errors.UndefinedTable:
+        cursor.connection.rollback()
+        return 0
+    return cursor.fetchone()[0]
+
+
+def migrate():
+    """Apply pending migrations, each in its own transaction. Returns the versions applied."""
+    applied = []
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        if current_version(cursor) >= LATEST_VERSION:
+            return applied
+        conn.commit()
+        for version, name, apply in MIGRATIONS:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+            cursor.execute(CREATE_VERSION_TABLE_QUERY)
+            cursor.execute(SELECT_VERSION_QUERY)
+            if cursor.fetchone()[0] >= version:
+                conn.commit()
+                continue
+            apply(cursor)
+            cursor.execute(INSERT_VERSION_QUERY, (version, name))
+            conn.commit()
+            logger.info('Applied schema migration %s (%s)', version, name)
+            applied.append(version)
+    return applied
+
+
+_ready = False
+_ready_lock = threading.Lock()
+
+
+def ensure_schema():
+    """Migrate once per process, before the first request touches the database."""
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if not _ready:
+            if SCHEMA_MIGRATIONS != 'deploy':
+                migrate()
+            _ready = True
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    versions = migrate()
+    logger.info('Schema at version %s (%s applied)', LATEST_VERSION, len(versions))
@@ -0,0 +1,172 @@
+"""Admin payment operations: verifying deposits and settling withdrawals, one or many at a time.
+
+A batch is one transaction of set-based statements however many ids it carries, and the
+response reports the outcome of every id. Ids that are unknown or no longer pending fail
+on their own without affecting the rest of the batch.
+"""
+from datetime import datetime
+
+from flask import jsonify, request
+
+import wallet
+from db import get_db_connection
+
+REFERRAL_BONUS = 20
+MAX_BATCH_SIZE = 500
+QUEUE_PAGE_SIZE = 50
+MAX_QUEUE_PAGE_SIZE = 200
+
+VERIFY_TRANSACTIONS_QUERY = '''UPDATE transactions SET status = 'verified'
+                               WHERE tx_id = ANY(%s) AND status = 'pending'
+                               RETURNING tx_id, user_id, amount'''
+CREDIT_REFERRALS_QUERY = '''UPDATE referrals SET bonus_credited = TRUE
+                            WHERE referee_id = ANY(%s) AND NOT bonus_credited
+                            RETURNING referrer_id, referee_id'''
+LOCK_WITHDRAWALS_QUERY = '''SELECT withdraw_id, user_id, amount FROM withdrawals
+                            WHERE withdraw_id = ANY(%s) AND status = 'pending'
+                            ORDER BY request_time, withdraw_id
+                            FOR UPDATE'''
+SETTLE_WITHDRAWALS_QUERY = "UPDATE withdrawals SET status = %s, admin_note = %s WHERE withdraw_id = ANY(%s)"
+SELECT_QUEUE_QUERY = '''SELECT withdraw_id, user_id, amount, method, request_time FROM withdrawals
+                        WHERE status = 'pending' {after}
+                        ORDER BY request_time, withdraw_id LIMIT %s'''
+
+
+def verify_payments(cursor, tx_ids):
+    """Mark pending deposits verified, credit them and pay any first-deposit referral bonuses.
+
+    Returns one result per tx_id, in request order.
+    """
+    cursor.execute(VERIFY_TRANSACTIONS_QUERY, (list(tx_ids),))
+    verified = {tx_id: (user_id, amount) for tx_id, user_id, amount in cursor.fetchall()}
+    wallet.apply_many(cursor, [(user_id, amount, tx_id) for tx_id, (user_id, amount) in verified.items()], 'deposit')
+    first_tx = {}
+    for tx_id, (user_id, _) in verified.items():
+        first_tx.setdefault(user_id, tx_id)
+    if first_tx:
+        cursor.execute(CREDIT_REFERRALS_QUERY, (list(first_tx),))
+        bonuses = [(referrer_id, REFERRAL_BONUS, first_tx[referee_id]) for referrer_id, referee_id in cursor.fetchall()]
+        wallet.apply_many(cursor, bonuses, 'referral_bonus')
+    results = []
+    for tx_id in tx_ids:
+        if tx_id in verified:
+            user_id, amount = verified[tx_id]
+            results.append({'tx_id': tx_id, 'status': 'verified', 'user_id': user_id, 'amount': amount})
+        else:
+            results.append({'tx_id': tx_id, 'status': 'failed', 'reason': 'Not pending'})
+    return results
+
+
+def settle_withdrawals(cursor, withdraw_ids, action_type, admin_note=''):
+    """Approve or reject pending withdrawals. Returns one result per withdraw_id, in request order.
+
+    The withdrawals and their users' balances are locked first. Approvals are then taken
+    oldest first for as long as each user's balance covers them; the rest stay pending.
+    """
+    status = 'approved' if action_type == 'approve' else 'rejected'
+    cursor.execute(LOCK_WITHDRAWALS_QUERY, (list(withdraw_ids),))
+    pending = cursor.fetchall()
+    balances = {}
+    if pending and status == 'approved':
+        # Same lock order as a single approval: withdrawals, then users.
+        cursor.execute("SELECT user_id, wallet FROM users WHERE user_id = ANY(%s) FOR UPDATE", (list({row[1] for row in pending}),))
+        balances = dict(cursor.fetchall())
+    settled, reasons = {}, {}
+    for withdraw_id, user_id, amount in pending:
+        if status == 'approved':
+            # Requests stored before amounts were validated can only be rejected.
+            if amount is None or amount <= 0:
+                reasons[withdraw_id] = 'Invalid amount'
+                continue
+            if balances.get(user_id) is None or balances[user_id] < amount:
+                reasons[withdraw_id] = 'Insufficient wallet'
+                continue
+            balances[user_id] -= amount
+        settled[withdraw_id] = (user_id, amount)
+    if settled:
+        cursor.execute(SETTLE_WITHDRAWALS_QUERY, (status, admin_note, list(settled)))
+    if status == 'approved':
+        wallet.apply_many(cursor, [(user_id, -amount, withdraw_id) for withdraw_id, (user_id, amount) in settled.items()],
+                          'withdrawal')
+    results = []
+    for withdraw_id in withdraw_ids:
+        if withdraw_id in settled:
+            user_id, amount = settled[withdraw_id]
+            results.append({'withdraw_id': withdraw_id, 'status': status, 'user_id': user_id, 'amount': amount})
+        else:
+            results.append({'withdraw_id': withdraw_id, 'status': 'failed', 'reason': reasons.get(withdraw_id, 'Not pending')})
+    return results
+
+
+def withdrawal_queue(cursor, limit, after=None):
+    if after is None:
+        cursor.execute(SELECT_QUEUE_QUERY.format(after=''), (limit,))
+    else:
+        cursor.execute(SELECT_QUEUE_QUERY.format(after='AND (request_time, withdraw_id) > (%s, %s)'), (*after, limit))
+    withdrawals = [{'withdraw_id': row[0], 'user_id': row[1], 'amount': row[2], 'method': row[3], 'request_time': row[4].isoformat()}
+                   for row in cursor.fetchall()]
+    next_cursor = f"{withdrawals[-1]['request_time']}|{withdrawals[-1]['withdraw_id']}" if len(withdrawals) == limit else None
+    return {'withdrawals': withdrawals, 'next_cursor': next_cursor}
+
+
+def is_admin(cursor, user_id):
+    cursor.execute("SELECT role FROM users WHERE user_id = %s", (user_id,))
+    role = cursor.fetchone()
+    return bool(role) and role[0] == 'admin'
+
+
+def _batch_ids(key):
+    ids = request.json.get(key)
+    if not isinstance(ids, list) or not ids or len(ids) > MAX_BATCH_SIZE:
+        return None
+    return list(dict.fromkeys(str(item) for item in ids))
+
+
+def bulk_verify_payments():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if not is_admin(cursor, request.json.get('user_id')):
+        return jsonify({'status': 'unauthorized'}), 403
+    tx_ids = _batch_ids('tx_ids')
+    if tx_ids is None:
+        return jsonify({'status': 'failed', 'reason': f'tx_ids must be a list of 1-{MAX_BATCH_SIZE} ids'}), 400
+    results = verify_payments(cursor, tx_ids)
+    conn.commit()
+    return jsonify({'results': results, 'verified': sum(result['status'] == 'verified' for result in results)})
+
+
+def bulk_manage_withdrawals():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if not is_admin(cursor, request.json.get('user_id')):
+        return jsonify({'status': 'unauthorized'}), 403
+    action_type = request.json.get('action_type')
+    if action_type not in ('approve', 'reject'):
+        return jsonify({'status': 'failed', 'reason': 'action_type must be approve or reject'}), 400
+    withdraw_ids = _batch_ids('withdraw_ids')
+    if withdraw_ids is None:
+        return jsonify({'status': 'failed', 'reason': f'withdraw_ids must be a list of 1-{MAX_BATCH_SIZE} ids'}), 400
+    results = settle_withdrawals(cursor, withdraw_ids, action_type, request.json.get('admin_note', ''))
+    conn.commit()
+    return jsonify({'results': results, 'settled': sum(result['status'] != 'failed' for result in results)})
+
+
+def pending_withdrawals():
+    cursor = get_db_connection().cursor()
+    if not is_admin(cursor, request.args.get('user_id')):
+        return jsonify({'status': 'unauthorized'}), 403
+    limit = min(max(request.args.get('limit', QUEUE_PAGE_SIZE, type=int), 1), MAX_QUEUE_PAGE_SIZE)
+    after = request.args.get('cursor')
+    if after:
+        request_time, _, withdraw_id = after.partition('|')
+        try:
+            after = (datetime.fromisoformat(request_time), withdraw_id)
+        except ValueError:
+            return jsonify({'status': 'failed', 'reason': 'Invalid cursor'}), 400
+    return jsonify(withdrawal_queue(cursor, limit, after))
+
+
+def init_app(app):
+    app.add_url_rule('/api/pending_withdrawals', 'pending_withdrawals', pending_withdrawals)
+    app.add_url_rule('/api/admin/verify_payments', 'bulk_verify_payments', bulk_verify_payments, methods=['POST'])
+    app.add_url_rule('/api/admin/withdrawals', 'bulk_manage_withdrawals', bulk_manage_withdrawals, methods=['POST'])
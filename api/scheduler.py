@@ -0,0 +1,121 @@
+"""Background thread that draws numbers for every started game on a fixed cadence.
+
+All timing state lives in games.next_draw_at, so a restarted worker simply picks up the
+games that are due, and any number of workers can run the scheduler side by side. Every
+ARCHIVE_INTERVAL_SECONDS the same thread also archives one batch of finished games.
+
+Serverless platforms freeze threads between requests, so there the thread is turned off
+(DRAW_SCHEDULER=off) and a cron job calls /api/cron/draws every minute instead, which runs
+the same loop in the request for DRAW_CRON_RUN_SECONDS (see vercel.json).
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import jsonify, request
+
+import archive
+import db
+import events
+import migrations
+from draws import draw_next_number
+
+SCHEDULER_ENABLED = os.environ.get('DRAW_SCHEDULER', 'on') != 'off'
+SCHEDULER_TICK_SECONDS = float(os.environ.get('DRAW_SCHEDULER_TICK_SECONDS', 1))
+SCHEDULER_BATCH_SIZE = 50
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ARCHIVE_INTERVAL_SECONDS', 300))  # 0 disables
+CRON_RUN_SECONDS = float(os.environ.get('DRAW_CRON_RUN_SECONDS', 55))
+CRON_SECRET = os.environ.get('CRON_SECRET')
+
+logger = logging.getLogger(__name__)
+
+
+def run_due_draws(limit=SCHEDULER_BATCH_SIZE):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        # next_draw_at is written from this clock by draw_next_number, so it is compared against
+        # this clock too; the database's now() depends on the session TimeZone.
+        cursor.execute('''SELECT game_id FROM games
+                          WHERE status = 'started' AND (next_draw_at IS NULL OR next_draw_at <= %s)
+                          ORDER BY next_draw_at NULLS FIRST LIMIT %s''', (datetime.now(), limit))
+        game_ids = [row[0] for row in cursor.fetchall()]
+    drawn = 0
+    for game_id in game_ids:
+        with db.connection() as conn:
+            result = draw_next_number(conn.cursor(), game_id)
+        events.broker.wake(game_id)
+        drawn += result is not None
+    return drawn
+
+
+def run_for(seconds, tick=SCHEDULER_TICK_SECONDS):
+    """Run the scheduler loop in the calling thread for about ``seconds``, then archive one batch.
+
+    Returns the number of draws made.
+    """
+    deadline = time.monotonic() + seconds
+    drawn = run_due_draws()
+    while time.monotonic() + tick < deadline:
+        time.sleep(tick)
+        drawn += run_due_draws()
+    if ARCHIVE_INTERVAL_SECONDS:
+        archive.archive_finished_games(max_batches=1)
+    return drawn
+
+
+class DrawScheduler:
+    def __init__(self, tick=SCHEDULER_TICK_SECONDS):
+        self.tick = tick
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_archive = time.monotonic() + ARCHIVE_INTERVAL_SECONDS
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='draw-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            try:
+                run_due_draws()
+            except Exception:
+                logger.exception('Draw scheduler tick failed')
+            if ARCHIVE_INTERVAL_SECONDS and time.monotonic() >= self._next_archive:
+                self._next_archive = time.monotonic() + ARCHIVE_INTERVAL_SECONDS
+                try:
+                    # One batch per interval keeps the draw loop responsive; cron can drain backlogs.
+                    archive.archive_finished_games(max_batches=1)
+                except Exception:
+                    logger.exception('Archive batch failed')
+
+
+scheduler = DrawScheduler()
+
+
+def cron_draws():
+    # Vercel sends CRON_SECRET as a bearer token; without one configured the endpoint stays shut.
+    if not CRON_SECRET or request.headers.get('Authorization') != f'Bearer {CRON_SECRET}':
+        return jsonify({'status': 'failed', 'reason': 'Unauthorized'}), 401
+    return jsonify({'status': 'ok', 'drawn': run_for(CRON_RUN_SECONDS)})
+
+
+def init_app(app):
+    app.add_url_rule('/api/cron/draws', 'cron_draws', cron_draws)
+
+
+if __name__ == '__main__':
+    # Standalone mode for deployments that run a single dedicated scheduler process.
+    logging.basicConfig(level=logging.INFO)
+    migrations.ensure_schema()
+    scheduler.start()
+    scheduler._thread.join()
@@ -0,0 +1,45 @@
+"""Finishing a game and paying out its winners."""
+import os
+import time
+from datetime import datetime
+
+import events
+import leaderboard
+import metrics
+import wallet
+
+HOUSE_CUT = 0.02
+# 'split' shares the prize between every card that completes a line on the same draw,
+# 'first' pays only the earliest card.
+TIE_POLICY = os.environ.get('TIE_POLICY', 'split')
+
+
+def settle_game(cursor, game_id, winner_ids):
+    """Mark ``winner_ids`` (ordered by card) as the winners of ``game_id`` and pay them.
+
+    Must run in the transaction that holds the games row lock. Returns
+    ``(winner_ids, prize_amount, share)``, or None if the game was already settled.
+    """
+    start = time.perf_counter()
+    winners = list(dict.fromkeys(winner_ids))
+    if TIE_POLICY == 'first':
+        winners = winners[:1]
+    cursor.execute('''SELECT bet_amount, (SELECT COUNT(*) FROM game_players WHERE game_id = g.game_id)
+                      FROM games g WHERE game_id = %s AND winner_id IS NULL''', (game_id,))
+    game = cursor.fetchone()
+    if not game or not winners:
+        return None
+    bet_amount, player_count = game
+    prize_amount = int(bet_amount * player_count * (1 - HOUSE_CUT))
+    share = prize_amount // len(winners)
+    now = datetime.now()
+    cursor.execute("UPDATE games SET winner_id = %s, prize_amount = %s, status = 'finished', end_time = %s, last_updated = %s WHERE game_id = %s",
+                   (winners[0], prize_amount, now, now, game_id))
+    cursor.execute("UPDATE game_players SET winner = TRUE WHERE game_id = %s AND user_id = ANY(%s)", (game_id, winners))
+    # Stakes were taken when each player joined, so settling only pays out the pot.
+    wallet.credit_many(cursor, winners, share, 'prize', game_id)
+    usernames = leaderboard.record_wins(cursor, winners)
+    events.publish(cursor, game_id, 'winner', {'winner_id': winners[0], 'winner_ids': winners, 'usernames': usernames,
+                                               'prize_amount': prize_amount, 'share': share})
+    metrics.settlement_seconds.observe(time.perf_counter() - start)
+    return winners, prize_amount, share
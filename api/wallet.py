@@ -0,0 +1,77 @@
+"""Wallet balance changes, each a single conditional statement recorded in wallet_ledger."""
+
+DEBIT_QUERY = '''WITH changed AS (
+        UPDATE users SET wallet = wallet - %(amount)s
+        WHERE user_id = %(user_id)s AND wallet >= %(required)s
+        RETURNING user_id, wallet)
+    INSERT INTO wallet_ledger (user_id, amount, balance_after, reason, ref)
+    SELECT user_id, -%(amount)s, wallet, %(reason)s, %(ref)s FROM changed
+    RETURNING balance_after'''
+
+CREDIT_QUERY = '''WITH changed AS (
+        UPDATE users SET wallet = wallet + %(amount)s
+        WHERE user_id = ANY(%(user_ids)s)
+        RETURNING user_id, wallet)
+    INSERT INTO wallet_ledger (user_id, amount, balance_after, reason, ref)
+    SELECT user_id, %(amount)s, wallet, %(reason)s, %(ref)s FROM changed
+    RETURNING user_id, balance_after'''
+
+# Several entries for one user are summed into a single row update; each ledger row still
+# gets the balance as it stood right after that entry, in input order.
+APPLY_MANY_QUERY = '''WITH items AS (
+        SELECT * FROM unnest(%(user_ids)s::BIGINT[], %(amounts)s::INTEGER[], %(refs)s::TEXT[])
+            WITH ORDINALITY AS i(user_id, amount, ref, ord)),
+    changed AS (
+        UPDATE users u SET wallet = u.wallet + t.total
+        FROM (SELECT user_id, SUM(amount) AS total FROM items GROUP BY user_id) t
+        WHERE u.user_id = t.user_id
+        RETURNING u.user_id, u.wallet)
+    INSERT INTO wallet_ledger (user_id, amount, balance_after, reason, ref)
+    SELECT i.user_id, i.amount, c.wallet - SUM(i.amount) OVER (PARTITION BY i.user_id ORDER BY i.ord DESC) + i.amount,
+           %(reason)s, i.ref
+    FROM items i JOIN changed c ON c.user_id = i.user_id
+    ORDER BY i.ord
+    RETURNING user_id, balance_after'''
+
+
+def debit(cursor, user_id, amount, reason, ref=None, minimum_balance=0):
+    """Take ``amount`` from the wallet if it holds at least ``max(amount, minimum_balance)``.
+
+    The balance check and the update are one statement, so concurrent debits cannot
+    overdraw. Returns the new balance, or None if the funds were not there.
+    """
+    cursor.execute(DEBIT_QUERY, {'user_id': user_id, 'amount': amount, 'required': max(amount, minimum_balance),
+                                 'reason': reason, 'ref': ref})
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def credit(cursor, user_id, amount, reason, ref=None):
+    """Add ``amount`` to the wallet. Returns the new balance, or None if the user does not exist."""
+    balances = credit_many(cursor, [user_id], amount, reason, ref)
+    return balances.get(user_id)
+
+
+def credit_many(cursor, user_ids, amount, reason, ref=None):
+    """Add ``amount`` to every wallet in ``user_ids`` with one statement. Returns {user_id: balance}."""
+    cursor.execute(CREDIT_QUERY, {'user_ids': list(user_ids), 'amount': amount, 'reason': reason, 'ref': ref})
+    return dict(cursor.fetchall())
+
+
+def apply_many(cursor, entries, reason):
+    """Post ``(user_id, amount, ref)`` entries (negative amounts debit) in one statement.
+
+    Balances are not checked: callers debiting through here must hold the users rows locked
+    and have checked the funds. Returns {user_id: final balance}.
+    """
+    if not entries:
+        return {}
+    user_ids, amounts, refs = (list(column) for column in zip(*entries))
+    cursor.execute(APPLY_MANY_QUERY, {'user_ids': user_ids, 'amounts': amounts, 'refs': refs, 'reason': reason})
+    return dict(cursor.fetchall())
+
+
+def balance(cursor, user_id):
+    cursor.execute("SELECT wallet FROM users WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
@@ -0,0 +1,76 @@
+"""Bytes and latency to open the web app: first visit and repeat visit, by Accept-Encoding.
+
+A visit fetches index.html and every local script and stylesheet it references. On a repeat
+visit the browser keeps what it was allowed to cache: immutable assets are not requested
+again, and anything else is revalidated with If-None-Match. The baseline is the old
+behaviour, every file in full on every open.
+
+    DATABASE_URL=postgresql://localhost/zebi_bench python bench/bench_assets.py
+"""
+import argparse
+import gzip
+import os
+import re
+import time
+
+import common
+
+REFERENCE_PATTERN = re.compile(r'''(?:src|href)="([^":]+)"''')
+
+
+def decode(response):
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'br':
+        import brotli
+        return brotli.decompress(response.get_data())
+    if encoding == 'gzip':
+        return gzip.decompress(response.get_data())
+    return response.get_data()
+
+
+def visit(client, encoding, cache):
+    """Open the app once with the browser cache ``cache``. Returns (bytes, requests, seconds)."""
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    total = requests = 0
+    start = time.perf_counter()
+    paths = ['/']
+    while paths:
+        path = paths.pop(0)
+        etag, cache_control, references = cache.get(path, (None, '', []))
+        if 'immutable' not in cache_control:
+            response = client.get(path, headers=dict(headers, **({'If-None-Match': etag} if etag else {})))
+            requests += 1
+            total += len(response.get_data())
+            if response.status_code == 200:
+                references = REFERENCE_PATTERN.findall(decode(response).decode()) if path == '/' else []
+            cache[path] = (response.headers.get('ETag'), response.headers.get('Cache-Control', ''), references)
+        paths.extend('/' + reference for reference in references)
+    return total, requests, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--visits', type=int, default=50)
+    args = parser.parse_args()
+
+    app = common.load_app().app
+    import assets
+    client = app.test_client()
+    with open(os.path.join(assets.PUBLIC_DIR, 'index.html')) as f:
+        sources = ['index.html'] + REFERENCE_PATTERN.findall(f.read())
+    baseline = sum(os.path.getsize(os.path.join(assets.PUBLIC_DIR, name)) for name in sources)
+    print(f'baseline  every open bytes={baseline:6d} requests={len(sources)}')
+    for encoding in ('br, gzip', 'gzip', None):
+        first = visit(client, encoding, {})
+        cache = {}
+        visit(client, encoding, cache)
+        repeats = [visit(client, encoding, cache) for _ in range(args.visits)]
+        repeat_bytes = sum(r[0] for r in repeats) / len(repeats)
+        repeat_requests = sum(r[1] for r in repeats) / len(repeats)
+        latency = common.percentile([r[2] for r in repeats], 0.5)
+        print(f"{encoding or 'identity':9s} first bytes={first[0]:6d} requests={first[1]} "
+              f"repeat bytes={repeat_bytes:6.0f} requests={repeat_requests:.0f} p50={latency * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
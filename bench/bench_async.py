@@ -0,0 +1,184 @@
+"""Thousands of spectators long-polling one game against a single async (ASGI) worker.
+
+Starts `uvicorn asgi:app` with one worker (or uses --url), opens --spectators keep-alive
+connections that each long-poll game_status with If-None-Match and wait=, then draws numbers
+every --interval seconds. Reports how many spectators were connected at once, how long each
+draw took to reach them, errors, and the server's threads, memory and database connections.
+Exits non-zero if a request failed or any spectator did not end on the last draw.
+
+    DATABASE_URL=postgresql://localhost/zebi_bench python bench/bench_async.py --spectators 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+import common
+
+
+async def http_get(reader, writer, host, path, headers):
+    lines = [f'GET {path} HTTP/1.1', f'Host: {host}'] + [f'{name}: {value}' for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+    status = int((await reader.readline()).split()[1])
+    response_headers = {}
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        response_headers[name.lower()] = value.strip()
+    body = await reader.readexactly(int(response_headers.get('content-length', 0)))
+    return status, response_headers, body
+
+
+async def spectator(url, game_id, user_id, wait, stats, seen, done):
+    parts = urlsplit(url)
+    try:
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port)
+    except OSError:
+        stats['errors'] += 1
+        return
+    stats['open'] += 1
+    stats['max_open'] = max(stats['max_open'], stats['open'])
+    path = f'/api/game_status?game_id={game_id}&user_id={user_id}&since=0&wait={wait}'
+    etag = None
+    try:
+        while not done.is_set():
+            status, headers, body = await http_get(reader, writer, parts.netloc, path, {'If-None-Match': etag} if etag else {})
+            stats['requests'] += 1
+            if status == 200:
+                etag = headers['etag']
+                seen.append((json.loads(body)['version'], time.time()))
+            elif status != 304:
+                stats['errors'] += 1
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+        stats['errors'] += 1
+    finally:
+        stats['open'] -= 1
+        writer.close()
+
+
+def wait_for_server(url, timeout=30):
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((parts.hostname, parts.port), 1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def server_usage(pid):
+    with open(f'/proc/{pid}/status') as f:
+        fields = dict(line.split(':', 1) for line in f)
+    return int(fields['Threads']), int(fields['VmRSS'].split()[0]) // 1024
+
+
+def current(game_id):
+    import db
+    import fanout
+    with db.connection() as conn:
+        return fanout.GameSnapshot.load(conn.cursor(), game_id)
+
+
+def database_connections():
+    import db
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database()")
+        return cursor.fetchone()[0]
+
+
+async def run(args, game_id, user_id, server_pid):
+    stats = {'open': 0, 'max_open': 0, 'requests': 0, 'errors': 0}
+    done = asyncio.Event()
+    views = [[] for _ in range(args.spectators)]
+    tasks = []
+    # Connected in batches so the listen backlog never overflows.
+    for start in range(0, args.spectators, 200):
+        tasks += [asyncio.ensure_future(spectator(args.url, game_id, user_id, args.wait, stats, views[n], done))
+                  for n in range(start, min(start + 200, args.spectators))]
+        await asyncio.sleep(0.2)
+    while stats['max_open'] < args.spectators and not stats['errors']:
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(1)
+    usage = server_pid and server_usage(server_pid)
+    connections = database_connections()
+    drawn = {}
+    for _ in range(args.draws):
+        started = time.time()
+        await asyncio.to_thread(common.draw, game_id)
+        snapshot = await asyncio.to_thread(current, game_id)
+        drawn.setdefault(snapshot.version, started)
+        if snapshot.status != 'started':
+            break
+        await asyncio.sleep(args.interval)
+    done.set()
+    await asyncio.sleep(args.interval)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return stats, views, drawn, usage, connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--spectators', type=int, default=2000)
+    parser.add_argument('--draws', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between draws')
+    parser.add_argument('--wait', type=float, default=25, help='long-poll wait= in seconds')
+    parser.add_argument('--url', help='an already running async server; by default one is started')
+    args = parser.parse_args()
+
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.spectators * 2 + 256)), hard))
+    server = None
+    if not args.url:
+        args.url = 'http://127.0.0.1:8766'
+        server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'asgi:app', '--app-dir', common.API_DIR,
+                                   '--port', '8766', '--log-level', 'warning', '--backlog', '4096'],
+                                  env=dict(os.environ, DRAW_SCHEDULER='off'))
+    try:
+        app = common.load_app().app
+        client = app.test_client()
+        wait_for_server(args.url)
+        players = [common.register_user(client) for _ in range(2)]
+        game_id = common.start_game(client, players)
+        stats, views, drawn, usage, connections = asyncio.run(run(args, game_id, players[0], server and server.pid))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    # A spectator that was busy during a draw gets the next version, which carries every number
+    # since 0, so a draw counts as delivered when the spectator first holds it or anything later.
+    delays = []
+    behind = 0
+    final = max(drawn)
+    for view in views:
+        for version, started in drawn.items():
+            at = next((at for seen, at in view if seen >= version), None)
+            if at is not None:
+                delays.append(max(at - started, 0))
+        if not view or view[-1][0] < final:
+            behind += 1
+    print(f"spectators={args.spectators} connected at once={stats['max_open']} draws={len(drawn)} "
+          f"requests={stats['requests']} errors={stats['errors']} behind={behind}")
+    print(f"draw -> spectator p50={common.percentile(delays, 0.5) * 1000:.1f}ms p95={common.percentile(delays, 0.95) * 1000:.1f}ms "
+          f"p99={common.percentile(delays, 0.99) * 1000:.1f}ms")
+    if usage:
+        print(f"server threads={usage[0]} rss={usage[1]}MB database connections (all clients)={connections}")
+    sys.exit(1 if behind or stats['errors'] else 0)
+
+
+if __name__ == '__main__':
+    main()
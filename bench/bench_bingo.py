@@ -0,0 +1,71 @@
+"""Micro-benchmark of the bitmask evaluator in api/bingo.py against a naive grid check.
+
+Before timing, both implementations are run on random cards and draws and must agree.
+
+    python bench/bench_bingo.py [--iterations N] [--seed S]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import bingo  # noqa: E402
+
+
+def naive_has_bingo(card_numbers, called_numbers):
+    called = set(called_numbers)
+    grid = [[card_numbers[row * 5 + col] in called or row * 5 + col == bingo.FREE_CELL for col in range(5)]
+            for row in range(5)]
+    return (any(all(row) for row in grid) or
+            any(all(grid[row][col] for row in range(5)) for col in range(5)) or
+            all(grid[i][i] for i in range(5)) or
+            all(grid[i][4 - i] for i in range(5)))
+
+
+def random_case(rng):
+    card = sorted(rng.sample(range(0, 101), 25))
+    called = rng.sample(range(0, 101), rng.randint(0, 101))
+    return card, called
+
+
+def check_agreement(rng, cases):
+    for _ in range(cases):
+        card, called = random_case(rng)
+        if bingo.has_bingo(card, called) != naive_has_bingo(card, called):
+            raise AssertionError(f'Evaluators disagree on card={card} called={called}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    check_agreement(rng, 5000)
+    cases = [random_case(rng) for _ in range(1000)]
+    prepared = [(card, bingo.called_bitmap(called)) for card, called in cases]
+
+    def run_naive():
+        for card, called in cases:
+            naive_has_bingo(card, called)
+
+    def run_bitmask():
+        for card, called in cases:
+            bingo.has_bingo(card, called)
+
+    def run_bitmask_prepared():
+        for card, called in prepared:
+            bingo.is_winning_mask(bingo.mark_mask(card, called))
+
+    rounds = max(1, args.iterations // len(cases))
+    for name, fn in (('naive', run_naive), ('bitmask', run_bitmask), ('bitmask, bitmap reused', run_bitmask_prepared)):
+        seconds = min(timeit.repeat(fn, number=rounds, repeat=3))
+        print(f'{name:24s} {seconds / (rounds * len(cases)) * 1e6:8.2f} us/check')
+
+
+if __name__ == '__main__':
+    main()
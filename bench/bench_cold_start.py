@@ -0,0 +1,53 @@
+"""Cold start: import time, first request and second request of a fresh process.
+
+Each run spawns a new interpreter, as a serverless cold start does. The first run against
+an empty database also applies the migrations; later runs only check the schema version.
+
+    DATABASE_URL=postgresql://localhost/zebi_bench python bench/bench_cold_start.py [--runs N]
+    SCHEMA_MIGRATIONS=deploy python bench/bench_cold_start.py   # skip the runtime check
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import common
+
+CHILD = '''
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+import common
+start = time.perf_counter()
+app = common.load_app().app
+imported = time.perf_counter()
+client = app.test_client()
+before = common.statements()
+client.get('/api/leaderboard')
+first = time.perf_counter()
+first_statements = common.statements() - before
+client.get('/api/leaderboard')
+second = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'first_request_ms': (first - imported) * 1000,
+                  'second_request_ms': (second - first) * 1000, 'first_request_statements': first_statements}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    bench_dir = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, '-c', CHILD, bench_dir], check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    print(f"first run      {' '.join(f'{key}={value:.1f}' for key, value in runs[0].items())}")
+    for key in runs[0]:
+        samples = [run[key] for run in runs[1:] or runs]
+        print(f"{key:25s} p50={common.percentile(samples, 0.5):8.1f} p95={common.percentile(samples, 0.95):8.1f}")
+
+
+if __name__ == '__main__':
+    main()
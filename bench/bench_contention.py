@@ -0,0 +1,118 @@
+"""Contention: N players hitting one game at the same time, checked for correctness.
+
+All players join at once, pick their numbers at once (each sends its pick twice), and then
+poll and claim bingo together while several admin threads force draws in parallel. Afterwards
+the game is audited: one seat, one stake and one card per player; gap-free draws with no
+repeated number; one settlement, with the prize ledger matching the winners. Exits non-zero
+if any check fails.
+
+    DATABASE_URL=postgresql://localhost/zebi_bench python bench/bench_contention.py --players 100
+"""
+import argparse
+import sys
+import threading
+import time
+
+import common
+from loadtest import Recorder
+
+
+def run_game(app, recorder, args):
+    client = app.test_client()
+    players = [common.register_user(client, wallet=args.bet * 10) for _ in range(args.players)]
+    creator = players[0]
+    common.make_admin(creator)
+    game_id = recorder.call(client, 'post', '/api/create_game', json={'user_id': creator, 'bet_amount': args.bet}).get_json()['game_id']
+
+    def together(target, items):
+        barrier = threading.Barrier(len(items))
+
+        def run(item):
+            barrier.wait()
+            target(app.test_client(), item)
+        threads = [threading.Thread(target=run, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    together(lambda c, user_id: recorder.call(c, 'post', '/api/join_game',
+                                              json={'user_id': user_id, 'game_id': game_id, 'bet_amount': args.bet}),
+             players[1:])
+    picks = [(user_id, number) for number, user_id in enumerate(players)]
+    together(lambda c, pick: recorder.call(c, 'post', '/api/select_number',
+                                           json={'user_id': pick[0], 'game_id': game_id, 'selected_number': pick[1]}),
+             picks + picks)
+    recorder.call(client, 'post', '/api/admin_actions',
+                  json={'user_id': creator, 'action': 'start_game', 'game_id': game_id, 'bet_amount': args.bet})
+
+    finished = threading.Event()
+
+    def play(c, user_id):
+        if user_id in players[:args.drawers]:
+            while not finished.is_set():
+                response = recorder.call(c, 'post', '/api/call_number', json={'user_id': creator, 'game_id': game_id, 'force': True})
+                if response.status_code == 400:
+                    finished.set()
+            return
+        deadline = time.monotonic() + args.timeout
+        while not finished.is_set() and time.monotonic() < deadline:
+            data = recorder.call(c, 'get', f'/api/game_status?game_id={game_id}&user_id={user_id}&since=0').get_json()
+            if data['status'] == 'finished':
+                finished.set()
+        recorder.call(c, 'post', '/api/check_bingo', json={'user_id': user_id, 'game_id': game_id})
+    together(play, players)
+    return game_id, players
+
+
+def audit(game_id, players, bet):
+    import db
+    failures = []
+    with db.connection() as conn:
+        cursor = conn.cursor()
+
+        def check(name, query, expected, params=()):
+            cursor.execute(query, params + (game_id,))
+            actual = cursor.fetchone()[0]
+            if actual != expected:
+                failures.append(f'{name}: expected {expected}, got {actual}')
+        check('seats', "SELECT COUNT(*) FROM game_players WHERE game_id = %s", len(players))
+        check('stakes', "SELECT COUNT(*) FROM wallet_ledger WHERE ref = %s AND reason = 'bet'", len(players))
+        check('cards', "SELECT COUNT(DISTINCT user_id) FROM player_cards WHERE game_id = %s", len(players))
+        check('one card each', "SELECT COUNT(*) FROM player_cards WHERE game_id = %s", len(players))
+        check('distinct numbers', "SELECT COUNT(DISTINCT selected_number) FROM game_players WHERE game_id = %s", len(players))
+        check('gap-free draws', "SELECT COUNT(*) = COALESCE(MAX(seq), 0) AND COUNT(*) = COUNT(DISTINCT number) FROM game_draws WHERE game_id = %s", True)
+        check('draw cursor', "SELECT draw_cursor = (SELECT COUNT(*) FROM game_draws WHERE game_id = g.game_id) FROM games g WHERE game_id = %s", True)
+        check('prize entries', "SELECT (SELECT COUNT(*) FROM wallet_ledger WHERE ref = g.game_id AND reason = 'prize') = "
+                               "(SELECT COUNT(*) FROM game_players WHERE game_id = g.game_id AND winner) FROM games g WHERE game_id = %s", True)
+        check('prize within pot', "SELECT COALESCE(SUM(amount), 0) <= %s FROM wallet_ledger WHERE ref = %s AND reason = 'prize'",
+              True, (bet * len(players),))
+        check('settled', "SELECT status = 'finished' FROM games WHERE game_id = %s", True)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--drawers', type=int, default=5, help='players that force draws in parallel')
+    parser.add_argument('--bet', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    args = parser.parse_args()
+
+    app = common.load_app().app
+    recorder = Recorder()
+    start = time.perf_counter()
+    game_id, players = run_game(app, recorder, args)
+    wall_seconds = time.perf_counter() - start
+    for endpoint, result in recorder.report(wall_seconds).items():
+        print(f"{endpoint:22s} n={result['requests']:5d} errors={result['errors']} p50={result['p50_ms']:7.2f}ms "
+              f"p95={result['p95_ms']:7.2f}ms p99={result['p99_ms']:7.2f}ms")
+    failures = audit(game_id, players, args.bet)
+    for failure in failures:
+        print(f'FAILED {failure}', file=sys.stderr)
+    print(f'{game_id}: {"ok" if not failures else f"{len(failures)} checks failed"}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
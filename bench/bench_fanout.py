@@ -0,0 +1,98 @@
+"""Fan-out: how fast and how faithfully game_status in other processes follows a game's writes.
+
+Several worker processes, each with its own app and LISTEN connection, poll game_status while
+this process draws numbers until the game is won. Reports how long each event took to show up
+in the workers, and the SQL statements per poll. Afterwards every worker's final full response
+must equal one built fresh from the database, and no worker may have seen the game go
+backwards; exits non-zero otherwise.
+
+    DATABASE_URL=postgresql://localhost/zebi_bench python bench/bench_fanout.py --workers 4
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+
+import common
+
+
+def watch(game_id, user_id, final_version, ready, results):
+    app = common.load_app().app
+    import fanout
+    client = app.test_client()
+    url = f'/api/game_status?game_id={game_id}&user_id={user_id}'
+    client.get(url)  # starts the listener
+    while not fanout.snapshots.live:
+        time.sleep(0.01)
+    ready.put(True)
+    seen, versions, polls = {}, [], 0
+    before = common.statements()
+    while True:
+        version = client.get(f'{url}&since=0').get_json()['version']
+        seen.setdefault(version, time.time())
+        versions.append(version)
+        polls += 1
+        if final_version.value and version >= final_version.value:
+            break
+        time.sleep(0.001)
+    statements = common.statements() - before
+    results.put({'seen': seen, 'polls': polls, 'statements': statements,
+                 'monotonic': versions == sorted(versions), 'body': client.get(url).get_json()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=0.02, help='seconds between draws')
+    args = parser.parse_args()
+
+    app = common.load_app().app
+    import db
+    import fanout
+    client = app.test_client()
+    players = [common.register_user(client) for _ in range(args.players)]
+    game_id = common.start_game(client, players)
+
+    def current():
+        with db.connection() as conn:
+            return fanout.GameSnapshot.load(conn.cursor(), game_id)
+
+    context = multiprocessing.get_context('spawn')
+    final_version = context.Value('i', 0)
+    ready, results = context.Queue(), context.Queue()
+    workers = [context.Process(target=watch, args=(game_id, players[0], final_version, ready, results))
+               for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.get()
+
+    committed = {}
+    while current().status == 'started':
+        common.draw(game_id)
+        snapshot = current()
+        committed.setdefault(snapshot.version, time.time())
+        time.sleep(args.interval)
+    final = current()
+    final_version.value = final.version
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    delays = [report['seen'][v] - at for report in reports for v, at in committed.items() if v in report['seen']]
+    expected = final.status_body(players[0], None)
+    failures = [f'worker {n}: ' + ('went backwards' if not report['monotonic'] else 'final state differs')
+                for n, report in enumerate(reports) if not report['monotonic'] or report['body'] != expected]
+    polls = sum(report['polls'] for report in reports)
+    print(f"{game_id}: {len(committed)} versions, {args.workers} workers, {polls} polls, "
+          f"{sum(report['statements'] for report in reports) / polls:.3f} statements/poll")
+    print(f"visible after p50={common.percentile(delays, 0.5) * 1000:.2f}ms p95={common.percentile(delays, 0.95) * 1000:.2f}ms "
+          f"max={max(delays) * 1000:.2f}ms (first poll that saw it)")
+    for failure in failures:
+        print(f'FAILED {failure}', file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
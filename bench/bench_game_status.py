@@ -0,0 +1,59 @@
+"""Bytes, statements and latency per /api/game_status poll: full, since=<seq> and If-None-Match.
+
+    DATABASE_URL=postgresql://localhost/zebi_bench python bench/bench_game_status.py [--polls N] [--draws D]
+"""
+import argparse
+import time
+
+import common
+
+
+def measure(client, polls, url, headers=None):
+    sizes, latencies = [], []
+    before = common.statements()
+    for _ in range(polls):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers or {})
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(response.get_data()))
+    return {
+        'status': response.status_code,
+        'bytes_per_poll': sum(sizes) / polls,
+        'statements_per_poll': (common.statements() - before) / polls,
+        'p50_ms': common.percentile(latencies, 0.5) * 1000,
+        'p95_ms': common.percentile(latencies, 0.95) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--polls', type=int, default=200)
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--draws', type=int, default=60)
+    args = parser.parse_args()
+
+    app = common.load_app().app
+    client = app.test_client()
+    players = [common.register_user(client) for _ in range(args.players)]
+    game_id = common.start_game(client, players)
+    for _ in range(args.draws):
+        common.draw(game_id)
+
+    url = f'/api/game_status?game_id={game_id}&user_id={players[0]}'
+    first = client.get(url)
+    draw_seq = first.get_json()['draw_seq']
+    delta_url = f'{url}&since={draw_seq}'
+    etag = client.get(delta_url).headers['ETag']
+
+    results = {
+        'full': measure(client, args.polls, url),
+        'since': measure(client, args.polls, delta_url),
+        'if_none_match': measure(client, args.polls, delta_url, {'If-None-Match': etag}),
+    }
+    for mode, result in results.items():
+        print(f"{mode:14s} status={result['status']} bytes={result['bytes_per_poll']:8.1f} "
+              f"statements={result['statements_per_poll']:.2f} p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
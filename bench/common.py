@@ -0,0 +1,105 @@
+"""Shared setup for benchmarks that drive the Flask app against a local Postgres.
+
+DATABASE_URL must point at a scratch database: benchmarks create users and games in it.
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+
+import psycopg2
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+sys.path.insert(0, API_DIR)
+
+os.environ.setdefault('ADMIN_IDS', '0')
+os.environ.setdefault('DRAW_SCHEDULER', 'off')
+
+import metrics  # noqa: E402
+
+_ids = itertools.count(int(time.time() * 1000) % 10**9)
+_counts = threading.local()
+
+
+class CountingCursor(metrics.InstrumentedCursor):
+    # Counted per thread, so concurrent clients each see their own requests' statements.
+    def execute(self, query, vars=None):
+        _counts.statements = getattr(_counts, 'statements', 0) + 1
+        return super().execute(query, vars)
+
+
+def counting_connect(dsn):
+    return psycopg2.connect(dsn, cursor_factory=CountingCursor)
+
+
+def load_app():
+    """Import the app with statement counting enabled on every pooled connection."""
+    import db
+    db.pool._connect = counting_connect
+    import app
+    return app
+
+
+def statements():
+    return getattr(_counts, 'statements', 0)
+
+
+def next_id():
+    return next(_ids)
+
+
+def embedded_database_url(data_dir):
+    """Start (or reuse) a throwaway Postgres with the optional ``pgserver`` package."""
+    import pgserver
+    server = pgserver.get_server(data_dir, cleanup_mode=None)
+    return server.get_uri()
+
+
+def register_user(client, wallet=1000):
+    user_id = next_id()
+    client.post('/api/register_user', json={'user_id': user_id, 'phone': '', 'name': f'bench{user_id}',
+                                            'username': f'bench{user_id}'})
+    fund(user_id, wallet)
+    return user_id
+
+
+def fund(user_id, wallet):
+    import db
+    with db.connection() as conn:
+        conn.cursor().execute("UPDATE users SET wallet = %s WHERE user_id = %s", (wallet, user_id))
+
+
+def make_admin(user_id):
+    import db
+    with db.connection() as conn:
+        conn.cursor().execute("UPDATE users SET role = 'admin' WHERE user_id = %s", (user_id,))
+
+
+def start_game(client, players, bet_amount=10):
+    """Create a game for ``players``, give each a card and start it. Returns the game_id."""
+    creator = players[0]
+    game_id = client.post('/api/create_game', json={'user_id': creator, 'bet_amount': bet_amount}).get_json()['game_id']
+    for user_id in players[1:]:
+        client.post('/api/join_game', json={'user_id': user_id, 'game_id': game_id, 'bet_amount': bet_amount})
+    for number, user_id in enumerate(players):
+        client.post('/api/select_number', json={'user_id': user_id, 'game_id': game_id, 'selected_number': number})
+        client.post('/api/accept_card', json={'user_id': user_id, 'game_id': game_id})
+    make_admin(creator)
+    client.post('/api/admin_actions', json={'user_id': creator, 'action': 'start_game', 'game_id': game_id,
+                                            'bet_amount': bet_amount})
+    return game_id
+
+
+def draw(game_id):
+    import db
+    from draws import draw_next_number
+    with db.connection() as conn:
+        return draw_next_number(conn.cursor(), game_id, force=True)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
@@ -0,0 +1,179 @@
+"""Simulate M concurrent bingo games of N players each against a local Postgres.
+
+Every player runs register_user -> create_game/join_game -> select_number -> accept_card ->
+game_status polling -> check_bingo in its own thread; each game's creator is made admin and
+drives the draws through call_number. The report gives throughput, p50/p95/p99 latency and
+SQL statements per request for every endpoint, plus pool and server connection counts.
+
+    DATABASE_URL=postgresql://localhost/zebi_bench python bench/loadtest.py --games 10 --players 20 --out run.json
+    python bench/loadtest.py --embedded /tmp/zebi-pg --baseline run.json
+
+With --baseline the run is compared to an earlier JSON report and the script exits non-zero
+when an endpoint's p95 latency or statements per request regress beyond --tolerance.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import common
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statements = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, client, method, path, **kwargs):
+        endpoint = path.split('?')[0]
+        before = common.statements()
+        start = time.perf_counter()
+        response = getattr(client, method)(path, **kwargs)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            self.statements[endpoint].append(common.statements() - before)
+            if response.status_code >= 500:
+                self.errors[endpoint] += 1
+        return response
+
+    def report(self, wall_seconds):
+        endpoints = {}
+        for endpoint, samples in sorted(self.latencies.items()):
+            endpoints[endpoint] = {
+                'requests': len(samples),
+                'errors': self.errors[endpoint],
+                'throughput_rps': len(samples) / wall_seconds,
+                'p50_ms': common.percentile(samples, 0.50) * 1000,
+                'p95_ms': common.percentile(samples, 0.95) * 1000,
+                'p99_ms': common.percentile(samples, 0.99) * 1000,
+                'statements_per_request': sum(self.statements[endpoint]) / len(samples),
+            }
+        return endpoints
+
+
+def play(app, recorder, game, index, args):
+    client = app.test_client()
+    user_id = common.next_id()
+    recorder.call(client, 'post', '/api/register_user',
+                  json={'user_id': user_id, 'phone': '', 'name': f'bench{user_id}', 'username': f'bench{user_id}'})
+    common.fund(user_id, args.bet * 10)
+    if index == 0:
+        common.make_admin(user_id)
+        game['game_id'] = recorder.call(client, 'post', '/api/create_game',
+                                        json={'user_id': user_id, 'bet_amount': args.bet}).get_json()['game_id']
+        game['created'].set()
+    else:
+        game['created'].wait()
+        recorder.call(client, 'post', '/api/join_game',
+                      json={'user_id': user_id, 'game_id': game['game_id'], 'bet_amount': args.bet})
+    game_id = game['game_id']
+    game['joined'].wait()
+    recorder.call(client, 'post', '/api/select_number', json={'user_id': user_id, 'game_id': game_id, 'selected_number': index})
+    recorder.call(client, 'post', '/api/accept_card', json={'user_id': user_id, 'game_id': game_id})
+    game['ready'].wait()
+    if index == 0:
+        recorder.call(client, 'post', '/api/admin_actions',
+                      json={'user_id': user_id, 'action': 'start_game', 'game_id': game_id, 'bet_amount': args.bet})
+        game['started'].set()
+    game['started'].wait()
+
+    status_url = f'/api/game_status?game_id={game_id}&user_id={user_id}'
+    data = recorder.call(client, 'get', status_url).get_json()
+    draw_seq, etag = data['draw_seq'], None
+    deadline = time.monotonic() + args.timeout
+    while data['status'] != 'finished' and time.monotonic() < deadline:
+        if index == 0:
+            recorder.call(client, 'post', '/api/call_number', json={'user_id': user_id, 'game_id': game_id, 'force': True})
+        response = recorder.call(client, 'get', f'{status_url}&since={draw_seq}',
+                                 headers={'If-None-Match': etag} if etag else {})
+        etag = response.headers.get('ETag')
+        if response.status_code == 200:
+            data = response.get_json()
+            draw_seq = data['draw_seq']
+        if args.poll_interval:
+            time.sleep(args.poll_interval)
+    recorder.call(client, 'post', '/api/check_bingo', json={'user_id': user_id, 'game_id': game_id})
+
+
+def start_game_threads(app, recorder, args):
+    game = {
+        'created': threading.Event(),
+        'started': threading.Event(),
+        'joined': threading.Barrier(args.players),
+        'ready': threading.Barrier(args.players),
+    }
+    return [threading.Thread(target=play, args=(app, recorder, game, index, args)) for index in range(args.players)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=5)
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--bet', type=int, default=10)
+    parser.add_argument('--poll-interval', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=120.0, help='give up on a game after this many seconds')
+    parser.add_argument('--embedded', metavar='DATA_DIR', help='run against a pgserver instance in DATA_DIR')
+    parser.add_argument('--out', help='write the JSON report here')
+    parser.add_argument('--baseline', help='compare with an earlier JSON report')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    if args.embedded:
+        os.environ['DATABASE_URL'] = common.embedded_database_url(args.embedded)
+    app = common.load_app().app
+    import db
+
+    recorder = Recorder()
+    threads = []
+    for _ in range(args.games):
+        threads.extend(start_game_threads(app, recorder, args))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - start
+
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE datname = current_database()")
+        server_connections = cursor.fetchone()[0]
+    report = {
+        'config': {'games': args.games, 'players': args.players, 'bet': args.bet, 'poll_interval': args.poll_interval},
+        'wall_seconds': wall_seconds,
+        'endpoints': recorder.report(wall_seconds),
+        'pool': db.pool.stats(),
+        'server_connections': server_connections,
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+def compare(baseline, current, tolerance):
+    regressions = []
+    for endpoint, before in baseline['endpoints'].items():
+        after = current['endpoints'].get(endpoint)
+        if not after:
+            continue
+        for metric in ('p95_ms', 'statements_per_request'):
+            if after[metric] > before[metric] * (1 + tolerance) and after[metric] - before[metric] > 0.5:
+                regressions.append(f'{endpoint} {metric}: {before[metric]:.2f} -> {after[metric]:.2f}')
+    return regressions
+
+
+if __name__ == '__main__':
+    main()
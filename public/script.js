@@ -8,6 +8,13 @@ const playerInfo = document.getElementById('playerInfo');
 let gameId = null;
 let selectedNumber = null;
 let currentBet = null;
+let gameEvents = null;
+let gameStatusPoller = null;
+let calledNumbers = [];
+let drawSeq = 0;
+let gameVersion = 0;
+let cardLoaded = false;
+let pendingWithdrawalIds = [];
 
 // DOM Elements
 const welcomePage = document.getElementById('welcomePage');
@@ -36,10 +43,27 @@ document.getElementById('checkBalance').addEventListener('click', () => {
     showPage(document.getElementById('profilePage'));
 });
 
+// One /bootstrap call serves profile, wallet, referrals, active game and leaderboard head;
+// screens reuse it until it expires or an action that changes the wallet invalidates it.
+const USER_DATA_TTL_MS = 30000;
+let userDataCache = null;
+
+function getUserData() {
+    if (!userDataCache || Date.now() - userDataCache.fetchedAt > USER_DATA_TTL_MS) {
+        const request = fetch(`${API_URL}/bootstrap?user_id=${userId}`).then(response => response.json());
+        userDataCache = { fetchedAt: Date.now(), request };
+        request.catch(() => { if (userDataCache && userDataCache.request === request) userDataCache = null; });
+    }
+    return userDataCache.request;
+}
+
+function invalidateUserData() {
+    userDataCache = null;
+}
+
 async function checkRegistration() {
     try {
-        const response = await fetch(`${API_URL}/user_data?user_id=${userId}`);
-        const data = await response.json();
+        const data = await getUserData();
         if (data.error) {
             showPage(welcomePage);
         } else {
@@ -55,8 +79,7 @@ async function checkRegistration() {
 
 async function checkAdminStatus() {
     try {
-        const response = await fetch(`${API_URL}/user_data?user_id=${userId}`);
-        const data = await response.json();
+        const data = await getUserData();
         if (data.error) throw new Error(data.error);
         if (data.role === 'admin') {
             adminMenuBtn.style.display = 'block';
@@ -71,8 +94,7 @@ async function checkAdminStatus() {
 
 async function updatePlayerInfo() {
     try {
-        const response = await fetch(`${API_URL}/user_data?user_id=${userId}`);
-        const data = await response.json();
+        const data = await getUserData();
         if (data.error) throw new Error(data.error);
         const username = data.username || `User_${userId}`;
         playerInfo.textContent = `👤 ${username} | 💰 ${data.wallet} ETB`;
@@ -119,15 +141,28 @@ function updateCard(calledNumbers) {
     }
 }
 
+// After the first full response only draws past drawSeq are requested and the card is not resent;
+// unchanged polls are answered with 304 through the browser's ETag revalidation.
 function updateGameStatus() {
-    if (!gameId) return;
-    fetch(`${API_URL}/game_status?game_id=${gameId}&user_id=${userId}`)
+    if (!gameId) return Promise.resolve();
+    const delta = cardLoaded ? `&since=${drawSeq}` : '';
+    return fetch(`${API_URL}/game_status?game_id=${gameId}&user_id=${userId}${delta}`)
         .then(response => response.json())
         .then(data => {
-            gameStatus.textContent = `Status: ${data.status} | ${data.start_time ? new Date(data.start_time).toLocaleString() : 'Not Started'} - ${data.end_time ? new Date(data.end_time).toLocaleString() : 'Not Ended'} | Prize: ${data.prize_amount} ETB | Called: ${data.numbers_called.length} | Winner: ${data.winner_id || 'None'} | Players: ${data.players.length}`;
-            updateCard(data.numbers_called);
-            calledNumbersDiv.textContent = `Called Numbers: ${data.numbers_called.join(', ')}`;
-            if (data.card_numbers) generateBingoCard(data.card_numbers);
+            if (data.since === undefined) {
+                calledNumbers = data.numbers_called;
+            } else if (data.draw_seq > drawSeq) {
+                calledNumbers = calledNumbers.concat(data.numbers_called.slice(drawSeq - data.draw_seq));
+            }
+            drawSeq = Math.max(drawSeq, data.draw_seq);
+            gameVersion = Math.max(gameVersion, data.version);
+            if (data.card_numbers) {
+                generateBingoCard(data.card_numbers);
+                cardLoaded = data.card_numbers.length > 0;
+            }
+            gameStatus.textContent = `Status: ${data.status} | ${data.start_time ? new Date(data.start_time).toLocaleString() : 'Not Started'} - ${data.end_time ? new Date(data.end_time).toLocaleString() : 'Not Ended'} | Prize: ${data.prize_amount} ETB | Called: ${calledNumbers.length} | Winner: ${data.winner_id || 'None'} | Players: ${data.players.length}`;
+            updateCard(calledNumbers);
+            calledNumbersDiv.textContent = `Called Numbers: ${calledNumbers.join(', ')}`;
             const inactiveNumbers = document.getElementById('inactiveNumbers');
             if (inactiveNumbers) inactiveNumbers.innerHTML = data.selected_numbers.map(n => `<span class="inactive">${n}</span>`).join(', ');
             if (data.status === 'finished' && data.winner_id) {
@@ -136,14 +171,68 @@ function updateGameStatus() {
         });
 }
 
+// Game updates are pushed over Server-Sent Events; polling is only the fallback. The stream
+// starts after gameVersion, so events already reflected in the last game_status are not replayed.
+function subscribeGameEvents() {
+    stopGameUpdates();
+    if (!window.EventSource) {
+        gameStatusPoller = setInterval(updateGameStatus, 5000);
+        return;
+    }
+    let failures = 0;
+    gameEvents = new EventSource(`${API_URL}/games/${gameId}/events?since=${gameVersion}`);
+    // The server ends each stream after a while; the browser reconnects with Last-Event-ID.
+    gameEvents.onopen = () => {
+        failures = 0;
+    };
+    gameEvents.addEventListener('number_called', event => {
+        failures = 0;
+        const data = JSON.parse(event.data);
+        if (data.draw_seq <= drawSeq) return;
+        if (data.draw_seq > drawSeq + 1) {
+            updateGameStatus();
+            return;
+        }
+        calledNumbers.push(String(data.number));
+        drawSeq = data.draw_seq;
+        updateCard(calledNumbers);
+        calledNumbersDiv.textContent = `Called Numbers: ${calledNumbers.join(', ')}`;
+    });
+    ['joined', 'number_selected', 'countdown', 'started'].forEach(type => {
+        gameEvents.addEventListener(type, () => {
+            failures = 0;
+            updateGameStatus();
+        });
+    });
+    ['winner', 'finished'].forEach(type => {
+        gameEvents.addEventListener(type, () => {
+            invalidateUserData();
+            stopGameUpdates();
+            updateGameStatus();
+        });
+    });
+    gameEvents.onerror = () => {
+        if (++failures >= 3) {
+            stopGameUpdates();
+            gameStatusPoller = setInterval(updateGameStatus, 5000);
+        }
+    };
+}
+
+function stopGameUpdates() {
+    if (gameEvents) gameEvents.close();
+    if (gameStatusPoller) clearInterval(gameStatusPoller);
+    gameEvents = null;
+    gameStatusPoller = null;
+}
+
 returnToBotBtn.addEventListener('click', () => {
     tg.close();
 });
 
 checkBalanceBtn.addEventListener('click', async () => {
     try {
-        const response = await fetch(`${API_URL}/user_data?user_id=${userId}`);
-        const data = await response.json();
+        const data = await getUserData();
         if (data.error) throw new Error(data.error);
         contentDiv.style.display = 'block';
         gameArea.style.display = 'none';
@@ -162,8 +251,7 @@ checkBalanceBtn.addEventListener('click', async () => {
 
 withdrawMoneyBtn.addEventListener('click', async () => {
     try {
-        const response = await fetch(`${API_URL}/user_data?user_id=${userId}`);
-        const data = await response.json();
+        const data = await getUserData();
         if (data.error) throw new Error(data.error);
         contentDiv.style.display = 'block';
         gameArea.style.display = 'none';
@@ -197,6 +285,7 @@ function requestWithdrawal() {
     })
     .then(response => response.json())
     .then(data => {
+        invalidateUserData();
         document.getElementById('withdrawMessage').textContent = data.status === 'requested' ? `✅ ጠይቅ ተሳክቷል (ID: ${data.withdraw_id})` : `❌ ${data.reason}`;
         updatePlayerInfo();
     })
@@ -207,8 +296,7 @@ function requestWithdrawal() {
 
 topLeadersBtn.addEventListener('click', async () => {
     try {
-        const response = await fetch(`${API_URL}/leaderboard`);
-        const data = await response.json();
+        const data = (await getUserData()).leaderboard || [];
         contentDiv.style.display = 'block';
         gameArea.style.display = 'none';
         let tableHtml = `
@@ -231,8 +319,7 @@ topLeadersBtn.addEventListener('click', async () => {
 
 inviteFriendsBtn.addEventListener('click', async () => {
     try {
-        const response = await fetch(`${API_URL}/user_data?user_id=${userId}`);
-        const data = await response.json();
+        const data = await getUserData();
         if (data.error) throw new Error(data.error);
         const botUsername = tg.initDataUnsafe?.botUsername || 'ZebiBingoBot';
         const referralLink = `https://t.me/${botUsername}?start=ref_${userId}`;
@@ -318,8 +405,7 @@ updatePlayerInfo();
 checkAdminStatus();
 adminMenuBtn.addEventListener('click', async () => {
     try {
-        const response = await fetch(`${API_URL}/user_data?user_id=${userId}`);
-        const data = await response.json();
+        const data = await getUserData();
         if (data.error || data.role !== 'admin') {
             contentDiv.style.display = 'block';
             gameArea.style.display = 'none';
@@ -328,6 +414,7 @@ adminMenuBtn.addEventListener('click', async () => {
         }
         const withdrawalsResponse = await fetch(`${API_URL}/pending_withdrawals?user_id=${userId}`);
         const withdrawalsData = await withdrawalsResponse.json();
+        pendingWithdrawalIds = withdrawalsData.withdrawals.map(w => w.withdraw_id);
         contentDiv.style.display = 'block';
         gameArea.style.display = 'none';
         contentDiv.innerHTML = `
@@ -344,10 +431,14 @@ adminMenuBtn.addEventListener('click', async () => {
                 <h3>የፋይናንስ ማረጋገጫ</h3>
                 <input id="txId" placeholder="የፋይናንስ መረጃ ID" />
                 <button onclick="adminAction('verify_payment')">✅ የፋይናንስ ማረጋገጫጫ</button>
+                <textarea id="txIds" placeholder="tx IDs, one per line"></textarea>
+                <button onclick="bulkVerifyPayments()">✅ Verify all</button>
                 <h3>ተጠቃሚ አስተዳደር</h3>
                 <input id="userIdToKick" placeholder="የሚባረረው ተጠቃሚ ID" />
                 <button onclick="adminAction('kick_user')">🚪 ተጠቃሚን አስወጣ</button>
                 <h3>Pending Withdrawals</h3>
+                <button onclick="bulkManageWithdrawals('approve')">✅ Approve all shown</button>
+                <button onclick="bulkManageWithdrawals('reject')">❌ Reject all shown</button>
                 ${withdrawalsData.withdrawals.map(w => `
                     <div>
                         ID: ${w.withdraw_id} | User: ${w.user_id} | Amount: ${w.amount} ETB | Method: ${w.method} | Time: ${new Date(w.request_time).toLocaleString()}
@@ -395,23 +486,39 @@ joinGameBtn.addEventListener('click', async () => {
         gameArea.style.display = 'none';
         contentDiv.innerHTML = `
             <h2>👥 ጨዋታ ይቀላቀሉ</h2>
-            <button onclick="joinGame(10)">10 ETB</button>
-            <button onclick="joinGame(50)">50 ETB</button>
-            <button onclick="joinGame(100)">100 ETB</button>
-            <button onclick="joinGame(200)">200 ETB</button>
+            <button id="tier_10" onclick="joinGame(10)">10 ETB</button>
+            <button id="tier_50" onclick="joinGame(50)">50 ETB</button>
+            <button id="tier_100" onclick="joinGame(100)">100 ETB</button>
+            <button id="tier_200" onclick="joinGame(200)">200 ETB</button>
         `;
+        showLobbyCounts();
     }
 });
 
+// Labels each bet tier with the number of players already waiting in it.
+async function showLobbyCounts() {
+    try {
+        const response = await fetch(`${API_URL}/lobby`);
+        const data = await response.json();
+        data.tiers.forEach(tier => {
+            const button = document.getElementById(`tier_${tier.bet_amount}`);
+            if (button && tier.waiting_players) button.textContent = `${tier.bet_amount} ETB (👥 ${tier.waiting_players})`;
+        });
+    } catch (error) {
+        // The tier buttons work without the counts.
+    }
+}
+
 async function joinGame(betAmount) {
     try {
-        const response = await fetch(`${API_URL}/create_game`, {
+        const response = await fetch(`${API_URL}/lobby/join`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ user_id: userId, bet_amount: betAmount })
         });
         const data = await response.json();
         if (data.status === 'failed') throw new Error(data.reason);
+        invalidateUserData();
         gameId = data.game_id;
         currentBet = data.bet_amount;
         contentDiv.style.display = 'none';
@@ -482,8 +589,11 @@ function acceptCard() {
             document.getElementById('previewCard').remove();
             document.querySelectorAll('#gameArea button').forEach(btn => btn.remove());
             generateBingoCard(data.card_numbers);
-            updateGameStatus();
-            setInterval(updateGameStatus, 5000);
+            calledNumbers = [];
+            drawSeq = 0;
+            gameVersion = 0;
+            cardLoaded = false;
+            updateGameStatus().then(subscribeGameEvents, subscribeGameEvents);
         }
     });
 }
@@ -500,6 +610,7 @@ function showPostWinOptions(betAmount) {
         <button onclick="continuePlay(${betAmount})">Continue Play</button>
         <button onclick="backToBetSelection()">Back to Bet Selection</button>
     `;
+    stopGameUpdates();
     gameId = null;
 }
 
@@ -552,6 +663,7 @@ bingoBtn.addEventListener('click', async () => {
             body: JSON.stringify({ user_id: userId, game_id: gameId })
         });
         const data = await response.json();
+        invalidateUserData();
         gameStatus.textContent = data.message;
         if (data.kicked) {
             tg.close();
@@ -585,6 +697,7 @@ async function adminAction(action) {
             body: JSON.stringify(payload)
         });
         const data = await response.json();
+        invalidateUserData();
         contentDiv.innerHTML = `<p>${data.status === 'verified' ? `✅ ${data.amount} ETB ለ${data.user_id} ተጠበቃ!` : `✅ ${data.status}!`}</p>`;
         if (data.prize_amount) {
             contentDiv.innerHTML += `<p>የጨዋታ ዕምቢታ: ${data.prize_amount} ETB</p>`;
@@ -595,6 +708,38 @@ async function adminAction(action) {
     }
 }
 
+async function bulkVerifyPayments() {
+    const txIds = document.getElementById('txIds').value.split(/[\s,]+/).filter(Boolean);
+    if (!txIds.length) return;
+    await bulkAdminRequest('verify_payments', { tx_ids: txIds });
+}
+
+async function bulkManageWithdrawals(actionType) {
+    if (!pendingWithdrawalIds.length) return;
+    await bulkAdminRequest('withdrawals', { withdraw_ids: pendingWithdrawalIds, action_type: actionType });
+}
+
+// Batch endpoints answer with one result per id; failures are listed, successes counted.
+async function bulkAdminRequest(endpoint, payload) {
+    try {
+        const response = await fetch(`${API_URL}/admin/${endpoint}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ user_id: userId, ...payload })
+        });
+        const data = await response.json();
+        if (!data.results) throw new Error(data.reason || data.status);
+        invalidateUserData();
+        const failed = data.results.filter(r => r.status === 'failed');
+        alert(`✅ ${data.results.length - failed.length} done` +
+              (failed.length ? `\n❌ ${failed.map(r => `${r.tx_id || r.withdraw_id}: ${r.reason}`).join('\n')}` : ''));
+        adminMenuBtn.click();
+        updatePlayerInfo();
+    } catch (error) {
+        contentDiv.innerHTML = `<p>አንድነት ችግር: ${error.message}</p>`;
+    }
+}
+
 function manageWithdrawal(withdrawId, actionType) {
     const adminNote = document.getElementById(`note_${withdrawId}`).value;
     fetch(`${API_URL}/admin_actions`, {
@@ -604,6 +749,7 @@ function manageWithdrawal(withdrawId, actionType) {
     })
     .then(response => response.json())
     .then(data => {
+        invalidateUserData();
         contentDiv.innerHTML = `<p>${data.status === 'approved' ? `✅ ${data.amount} ETB withdrawn for User ${data.user_id}` : `❌ ${data.status}`}</p>`;
         adminMenuBtn.click();
         updatePlayerInfo();
@@ -0,0 +1,76 @@
+"""The bitmask evaluator in api/bingo.py against a naive grid check, for every pattern in PATTERNS."""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import bingo  # noqa: E402
+import cards  # noqa: E402
+
+SIZE = 5
+NAIVE_PATTERNS = {
+    'lines': ([[(row, col) for col in range(SIZE)] for row in range(SIZE)] +
+              [[(row, col) for row in range(SIZE)] for col in range(SIZE)] +
+              [[(i, i) for i in range(SIZE)], [(i, SIZE - 1 - i) for i in range(SIZE)]]),
+    'corners': [[(0, 0), (0, SIZE - 1), (SIZE - 1, 0), (SIZE - 1, SIZE - 1)]],
+    'full_house': [[(row, col) for row in range(SIZE) for col in range(SIZE)]],
+}
+CASES = 3000
+
+
+def naive_grid(card_numbers, called_numbers, free_cell=bingo.FREE_CELL):
+    called = set(called_numbers)
+    return [[card_numbers[row * SIZE + col] in called or row * SIZE + col == free_cell for col in range(SIZE)]
+            for row in range(SIZE)]
+
+
+def naive_winning(grid, patterns):
+    return [cells for name in patterns for cells in NAIVE_PATTERNS[name] if all(grid[row][col] for row, col in cells)]
+
+
+def as_mask(cells):
+    return sum(1 << (row * SIZE + col) for row, col in cells)
+
+
+def random_cases(seed):
+    rng = random.Random(seed)
+    for _ in range(CASES):
+        card = sorted(rng.sample(range(101), bingo.CELL_COUNT))
+        # Mostly heavy draws, so the rarer patterns (corners, full house) actually occur.
+        called = rng.sample(range(101), rng.choice([rng.randint(0, 101), rng.randint(80, 101), 101]))
+        yield card, called
+
+
+def test_patterns_match_naive_definitions():
+    assert set(bingo.PATTERNS) == set(NAIVE_PATTERNS)
+    for name, masks in bingo.PATTERNS.items():
+        assert sorted(masks) == sorted(as_mask(cells) for cells in NAIVE_PATTERNS[name])
+
+
+@pytest.mark.parametrize('free_cell', [bingo.FREE_CELL, None])
+def test_mark_mask(free_cell):
+    for card, called in random_cases(1):
+        grid = naive_grid(card, called, free_cell)
+        expected = as_mask((row, col) for row in range(SIZE) for col in range(SIZE) if grid[row][col])
+        assert bingo.mark_mask(card, bingo.called_bitmap(called), free_cell) == expected
+
+
+@pytest.mark.parametrize('patterns', [(name,) for name in bingo.PATTERNS] + [tuple(bingo.PATTERNS)])
+def test_evaluators_agree_with_naive(patterns):
+    seen_win = False
+    for card, called in random_cases(2):
+        mask = bingo.mark_mask(card, bingo.called_bitmap(called))
+        expected = naive_winning(naive_grid(card, called), patterns)
+        assert sorted(bingo.winning_masks(mask, patterns)) == sorted(as_mask(cells) for cells in expected)
+        assert bingo.is_winning_mask(mask, patterns) == bool(expected)
+        assert bingo.has_bingo(card, called, patterns) == bool(expected)
+        seen_win |= bool(expected)
+    assert seen_win
+
+
+def test_card_bitmap():
+    for number in range(cards.CARD_COUNT):
+        assert cards.card_bitmap(number) == sum(1 << n for n in set(cards.card(number)))
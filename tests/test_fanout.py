@@ -0,0 +1,243 @@
+"""The live game snapshots and recent-event buffers the fan-out listener keeps, and one LISTEN/NOTIFY round trip."""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import events  # noqa: E402
+import fanout  # noqa: E402
+
+GAME = 'g1'
+
+
+def snapshot(version=3, players=(1, 2), selections=None, numbers=()):
+    return fanout.GameSnapshot(version, 'waiting', None, None, 0, None, 10, None, tuple(players),
+                               dict(selections or {}), tuple(numbers))
+
+
+def live_cache(*snapshots):
+    cache = fanout.SnapshotCache()
+    cache.set_live(True)
+    for game_id, game in snapshots:
+        cache.store(game_id, game, cache.lookup(game_id)[1])
+    return cache
+
+
+def test_apply_joined():
+    after = snapshot().apply(4, 'joined', {'user_id': '3'})
+    assert (after.version, after.players) == (4, (1, 2, 3))
+    # Joining twice (a replayed event) does not list the player twice.
+    assert snapshot().apply(4, 'joined', {'user_id': 2}).players == (1, 2)
+
+
+def test_apply_number_selected():
+    before = snapshot(selections={1: 5})
+    after = before.apply(4, 'number_selected', {'user_id': '2', 'selected_number': 17})
+    assert (after.version, after.selections) == (4, {1: 5, 2: 17})
+    assert before.selections == {1: 5}
+    assert before.apply(4, 'number_selected', {'selected_number': 17}) is None
+
+
+def test_apply_countdown():
+    after = snapshot().apply(4, 'countdown', {'countdown_start': '2026-01-02T03:04:05'})
+    assert after.countdown_start == datetime(2026, 1, 2, 3, 4, 5)
+
+
+def test_apply_number_called():
+    after = snapshot(numbers=(7, 9)).apply(4, 'number_called', {'draw_seq': 3, 'number': 42})
+    assert (after.version, after.numbers) == (4, (7, 9, 42))
+    # A draw other than the next one means the snapshot missed one.
+    assert snapshot(numbers=(7, 9)).apply(4, 'number_called', {'draw_seq': 4, 'number': 42}) is None
+
+
+@pytest.mark.parametrize('seq, event_type, payload', [
+    (5, 'joined', {'user_id': 3}),  # skips seq 4
+    (3, 'joined', {'user_id': 3}),  # already applied
+    (4, 'joined', None),  # payload too large to send
+    (4, 'started', {}),
+    (4, 'winner', {'winner_id': 1}),
+])
+def test_apply_cannot_update(seq, event_type, payload):
+    assert snapshot().apply(seq, event_type, payload) is None
+
+
+def test_cache_applies_events_in_order():
+    cache = live_cache((GAME, snapshot()))
+    cache.apply(GAME, 4, 'joined', {'user_id': 3})
+    cache.apply(GAME, 5, 'number_selected', {'user_id': 3, 'selected_number': 8})
+    cached, generation = cache.lookup(GAME)
+    assert (cached.version, cached.players, cached.selections, generation) == (5, (1, 2, 3), {3: 8}, None)
+    # Events at or below the cached version change nothing.
+    cache.apply(GAME, 5, 'started', {})
+    assert cache.lookup(GAME)[0] is cached
+
+
+@pytest.mark.parametrize('seq, event_type, payload', [
+    (5, 'joined', {'user_id': 3}),
+    (4, 'joined', None),
+    (4, 'started', {}),
+])
+def test_cache_discards_on_gap_or_unknown_event(seq, event_type, payload):
+    cache = live_cache((GAME, snapshot()), ('g2', snapshot()))
+    cache.apply(GAME, seq, event_type, payload)
+    assert cache.lookup(GAME)[0] is None
+    assert cache.lookup('g2')[0] is not None
+
+
+def test_store_requires_live_listener():
+    cache = fanout.SnapshotCache()
+    cache.store(GAME, snapshot(), cache.lookup(GAME)[1])
+    assert cache.lookup(GAME)[0] is None and len(cache) == 0
+
+
+def test_store_skips_snapshot_older_than_notified_event():
+    cache = live_cache()
+    generation = cache.lookup(GAME)[1]
+    cache.apply(GAME, 4, 'joined', {'user_id': 3})  # arrives while version 3 is being loaded
+    cache.store(GAME, snapshot(3), generation)
+    assert cache.lookup(GAME)[0] is None
+    cache.store(GAME, snapshot(4), generation)
+    assert cache.lookup(GAME)[0].version == 4
+
+
+def test_store_skips_snapshot_loaded_before_reconnect():
+    cache = live_cache()
+    generation = cache.lookup(GAME)[1]
+    cache.set_live(False)
+    cache.set_live(True)
+    cache.store(GAME, snapshot(), generation)
+    assert cache.lookup(GAME)[0] is None
+
+
+def test_set_live_and_discard_clear_snapshots():
+    cache = live_cache((GAME, snapshot()), ('g2', snapshot()))
+    cache.discard(GAME)
+    assert cache.lookup(GAME)[0] is None and len(cache) == 1
+    cache.set_live(False)
+    assert len(cache) == 0 and not cache.live
+
+
+def test_store_evicts_least_recently_used():
+    cache = fanout.SnapshotCache(max_games=2)
+    cache.set_live(True)
+    for game_id in ('a', 'b'):
+        cache.store(game_id, snapshot(), cache.lookup(game_id)[1])
+    cache.lookup('a')
+    cache.store('c', snapshot(), cache.lookup('c')[1])
+    assert [game_id for game_id in 'abc' if cache.lookup(game_id)[0]] == ['a', 'c']
+
+
+def live_broker(max_games=events.RECENT_MAX_GAMES):
+    broker = events.GameEventBroker(max_games)
+    broker.set_live(True)
+    return broker
+
+
+def test_broker_keeps_gap_free_events():
+    broker = live_broker()
+    for seq in (1, 2, 3):
+        broker.deliver(GAME, seq, 'joined', {'user_id': seq})
+    assert broker.recent(GAME, 0) == [(seq, 'joined', {'user_id': seq}) for seq in (1, 2, 3)]
+    assert broker.recent(GAME, 2) == [(3, 'joined', {'user_id': 3})]
+    assert broker.recent(GAME, 3) == []
+    assert broker.version(GAME) == 3
+
+
+def test_broker_ignores_replayed_events():
+    broker = live_broker()
+    broker.deliver(GAME, 1, 'joined', {'user_id': 1})
+    broker.deliver(GAME, 2, 'joined', {'user_id': 2})
+    broker.deliver(GAME, 1, 'joined', {'user_id': 9})
+    assert broker.recent(GAME, 0) == [(1, 'joined', {'user_id': 1}), (2, 'joined', {'user_id': 2})]
+    assert broker.version(GAME) == 2
+
+
+def test_broker_restarts_after_gap():
+    broker = live_broker()
+    broker.deliver(GAME, 1, 'joined', {'user_id': 1})
+    broker.deliver(GAME, 3, 'joined', {'user_id': 3})
+    # Event 2 was missed, so anything from before it has to come from the log.
+    assert broker.recent(GAME, 0) is None
+    assert broker.recent(GAME, 1) is None
+    assert broker.recent(GAME, 2) == [(3, 'joined', {'user_id': 3})]
+
+
+def test_broker_oversized_payload_leaves_gap():
+    broker = live_broker()
+    broker.deliver(GAME, 1, 'joined', {'user_id': 1})
+    broker.deliver(GAME, 2, 'number_called', None)
+    assert broker.recent(GAME, 0) is None and broker.recent(GAME, 1) is None
+    # Still wakes the streams, which then read event 2 from the log.
+    assert broker.version(GAME) == 2
+    broker.deliver(GAME, 3, 'joined', {'user_id': 3})
+    assert broker.recent(GAME, 1) is None
+    assert broker.recent(GAME, 2) == [(3, 'joined', {'user_id': 3})]
+
+
+def test_broker_recent_only_while_live():
+    broker = live_broker()
+    broker.deliver(GAME, 1, 'joined', {'user_id': 1})
+    broker.set_live(False)
+    assert broker.recent(GAME, 0) is None
+    broker.set_live(True)
+    assert broker.recent(GAME, 0) is None
+
+
+def test_broker_evicts_oldest_game():
+    broker = live_broker(max_games=2)
+    for game_id in ('a', 'b', 'c'):
+        broker.deliver(game_id, 1, 'joined', {'user_id': 1})
+    assert [game_id for game_id in 'abc' if broker.recent(game_id, 0)] == ['b', 'c']
+
+
+def test_oversized_notify_drops_payload():
+    if not events.NOTIFY_ENABLED:
+        pytest.skip('GAME_FANOUT is off')
+    payload = {'numbers': list(range(2000))}
+    query, params = events.insert_event(GAME, 1, 'number_called', payload)
+    assert query == events.INSERT_AND_NOTIFY_QUERY
+    assert len(params[-1].encode()) <= events.NOTIFY_MAX_BYTES and 'payload' not in params[-1]
+    assert params[3] == json.dumps(payload)
+
+
+@pytest.mark.skipif(not os.environ.get('DATABASE_URL'), reason='needs DATABASE_URL')
+def test_listen_notify_round_trip():
+    import db
+    import migrations
+    migrations.migrate()
+    game_id = f'test-{uuid.uuid4()}'
+    with db.connection() as conn:
+        conn.cursor().execute("INSERT INTO games (game_id, status, bet_amount) VALUES (%s, 'waiting', 10)", (game_id,))
+    delivered = threading.Event()
+    fanout.subscribe(lambda changed: changed == game_id and delivered.set())
+    fanout.listener.start()
+    try:
+        deadline = time.monotonic() + 10
+        while not fanout.snapshots.live and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert fanout.snapshots.live
+
+        def load():
+            with db.connection() as conn:
+                return fanout.GameSnapshot.load(conn.cursor(), game_id)
+        assert fanout.snapshots.get_or_load(game_id, load).version == 0
+
+        with db.connection() as conn:
+            assert events.publish(conn.cursor(), game_id, 'joined', {'user_id': 7}) == 1
+        assert delivered.wait(10)
+        cached, _ = fanout.snapshots.lookup(game_id)
+        assert (cached.version, cached.players) == (1, (7,))
+        assert events.broker.recent(game_id, 0) == [(1, 'joined', {'user_id': 7})]
+    finally:
+        fanout.listener.stop()
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM game_events WHERE game_id = %s", (game_id,))
+            cursor.execute("DELETE FROM games WHERE game_id = %s", (game_id,))